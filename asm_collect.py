@@ -20,50 +20,47 @@
 from __future__ import print_function
 
 import argparse
+import copy
 import os
 import sys
 
+from asmtest.asm_collect import ConfigDetection
+from asmtest.asm_collect import EquivalentConfigs
+from asmtest.asm_collect import TestSource
 from asmtest.asm_collect import flatten_tests_by_cat
+from asmtest.asm_collect import generate_test_list
+from asmtest.asm_collect import get_compiler_id
+from asmtest.asm_collect import get_config_id
 from asmtest.asm_collect import get_name_to_insn_set_map
 from asmtest.asm_collect import get_output_location_for_settings
 from asmtest.asm_collect import parse_insn_sets
 from asmtest.asm_collect import perform_all_tests
+from asmtest.asm_collect import print_equivalent_config
+from asmtest.asm_collect import read_results
+from asmtest.asm_collect import test_sort_key
 from asmtest.asm_collect import write_results
 from asmtest.compiler import detect_compiler
-from asmtest.compiler import detect_supported_insn_sets
-from asmtest.test_desc import Test
-from asmtest.test_desc import TestGenerator
+from asmtest.detection_cache import DetectionCache
+from asmtest.detection_cache import get_default_detection_cache_path
+from asmtest.distributed import DEFAULT_COORDINATOR_JOBS
+from asmtest.distributed import DistributedExecutor
+from asmtest.distributed import parse_address
+from asmtest.distributed import run_worker
+from asmtest.fingerprint import get_libsimdpp_fingerprint
+from asmtest.insn_set import get_all_insn_set_configs
+from asmtest.postprocess import get_insn_totals
+from asmtest.resources import parse_memory_size
+from asmtest.result_cache import create_result_cache
+from asmtest.results_db import QUERY_COLUMNS
+from asmtest.results_db import ResultsDb
+from asmtest.scheduling import CompileTimeHistory
 from asmtest.test_list import get_all_tests
 
 
-def generate_test_list(category_to_tests, categories):
-    ret = {}
-    index = 0
-
-    if categories is None:
-        tests = category_to_tests
-    else:
-        tests = {}
-        for cat in categories:
-            if cat not in category_to_tests:
-                raise Exception(f'Category {cat} does not exist')
-            tests[cat] = category_to_tests[cat]
-
-    for category, test_gen_list in tests.items():
-        test_list = []
-        for t in test_gen_list:
-            if isinstance(t, TestGenerator):
-                for d in t.generate():
-                    test_list.append(Test(d, "id" + str(index)))
-                    index += 1
-            else:
-                test_list.append(Test(t, "id" + str(index)))
-                index += 1
-        ret[category] = test_list
-    return ret
-
-
-def write_results_to_files(output_root, compiler, test_and_config_list):
+def write_results_to_files(output_root, compiler, test_and_config_list,
+                           results_db=None):
+    # If results_db is set, the results are also stored in the given
+    # ResultsDb
     for config, tests_by_cat in test_and_config_list:
         for cat in sorted(tests_by_cat.keys()):
             test_list = tests_by_cat[cat]
@@ -77,8 +74,245 @@ def write_results_to_files(output_root, compiler, test_and_config_list):
             with open(out_path, 'w') as out_f:
                 write_results(test_list, out_f)
 
+            if results_db is not None:
+                results_db.put_results(get_compiler_id(compiler),
+                                       compiler.target_arch or 'unknown',
+                                       get_config_id(config), cat, test_list)
+    if results_db is not None:
+        results_db.commit()
+
+
+def apply_existing_results(output_root, compiler, test_and_config_list):
+    ''' Reads results written by a previous invocation of
+        write_results_to_files and copies instruction counts to matching tests
+        in test_and_config_list. Tests are matched by code, vector size and
+        types. Returns a test and config list containing only the tests that
+        didn't have a successful result and still need to be compiled.
+    '''
+    ret = []
+    for config, tests_by_cat in test_and_config_list:
+        missing_tests_by_cat = {}
+        for cat in sorted(tests_by_cat.keys()):
+            test_list = tests_by_cat[cat]
+
+            rel_path = get_output_location_for_settings(compiler, config, cat)
+            out_path = os.path.join(output_root, rel_path)
+
+            existing_insns = {}
+            if os.path.isfile(out_path):
+                with open(out_path, 'r') as in_f:
+                    for test in read_results(in_f):
+                        if test.insns is not None:
+                            existing_insns[test_sort_key(test)] = test.insns
+
+            missing_tests = []
+            for test in test_list:
+                insns = existing_insns.get(test_sort_key(test))
+                if insns is not None:
+                    test.insns = copy.deepcopy(insns)
+                else:
+                    missing_tests.append(test)
+
+            if len(missing_tests) > 0:
+                missing_tests_by_cat[cat] = missing_tests
+        ret.append((config, missing_tests_by_cat))
+    return ret
+
+
+def check_libsimdpp_path(libsimdpp_path):
+    if not os.path.isdir(libsimdpp_path):
+        raise Exception(f'libsimdpp path {libsimdpp_path} does not exist')
+
+    if not os.path.isfile(os.path.join(libsimdpp_path, 'simdpp/simd.h')):
+        raise Exception(f'Invalid libsimdpp install at {libsimdpp_path}')
+
+
+def create_cache_from_args(args, compiler, libsimdpp_path):
+    cache_dir = None
+    if args.cache_dir is not None:
+        cache_dir = os.path.abspath(args.cache_dir)
+    return create_result_cache(compiler, libsimdpp_path, cache_dir=cache_dir,
+                               remote_url=args.remote_cache)
+
+
+def add_detection_cache_arguments(parser):
+    parser.add_argument(
+        '--detection_cache', type=str, default=None,
+        help='Path to a file storing the detected compiler and the ' +
+        'instruction sets it supports. Detection is skipped if the ' +
+        'compiler binary and libsimdpp headers have not changed since the ' +
+        'file has been written. By default ' +
+        get_default_detection_cache_path())
+    parser.add_argument(
+        '--no_detection_cache', action='store_true', default=False,
+        help='If set, the compiler and the supported instruction sets are ' +
+        'always detected and the detection cache is not updated.')
+
+
+def load_detection_cache(args):
+    if args.no_detection_cache:
+        return None
+    return DetectionCache.load(args.detection_cache or
+                               get_default_detection_cache_path())
+
+
+def detect_compiler_with_cache(cxx, detection_cache):
+    compiler = None
+    if detection_cache is not None:
+        compiler = detection_cache.get_compiler(cxx)
+    if compiler is None:
+        compiler = detect_compiler(cxx)
+        if compiler is None:
+            print('Could not detect compiler')
+            sys.exit(1)
+        if detection_cache is not None:
+            detection_cache.put_compiler(cxx, compiler)
+    return compiler
+
+
+def worker_main(argv):
+    parser = argparse.ArgumentParser(
+        prog='asm_collect worker',
+        description='Compiles tests on behalf of asm_collect started with ' +
+        '--listen on another host. The compiler version and libsimdpp ' +
+        'headers must be identical to those used by the coordinator.')
+    parser.add_argument(
+        'address', type=str,
+        help='The address of the coordinator in host:port form.')
+    parser.add_argument(
+        'cxx', type=str,
+        help='Path to the compiler or CMake generator name.')
+    parser.add_argument(
+        'libsimdpp', type=str,
+        help='Path to the libsimdpp library')
+    parser.add_argument(
+        '--jobs', '-j', type=int, default=None,
+        help='The maximum number of compilers to run at once. By default ' +
+        'one more than the number of CPUs available to the process.')
+    parser.add_argument(
+        '--cache_dir', type=str, default=None,
+        help='If this option is given, instruction counts of compiled tests ' +
+        'are cached in the given directory. See the same option of ' +
+        'asm_collect.')
+    parser.add_argument(
+        '--remote_cache', type=str, default=None,
+        help='The URL of a shared result cache. See the same option of ' +
+        'asm_collect.')
+    parser.add_argument(
+        '--connect_timeout', type=float, default=60,
+        help='The number of seconds to keep retrying to connect to the ' +
+        'coordinator.')
+    add_detection_cache_arguments(parser)
+
+    args = parser.parse_args(argv)
+
+    detection_cache = load_detection_cache(args)
+    compiler = detect_compiler_with_cache(args.cxx, detection_cache)
+
+    libsimdpp_path = os.path.abspath(args.libsimdpp)
+    check_libsimdpp_path(libsimdpp_path)
+
+    cache = create_cache_from_args(args, compiler, libsimdpp_path)
+
+    if detection_cache is not None:
+        detection_cache.save()
+
+    run_worker(parse_address(args.address), libsimdpp_path, compiler,
+               jobs=args.jobs, cache=cache,
+               retry_seconds=args.connect_timeout)
+
+
+def query_main(argv):
+    parser = argparse.ArgumentParser(
+        prog='asm_collect query',
+        description='Looks up and aggregates the results stored by ' +
+        'asm_collect via --results_db. The filters accept glob patterns, ' +
+        'e.g. --type "uint8<*>".')
+    parser.add_argument(
+        'results_db', type=str,
+        help='Path to the results database')
+    for column in QUERY_COLUMNS:
+        parser.add_argument(
+            f'--{column}', type=str, default=None,
+            help=f'Only include the results whose {column} matches the ' +
+            'given pattern')
+    parser.add_argument(
+        '--type', type=str, default=None,
+        help='Only include the results of tests that have at least one of ' +
+        'the vr, va, vb and vc types matching the given pattern')
+    parser.add_argument(
+        '--insn', type=str, default=None,
+        help='If set, counts the given instruction instead of all ' +
+        'instructions')
+    parser.add_argument(
+        '--group_by', type=str, default=None,
+        help='Comma-separated list of columns to aggregate the results ' +
+        f'by. Allowed values: {", ".join(QUERY_COLUMNS)}. If not set, ' +
+        'each matching test is printed.')
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.results_db):
+        print(f'Results database {args.results_db} does not exist')
+        sys.exit(1)
+
+    filters = {column: getattr(args, column) for column in QUERY_COLUMNS
+               if getattr(args, column) is not None}
+    group_by = None
+    if args.group_by is not None:
+        group_by = args.group_by.split(',')
+        unknown_columns = [c for c in group_by if c not in QUERY_COLUMNS]
+        if len(unknown_columns) > 0:
+            print(f'Unknown columns: {", ".join(unknown_columns)}')
+            sys.exit(1)
+
+    results_db = ResultsDb.open(args.results_db)
+    try:
+        columns, rows = results_db.query(filters, args.type, args.insn,
+                                         group_by)
+    finally:
+        results_db.close()
+
+    print('\t'.join(columns))
+    for row in rows:
+        print('\t'.join('' if value is None else str(value)
+                        for value in row))
+
+
+def print_insn_set_support(supported_configs, unsupported_configs, verbose):
+    if verbose or len(supported_configs) == 0:
+        print('Unsupported instruction sets')
+        for config, error in unsupported_configs:
+            print(config.to_short_str())
+            print('Error:')
+            print(error)
+
+    print('Supported instruction sets:')
+    for config in supported_configs:
+        print(config.to_short_str())
+
+
+def print_insn_totals(test_and_config_list, max_insns=10):
+    # Prints the most frequent instructions across all successfully compiled
+    # tests of each config
+    for config, tests_by_cat in test_and_config_list:
+        totals = get_insn_totals(
+            [test.insns for test in flatten_tests_by_cat(tests_by_cat)
+             if test.insns is not None])
+        most_frequent = sorted(totals.items(),
+                               key=lambda item: (-item[1], item[0]))
+        print(f'Instruction totals for {",".join(config.short_ids())}: ' +
+              ', '.join(f'{insn}: {count}'
+                        for insn, count in most_frequent[:max_insns]))
+
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'worker':
+        worker_main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == 'query':
+        query_main(sys.argv[2:])
+        return
+
     allowed_insn_sets = ', '.join(get_name_to_insn_set_map().keys())
 
     parser = argparse.ArgumentParser(prog='asm_collect')
@@ -106,59 +340,244 @@ def main():
         'location: <output_root>/<compiler_id>/' +
         '<category>_<arch>_<enabled_insn_sets>.json. ' +
         'Missing directories are created if needed.')
+    parser.add_argument(
+        '--results_db', type=str, default=None,
+        help='If this option is given, the results saved to --output_root ' +
+        'are also stored in a SQLite database at the given path, ' +
+        'replacing earlier results of the same compiler, instruction sets ' +
+        'and category. Use "asm_collect.py query <path>" to query it.')
+    parser.add_argument(
+        '--incremental', action='store_true', default=False,
+        help='If set, reuses the results already present in --output_root ' +
+        'and compiles only the tests that are new or failed previously. ' +
+        'The new results are merged into the existing files.')
+    parser.add_argument(
+        '--chunk_seconds', type=float, default=None,
+        help='If set, the number of tests per file is chosen so that each ' +
+        'file takes approximately the given number of seconds to compile. ' +
+        'The value of --tests_per_file becomes the upper limit.')
+    parser.add_argument(
+        '--timing_history', type=str, default=None,
+        help='Path to a file storing the compile times measured in ' +
+        'previous runs. Used to estimate file sizes for --chunk_seconds. ' +
+        'The file is updated after each run.')
+    parser.add_argument(
+        '--isolate_failures', action='store_true', default=False,
+        help='If set, a failure to compile a file does not abort the run. ' +
+        'Instead, the failing tests are found by recursively splitting the ' +
+        'file and only they are marked as failed.')
+    parser.add_argument(
+        '--compile_timeout', type=float, default=None,
+        help='Maximum number of seconds a single compiler invocation may ' +
+        'take. Compilations that time out are treated as failed.')
+    parser.add_argument(
+        '--jobs', '-j', type=int, default=None,
+        help='The maximum number of compilers to run at once. By default ' +
+        'one more than the number of CPUs available to the process, ' +
+        'taking CPU affinity and cgroup CPU quota into account.')
+    parser.add_argument(
+        '--max_memory', '--max-memory', type=str, default=None,
+        help='The maximum amount of memory the compilers may use in total, ' +
+        'e.g. 8G or 512M. New compilers are not started while the limit ' +
+        'would be exceeded. Regardless of this option, new compilers are ' +
+        'started only while enough system or cgroup memory is available.')
+    parser.add_argument(
+        '--no_jobserver', action='store_true', default=False,
+        help='If set, the GNU make jobserver is not used even if the ' +
+        'program is run from make with parallel jobs enabled. By default, ' +
+        'a jobserver token is acquired for each concurrent compiler.')
+    parser.add_argument(
+        '--asyncio', action='store_true', default=False,
+        help='If set, compilers are launched from an asyncio event loop in ' +
+        'a single process instead of from a pool of worker processes. ' +
+        'This reduces the overhead when running many compilers at once.')
+    parser.add_argument(
+        '--pch', action='store_true', default=False,
+        help='If set, libsimdpp headers are precompiled once for each ' +
+        'instruction set configuration. Supported only for GCC and Clang.')
+    parser.add_argument(
+        '--cache_dir', type=str, default=None,
+        help='If this option is given, instruction counts of compiled tests ' +
+        'are cached in the given directory and reused on subsequent runs ' +
+        'as long as the compiler, the libsimdpp headers and the tests ' +
+        'themselves do not change.')
+    parser.add_argument(
+        '--remote_cache', type=str, default=None,
+        help='If this option is given, instruction counts of compiled tests ' +
+        'are cached in a HTTP key-value store at the given URL, such as ' +
+        'the one started via "python3 -m asmtest.cache_server <dir>". ' +
+        'This allows multiple hosts to share the results. If --cache_dir ' +
+        'is also set, the local cache is checked first. The run proceeds ' +
+        'without the remote cache if the server can not be reached.')
+    parser.add_argument(
+        '--listen', type=str, default=None,
+        help='If set, the tests are not compiled locally. Instead, the ' +
+        'program listens on the given host:port address for workers ' +
+        'started via "asm_collect.py worker host:port cxx libsimdpp" and ' +
+        'distributes the compilations and instruction set detection among ' +
+        'them. --cache_dir and --remote_cache must be passed to the ' +
+        'workers instead.')
+    add_detection_cache_arguments(parser)
     parser.add_argument(
         '--verbose', action='store_true', default=False,
         help='If set, produces verbose output')
 
     args = parser.parse_args()
 
-    compiler = detect_compiler(args.cxx)
-    if compiler is None:
-        print('Could not detect compiler')
+    max_memory = None
+    if args.max_memory is not None:
+        max_memory = parse_memory_size(args.max_memory)
+
+    if args.incremental and args.output_root is None:
+        print('Please set --output_root to use --incremental')
+        sys.exit(1)
+
+    if args.results_db is not None and args.output_root is None:
+        print('Please set --output_root to use --results_db')
+        sys.exit(1)
+
+    if args.listen is not None and args.pch:
+        print('--pch can not be used together with --listen')
         sys.exit(1)
 
+    detection_cache = load_detection_cache(args)
+    compiler = detect_compiler_with_cache(args.cxx, detection_cache)
+
     libsimdpp_path = os.path.abspath(args.libsimdpp)
-    if not os.path.isdir(libsimdpp_path):
-        raise Exception(f'libsimdpp path {libsimdpp_path} does not exist')
+    check_libsimdpp_path(libsimdpp_path)
+    libsimdpp_fingerprint = get_libsimdpp_fingerprint(libsimdpp_path)
 
-    if not os.path.isfile(os.path.join(libsimdpp_path, 'simdpp/simd.h')):
-        raise Exception(f'Invalid libsimdpp install at {libsimdpp_path}')
+    categories = None
+    if args.categories is not None:
+        categories = args.categories.split(',')
 
+    def get_tests_for_config(config):
+        tests_by_cat = generate_test_list(get_all_tests(config), categories)
+        tests_by_cat_to_compile = tests_by_cat
+        if args.incremental:
+            tests_by_cat_to_compile = apply_existing_results(
+                args.output_root, compiler, [(config, tests_by_cat)])[0][1]
+        return tests_by_cat, tests_by_cat_to_compile
+
+    # The instruction sets are detected on the same executor as the tests
+    # are compiled on and the tests of each supported config are compiled
+    # as soon as the config is detected. The list is filled by
+    # perform_all_tests in that case.
+    test_and_config_list = []
+    test_and_config_list_to_compile = []
+    equivalent_test_and_config_list = []
+    config_detection = None
     if args.instr_sets is not None:
-        insn_set_configs = [parse_insn_sets(args.instr_sets)]
+        config = parse_insn_sets(args.instr_sets)
+        tests_by_cat, tests_by_cat_to_compile = get_tests_for_config(config)
+        test_and_config_list.append((config, tests_by_cat))
+        test_and_config_list_to_compile.append((config,
+                                                tests_by_cat_to_compile))
     else:
         if args.output_root is None:
             print('Please set --output_root to test all instruction sets')
             sys.exit(1)
-        insn_set_configs, insn_set_unsupported_configs = \
-            detect_supported_insn_sets(libsimdpp_path, compiler)
-
-        if args.verbose or len(insn_set_configs) == 0:
-            print('Unsupported instruction sets')
-            for config, error in insn_set_unsupported_configs:
-                print(config.to_short_str())
-                print('Error:')
-                print(error)
-
-        print('Supported instruction sets:')
-        for config in insn_set_configs:
-            print(config.to_short_str())
 
-    categories = None
-    if args.categories is not None:
-        categories = args.categories.split(',')
+        cached_insn_sets = None
+        if detection_cache is not None:
+            cached_insn_sets = detection_cache.get_insn_sets(
+                compiler, libsimdpp_fingerprint)
+
+        if cached_insn_sets is not None:
+            supported_configs, unsupported_configs = cached_insn_sets
+            print_insn_set_support(supported_configs, unsupported_configs,
+                                   args.verbose)
+            # Equivalent configs share the tests of the first one and are
+            # added to test_and_config_list only after the compilation so
+            # that the tests aren't compiled twice
+            equivalent_configs = EquivalentConfigs()
+            for config in supported_configs:
+                equivalent = equivalent_configs.find(config)
+                if equivalent is not None:
+                    equivalent_config, tests_by_cat = equivalent
+                    print_equivalent_config(config, equivalent_config,
+                                            sys.stdout)
+                    equivalent_test_and_config_list.append(
+                        (config, tests_by_cat))
+                    continue
+                tests_by_cat, tests_by_cat_to_compile = \
+                    get_tests_for_config(config)
+                equivalent_configs.add(config, tests_by_cat)
+                test_and_config_list.append((config, tests_by_cat))
+                test_and_config_list_to_compile.append(
+                    (config, tests_by_cat_to_compile))
+        else:
+            config_detection = ConfigDetection(
+                get_all_insn_set_configs(
+                    compiler.supports_preprocessor_probe()),
+                get_tests_for_config)
+            test_and_config_list_to_compile = test_and_config_list
+
+    cache = create_cache_from_args(args, compiler, libsimdpp_path)
+
+    compile_time_history = None
+    if args.timing_history is not None:
+        compile_time_history = CompileTimeHistory.load(args.timing_history,
+                                                       compiler)
+
+    jobs = args.jobs
+    executor_factory = None
+    if args.listen is not None:
+        listen_address = parse_address(args.listen)
+        if jobs is None:
+            jobs = DEFAULT_COORDINATOR_JOBS
+
+        def create_distributed_executor(worker_context):
+            return DistributedExecutor(listen_address, worker_context)
+        executor_factory = create_distributed_executor
+
+    test_source = TestSource(test_and_config_list, regenerate=True,
+                             categories=categories)
+    perform_all_tests(libsimdpp_path, compiler,
+                      test_and_config_list_to_compile, args.tests_per_file,
+                      cache=cache, use_pch=args.pch,
+                      use_asyncio=args.asyncio, jobs=jobs,
+                      executor_factory=executor_factory,
+                      max_memory=max_memory,
+                      use_jobserver=not args.no_jobserver,
+                      isolate_failures=args.isolate_failures,
+                      timeout=args.compile_timeout,
+                      chunk_target_seconds=args.chunk_seconds,
+                      compile_time_history=compile_time_history,
+                      test_source=test_source,
+                      config_detection=config_detection)
+
+    if config_detection is not None:
+        print_insn_set_support(config_detection.supported_configs,
+                               config_detection.unsupported_configs,
+                               args.verbose)
+        if detection_cache is not None and config_detection.is_complete():
+            detection_cache.put_insn_sets(
+                compiler, libsimdpp_fingerprint,
+                config_detection.supported_configs,
+                config_detection.unsupported_configs)
+
+    if detection_cache is not None:
+        detection_cache.save()
+
+    test_and_config_list.extend(equivalent_test_and_config_list)
 
-    test_and_config_list = [(config,
-                             generate_test_list(get_all_tests(config),
-                                                categories)
-                             ) for config in insn_set_configs]
+    if compile_time_history is not None:
+        compile_time_history.save()
 
-    perform_all_tests(libsimdpp_path, compiler, test_and_config_list,
-                      args.tests_per_file)
+    if args.verbose:
+        print_insn_totals(test_and_config_list)
 
     if args.output_root:
-        write_results_to_files(args.output_root, compiler,
-                               test_and_config_list)
+        results_db = None
+        if args.results_db is not None:
+            results_db = ResultsDb.open(args.results_db)
+        try:
+            write_results_to_files(args.output_root, compiler,
+                                   test_and_config_list, results_db)
+        finally:
+            if results_db is not None:
+                results_db.close()
     else:
         write_results(flatten_tests_by_cat(test_and_config_list[0][1]),
                       sys.stdout)
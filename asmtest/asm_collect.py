@@ -18,28 +18,58 @@
 
 from __future__ import print_function
 
+import asyncio
 import copy
+import functools
+import itertools
 import json
-import multiprocessing
 import os
+import re
 import shutil
 import sys
 import tempfile
+import time
+from collections import OrderedDict
+from collections import defaultdict
+from collections import deque
 from concurrent import futures
 
+from asmtest.asm_parser import AsmFunctionParser
 from asmtest.asm_parser import InsnCount
-from asmtest.asm_parser import parse_compiler_asm_output
+from asmtest.asm_parser import decode_insn_counts
+from asmtest.asm_parser import encode_insn_counts
+from asmtest.asm_parser import iter_compiler_asm_functions
+from asmtest.asm_parser import parse_compiler_asm_file
+from asmtest.async_engine import AsyncioExecutor
 from asmtest.codegen import get_code_for_tests
-from asmtest.compiler import compile_code_to_asm
+from asmtest.compiler import build_precompiled_header
+from asmtest.compiler import build_precompiled_header_async
+from asmtest.compiler import compile_code_to_asm_file
+from asmtest.compiler import compile_code_to_asm_file_async
+from asmtest.compiler import compile_code_to_asm_lines
+from asmtest.compiler import compile_code_to_asm_lines_async
+from asmtest.compiler import detect_insn_set_support
+from asmtest.compiler import detect_insn_set_support_async
+from asmtest.insn_equivalence import get_canonical_insns
 from asmtest.insn_set import InsnSet
 from asmtest.insn_set import InsnSetConfig
-from asmtest.json_utils import NoIndent
-from asmtest.json_utils import NoIndentJsonEncoder
+from asmtest.jobserver import JobserverClient
+from asmtest.postprocess import postprocess_insn_counts
+from asmtest.resources import ResourceLimiter
+from asmtest.resources import get_default_job_count
+from asmtest.scheduling import ChunkQueue
+from asmtest.scheduling import CompileTimeHistory
+from asmtest.scheduling import split_tests_into_adaptive_chunks
+from asmtest.test_desc import Test
+from asmtest.test_desc import TestDesc
+from asmtest.test_desc import TestGenerator
 from asmtest.test_desc import group_tests_by_code
+from asmtest.test_list import get_all_tests
 from asmtest.utils import rmtree_with_retry
 
 
-def get_output_location_for_settings(compiler, insn_set_config, category):
+def get_compiler_id(compiler):
+    # Returns the name of the compiler that the results are stored under
     compiler_version = compiler.version.split('.')
     version_components = 2
 
@@ -57,18 +87,26 @@ def get_output_location_for_settings(compiler, insn_set_config, category):
 
     # remove bugfix and minor version components if needed
     compiler_version = '.'.join(compiler_version[:version_components])
+    return f'{compiler.name}_{compiler_version}'
 
-    target_arch = compiler.target_arch
-    if target_arch is None:
-        target_arch = 'unknown'
 
+def get_config_id(insn_set_config):
+    # Returns the name of the instruction set config that the results are
+    # stored under
     short_ids = insn_set_config.short_ids()
     if len(short_ids) == 0:
         short_ids = ['none']
+    return '_'.join(short_ids)
 
-    return os.path.join(f'{compiler.name}_{compiler_version}',
-                        '_'.join([category, compiler.target_arch] +
-                                 short_ids) + '.json')
+
+def get_output_location_for_settings(compiler, insn_set_config, category):
+    target_arch = compiler.target_arch
+    if target_arch is None:
+        target_arch = 'unknown'
+
+    return os.path.join(get_compiler_id(compiler),
+                        '_'.join([category, compiler.target_arch,
+                                  get_config_id(insn_set_config)]) + '.json')
 
 
 def get_name_to_insn_set_map():
@@ -77,7 +115,7 @@ def get_name_to_insn_set_map():
         'HAS_SSE3':     InsnSet.X86_SSE3,
         'HAS_SSSE3':    InsnSet.X86_SSSE3,
         'HAS_SSE4_1':   InsnSet.X86_SSE4_1,
-        'HAS_POPCNT':   InsnSet.X86_SSE4_1,
+        'HAS_POPCNT':   InsnSet.X86_POPCNT,
         'HAS_AVX':      InsnSet.X86_AVX,
         'HAS_AVX2':     InsnSet.X86_AVX2,
         'HAS_FMA3':     InsnSet.X86_FMA3,
@@ -100,30 +138,97 @@ def parse_insn_sets(insn_set_list):
     return InsnSetConfig(insn_sets)
 
 
-def merge_equivalent_insns(insns):
-    ''' This function merges the instruction counts of equivalent instructions.
-        This is needed in cases the architecture supports several effectively
-        equivalent instructions and the compiler is free to choose any of them.
+def test_sort_key(test):
+    return (test.desc.code, test.desc.bytes, test.desc.rtype,
+            test.desc.atype, test.desc.btype, test.desc.ctype)
+
+
+def generate_test_list(category_to_tests, categories):
+    ret = {}
+    index = 0
+
+    if categories is None:
+        tests = category_to_tests
+    else:
+        tests = {}
+        for cat in categories:
+            if cat not in category_to_tests:
+                raise Exception(f'Category {cat} does not exist')
+            tests[cat] = category_to_tests[cat]
+
+    for category, test_gen_list in tests.items():
+        test_list = []
+        for t in test_gen_list:
+            if isinstance(t, TestGenerator):
+                for d in t.generate():
+                    test_list.append(Test(d, "id" + str(index)))
+                    index += 1
+            else:
+                test_list.append(Test(t, "id" + str(index)))
+                index += 1
+        ret[category] = test_list
+    return ret
+
+
+class ResultsWriter:
+
+    ''' Writes the results of tests in the layout used by write_results.
+        The data of each test is formatted directly, so that the output is
+        the same as json.dumps(test.to_json(), sort_keys=True) would produce.
     '''
-    groups = {
-        'movaps': ['movapd', 'movdqa'],
-        'movups': ['movupd', 'movdqu'],
-        'vmovaps': ['vmovapd', 'vmovdqa'],
-        'vmovups': ['vmovupd', 'vmovdqu'],
-    }
 
-    for main_insn in groups:
-        eq_insns = groups[main_insn]
-        for eq_insn in eq_insns:
-            if eq_insn in insns.insns:
-                count = insns.insns[eq_insn]
-                insns.sub_insn(eq_insn, count)
-                insns.add_insn(main_insn, count)
+    def __init__(self, file):
+        self.file = file
+        # Maps type and instruction names to their JSON representation.
+        # There are few distinct names, thus each is encoded only once.
+        self.quoted_names = {}
 
+    def quote(self, name):
+        ret = self.quoted_names.get(name)
+        if ret is None:
+            ret = json.dumps(name)
+            self.quoted_names[name] = ret
+        return ret
 
-def test_sort_key(test):
-    return (test.desc.code, test.desc.bytes, test.desc.rtype,
-            test.desc.atype, test.desc.btype, test.desc.ctype)
+    def format_test(self, test, code_json=None):
+        desc = test.desc
+        parts = [f'"bytes": {desc.bytes}']
+        if code_json is not None:
+            parts.append(f'"code": {code_json}')
+        if test.insns is None:
+            parts.append('"success": false')
+        for key, type_name in [('va', desc.atype), ('vb', desc.btype),
+                               ('vc', desc.ctype), ('vr', desc.rtype)]:
+            if type_name is not None:
+                parts.append(f'"{key}": {self.quote(type_name)}')
+        if test.insns is not None:
+            insns = ', '.join(f'{self.quote(insn)}: {count}'
+                              for insn, count in sorted(test.insns.items())
+                              if count != 0)
+            parts.append(f'"zinsns": {{{insns}}}')
+        return '{' + ', '.join(parts) + '}'
+
+    def write(self, test_list):
+        separator = '[\n  '
+        for group in group_tests_by_code(test_list):
+            self.file.write(separator)
+            separator = ',\n  '
+            code_json = json.dumps(group[0].desc.code)
+            if len(group) == 1:
+                self.file.write(self.format_test(group[0], code_json))
+                continue
+
+            self.file.write(f'{{\n    "code": {code_json},\n    "tests": [')
+            test_separator = '\n      '
+            for test in sorted(group, key=test_sort_key):
+                self.file.write(test_separator + self.format_test(test))
+                test_separator = ',\n      '
+            self.file.write('\n    ]\n  }')
+
+        if separator == '[\n  ':
+            self.file.write('[]')
+        else:
+            self.file.write('\n]')
 
 
 def write_results(test_list, file):
@@ -131,48 +236,173 @@ def write_results(test_list, file):
         We want json output to be compact, but readable at the same time.
         We group tests that have the same code snippet and also disable json
         indentation for data of each individual test.
+
+        The output is the same as json.dump(..., sort_keys=True, indent=2)
+        would produce with the data of each test kept on a single line. It
+        is written to the file one test at a time.
+    '''
+    ResultsWriter(file).write(test_list)
+
+
+def read_results(file):
+    ''' Reads a list of Test instances from a file written by write_results.
+        Tests that failed to compile have their insns member set to None.
     '''
-    json_data = []
-    for group in group_tests_by_code(test_list):
-        if len(group) > 1:
-            json_group_tests = [test.to_json()
-                                for test in sorted(group, key=test_sort_key)]
-            for json_test in json_group_tests:
-                json_test.pop('code')
-            json_group = {
-                'code': group[0].desc.code,
-                'tests': [NoIndent(json_test)
-                          for json_test in json_group_tests],
-            }
-            json_data.append(json_group)
+    json_data = json.load(file)
+
+    tests = []
+    for json_item in json_data:
+        if 'tests' in json_item:
+            json_tests = json_item['tests']
+            for json_test in json_tests:
+                json_test['code'] = json_item['code']
         else:
-            json_data.append(NoIndent(group[0].to_json()))
+            json_tests = [json_item]
+
+        for json_test in json_tests:
+            tests.append(Test.from_json(json_test, 'id' + str(len(tests))))
+    return tests
+
+
+TEST_FUNCTION_NAME_RE = re.compile(r'_*test_id_(\w+)_end$')
+
+
+def get_test_ident_from_function_name(name):
+    # Returns the ident of the test that the function with given name
+    # implements or None if the function is not a test. Some compilers
+    # prepend an underscore to the names of extern "C" functions.
+    m = TEST_FUNCTION_NAME_RE.match(name)
+    if m is None:
+        return None
+    return m.group(1)
+
+
+def add_test_function_insns(index, function):
+    # Adds the instruction counts of the given AsmFunction to the index
+    # unless the function does not implement a test
+    ident = get_test_ident_from_function_name(function.name)
+    if ident is not None and ident not in index:
+        index[ident] = InsnCount.from_insn_list(function.insns)
+
+
+def build_test_insns_index(functions):
+    ''' Returns a dict mapping test idents to the InsnCount instances of the
+        functions implementing them. Functions that do not implement tests
+        are ignored. Each function is converted as soon as functions yields
+        it, thus only the counts are held in memory.
+    '''
+    index = {}
+    for function in functions:
+        add_test_function_insns(index, function)
+    return index
 
-    json.dump(json_data, file, sort_keys=True, indent=2,
-              cls=NoIndentJsonEncoder)
 
+def is_test_function_name(name):
+    return get_test_ident_from_function_name(name) is not None
 
-def parse_test_insns(asm_output, test_list, baseline_test_list):
-    # The result is stored to the insns member of each object in test_list
-    functions = parse_compiler_asm_output(asm_output)
 
-    for test in test_list + baseline_test_list:
-        function_name = f'test_id_{test.ident}_end'
-        found_function = None
-        for fun in functions:
-            if function_name in fun.name:
-                found_function = fun
-                break
-        if found_function is None:
+def get_indexed_test_insns(index, test_list):
+    # Returns a dict mapping the idents of the given tests to InsnCount
+    # instances in the index returned by build_test_insns_index
+    ret = {}
+    for test in test_list:
+        insns = index.get(test.ident)
+        if insns is None:
             raise Exception(f'Could not find ident {test.ident}')
-        test.insns = InsnCount.from_insn_list(found_function.insns)
+        ret[test.ident] = insns
+    return ret
+
+
+def get_test_insns(functions, test_list):
+    # Returns a dict mapping test idents to InsnCount instances. functions is
+    # an iterable of AsmFunction instances, it is consumed only once.
+    return get_indexed_test_insns(build_test_insns_index(functions),
+                                  test_list)
+
+
+def parse_test_insns(asm_output, test_list, canonical_insns=None):
+    # Returns a dict mapping test idents to InsnCount instances. Equivalent
+    # instructions are merged according to canonical_insns while parsing.
+    return get_test_insns(
+        iter_compiler_asm_functions(asm_output.split('\n'),
+                                    is_test_function_name, canonical_insns),
+        test_list)
+
+
+def parse_test_insns_file(asm_path, test_list, canonical_insns=None):
+    # Same as parse_test_insns, but reads the assembly from the given file
+    return get_test_insns(
+        parse_compiler_asm_file(asm_path, is_test_function_name,
+                                canonical_insns),
+        test_list)
+
+
+# The number of lines parse_test_insns_async parses at once
+PARSE_BATCH_LINES = 1024
+
+
+async def parse_test_insns_async(lines, test_list, canonical_insns=None):
+    # asyncio equivalent of parse_test_insns. lines is an asynchronous
+    # generator of the lines of compiler output. The lines are parsed in
+    # batches as they arrive so that the output is never held in memory as a
+    # whole and the event loop is not blocked for long.
+    parser = AsmFunctionParser(is_test_function_name, canonical_insns)
+    index = {}
+    batch = []
+    try:
+        async for line in lines:
+            batch.append(line)
+            if len(batch) >= PARSE_BATCH_LINES:
+                for function in parser.parse(batch):
+                    add_test_function_insns(index, function)
+                batch = []
+    finally:
+        await lines.aclose()
+    for function in parser.parse(batch):
+        add_test_function_insns(index, function)
+    function = parser.finish()
+    if function is not None:
+        add_test_function_insns(index, function)
+    return get_indexed_test_insns(index, test_list)
+
+
+def get_test_signature(desc):
+    # The number of instructions that the test scaffolding emits depends only
+    # on the values returned by this function
+    return (desc.bytes, desc.rtype, desc.atype, desc.btype, desc.ctype)
 
-    # subtract baseline
-    for i, (test, baseline_test) in \
-            enumerate(zip(test_list, baseline_test_list)):
 
-        test.insns.sub(baseline_test.insns)
-        merge_equivalent_insns(test.insns)
+def get_baseline_tests(test_list):
+    ''' Returns a list of tests with empty code, one for each unique test
+        signature in the given test list. These tests are compiled to find out
+        the baseline number of instructions that the test scaffolding emits.
+    '''
+    signatures = OrderedDict()
+    for test in test_list:
+        signatures[get_test_signature(test.desc)] = True
+    return create_baseline_tests(signatures)
+
+
+def create_baseline_tests(signatures):
+    # Returns a list of tests with empty code, one for each of the given test
+    # signatures
+    ret = []
+    for i, (bytes, rtype, atype, btype, ctype) in enumerate(signatures):
+        desc = TestDesc('', bytes, [rtype, atype, btype, ctype])
+        ret.append(Test(desc, f'base{i}'))
+    return ret
+
+
+def subtract_baseline_insns(test_list, baseline_insns, use_numpy=None):
+    ''' Subtracts the baseline from the raw instruction counts of the tests.
+        baseline_insns is a dict mapping test signatures to InsnCount
+        instances. All tests are processed in a single batch, see
+        postprocess_insn_counts.
+    '''
+    postprocess_insn_counts(
+        [test.insns for test in test_list],
+        [baseline_insns[get_test_signature(test.desc)] for test in test_list],
+        use_numpy=use_numpy)
 
 
 def split_test_list_into_chunks(test_list, tests_per_file):
@@ -187,74 +417,912 @@ def flatten_tests_by_cat(tests_by_cat):
     return ret
 
 
-def perform_single_compilation(libsimdpp_path, test_dir, compiler,
-                               insn_set_config, tests_chunk):
-    # compile a second copy of the tests to find out baseline number
-    # of instructions that the test scaffolding emits
-    tests_baseline_chunk = copy.deepcopy(tests_chunk)
-    for i in tests_baseline_chunk:
-        i.ident = i.ident + "_zero"
-        i.desc.code = ""
+def flatten_tests_by_cat_with_categories(tests_by_cat):
+    # Returns a list of (category, test) tuples in the same order as
+    # flatten_tests_by_cat
+    ret = []
+    for cat in sorted(tests_by_cat.keys()):
+        ret += [(cat, test) for test in tests_by_cat[cat]]
+    return ret
+
+
+def split_tests_by_cat_into_chunks(tests_by_cat, config, tests_per_file,
+                                   chunk_target_seconds,
+                                   compile_time_history):
+    # Returns a list of (categories, tests) tuples, one for each chunk
+    tests_with_cats = flatten_tests_by_cat_with_categories(tests_by_cat)
+
+    if chunk_target_seconds is None:
+        chunks = split_test_list_into_chunks(tests_with_cats, tests_per_file)
+    else:
+        chunks = split_tests_into_adaptive_chunks(
+            tests_with_cats, config, compile_time_history,
+            chunk_target_seconds, tests_per_file)
+
+    return [([cat for cat, _ in chunk], [test for _, test in chunk])
+            for chunk in chunks]
+
+
+class CompilationChunk:
+
+    ''' Represents a chunk of tests that are compiled as a single file
+    '''
+
+    def __init__(self, config_index, config, categories, tests, pch_path):
+        self.config_index = config_index
+        self.config = config
+        self.categories = categories
+        self.tests = tests
+        self.pch_path = pch_path
+        self.future = None
+        # The order in which the chunk was submitted
+        self.index = None
+
+    def split(self):
+        middle = len(self.tests) // 2
+        return [
+            CompilationChunk(self.config_index, self.config,
+                             self.categories[:middle], self.tests[:middle],
+                             self.pch_path),
+            CompilationChunk(self.config_index, self.config,
+                             self.categories[middle:], self.tests[middle:],
+                             self.pch_path),
+        ]
+
+
+def compile_tests_to_insns_via_pipe(libsimdpp_path, test_dir, compiler,
+                                    insn_set_config, test_list, test_code,
+                                    pch_path, timeout):
+    try:
+        lines = compile_code_to_asm_lines(libsimdpp_path, compiler,
+                                          insn_set_config, test_code,
+                                          pch_path=pch_path, timeout=timeout)
+        return get_test_insns(
+            iter_compiler_asm_functions(
+                lines, is_test_function_name,
+                get_canonical_insns(compiler.target_arch)),
+            test_list)
+    except Exception:
+        save_failed_test_code(test_dir, test_code)
+        raise
+
+
+def save_failed_test_code(test_dir, test_code):
+    # preserve the source of failed compilations just like when compiling via
+    # files
+    curr_test_dir = tempfile.mkdtemp(dir=test_dir)
+    with open(os.path.join(curr_test_dir, 'test.cc'), 'w') as out_f:
+        out_f.write(test_code)
+
+
+def compile_tests_to_insns(libsimdpp_path, test_dir, compiler,
+                           insn_set_config, test_list, cache=None,
+                           pch_path=None, timeout=None):
+    # Compiles the given tests as a single file and returns a tuple
+    # containing a dict mapping test idents to InsnCount instances and the
+    # time the compilation took in seconds. The time is None if the result
+    # came from the cache. The instructions emitted by the test scaffolding
+    # are not subtracted.
+    test_code = get_code_for_tests(insn_set_config, test_list)
 
-    test_code = get_code_for_tests(insn_set_config,
-                                   tests_chunk + tests_baseline_chunk)
+    if cache is not None:
+        cache_key = cache.get_key(compiler, insn_set_config, test_code)
+        cached_insns = cache.get(cache_key)
+        if cached_insns is not None:
+            return cached_insns, None
+
+    start_time = time.time()
+
+    if compiler.supports_pipe_compilation():
+        insns_by_ident = compile_tests_to_insns_via_pipe(
+            libsimdpp_path, test_dir, compiler, insn_set_config, test_list,
+            test_code, pch_path, timeout)
+        compile_seconds = time.time() - start_time
+        if cache is not None:
+            cache.put(cache_key, insns_by_ident)
+        return insns_by_ident, compile_seconds
 
     # we deliberately don't use tempfile.TemporaryDirectory() so that
     # the result of failed compilations is preserved if an exception is raised
     curr_test_dir = tempfile.mkdtemp(dir=test_dir)
 
-    asm_output = compile_code_to_asm(libsimdpp_path, compiler,
-                                     insn_set_config, test_code,
-                                     curr_test_dir)
+    asm_path = compile_code_to_asm_file(libsimdpp_path, compiler,
+                                        insn_set_config, test_code,
+                                        curr_test_dir, pch_path=pch_path,
+                                        timeout=timeout)
 
-    parse_test_insns(asm_output, tests_chunk, tests_baseline_chunk)
+    insns_by_ident = parse_test_insns_file(
+        asm_path, test_list, get_canonical_insns(compiler.target_arch))
+    compile_seconds = time.time() - start_time
+
+    if cache is not None:
+        cache.put(cache_key, insns_by_ident)
 
     # MSVC likes to keep files locked even after returning control to the
     # invoking shell
     rmtree_with_retry(curr_test_dir)
+    return insns_by_ident, compile_seconds
 
 
-def perform_all_tests(libsimdpp_path, compiler, test_and_config_list,
-                      tests_per_file, stdout=sys.stdout, stderr=sys.stderr):
-    num_threads = multiprocessing.cpu_count() + 1
-    print(f"Using {num_threads} threads\n", file=stdout)
-
-    with futures.ProcessPoolExecutor(max_workers=num_threads) as executor:
-
-        # we deliberately don't use tempfile.TemporaryDirectory() so that
-        # the result of failed compilations is preserved if an exception is
-        # raised
-        tmp_dir = tempfile.mkdtemp()
-
-        work_futures = []
-
-        # get the number of test cases for progress tracking
-        processed_pos = 0
-
-        for config, tests_by_cat in test_and_config_list:
-            test_list = flatten_tests_by_cat(tests_by_cat)
-
-            for tests_chunk in split_test_list_into_chunks(test_list,
-                                                           tests_per_file):
-                processed_pos += len(tests_chunk)
-                work_futures += [
-                    (processed_pos,
-                     executor.submit(perform_single_compilation,
-                                     libsimdpp_path,
-                                     tmp_dir, compiler, config, tests_chunk)
-                     )
-                ]
-
-        total_test_count = processed_pos
-        for processed_pos, future in work_futures:
+async def compile_tests_to_insns_async(libsimdpp_path, test_dir, compiler,
+                                       insn_set_config, test_list, cache=None,
+                                       pch_path=None, timeout=None):
+    # asyncio equivalent of compile_tests_to_insns. The compiler output is
+    # parsed as it is read from the pipe if the compiler supports pipe
+    # compilation and in the default executor of the event loop otherwise.
+    test_code = get_code_for_tests(insn_set_config, test_list)
+    loop = asyncio.get_running_loop()
+
+    # the cache may need to access the network
+    if cache is not None:
+        cache_key = cache.get_key(compiler, insn_set_config, test_code)
+        cached_insns = await loop.run_in_executor(None, cache.get, cache_key)
+        if cached_insns is not None:
+            return cached_insns, None
+
+    start_time = time.time()
+
+    if compiler.supports_pipe_compilation():
+        try:
+            insns_by_ident = await parse_test_insns_async(
+                compile_code_to_asm_lines_async(
+                    libsimdpp_path, compiler, insn_set_config, test_code,
+                    pch_path=pch_path, timeout=timeout),
+                test_list, get_canonical_insns(compiler.target_arch))
+        except Exception:
+            save_failed_test_code(test_dir, test_code)
+            raise
+        compile_seconds = time.time() - start_time
+        if cache is not None:
+            await loop.run_in_executor(None, cache.put, cache_key,
+                                       insns_by_ident)
+        return insns_by_ident, compile_seconds
+
+    curr_test_dir = tempfile.mkdtemp(dir=test_dir)
+
+    asm_path = await compile_code_to_asm_file_async(
+        libsimdpp_path, compiler, insn_set_config, test_code, curr_test_dir,
+        pch_path=pch_path, timeout=timeout)
+
+    insns_by_ident = await loop.run_in_executor(
+        None, parse_test_insns_file, asm_path, test_list,
+        get_canonical_insns(compiler.target_arch))
+    compile_seconds = time.time() - start_time
+
+    if cache is not None:
+        await loop.run_in_executor(None, cache.put, cache_key, insns_by_ident)
+
+    await loop.run_in_executor(None, rmtree_with_retry, curr_test_dir)
+    return insns_by_ident, compile_seconds
+
+
+def get_baseline_insns(baseline_tests, insns_by_ident):
+    return {get_test_signature(test.desc): insns_by_ident[test.ident]
+            for test in baseline_tests}
+
+
+def perform_single_baseline_compilation(libsimdpp_path, test_dir, compiler,
+                                        insn_set_config, baseline_tests,
+                                        cache=None, pch_path=None,
+                                        timeout=None):
+    # Returns a tuple containing a dict mapping test signatures to the
+    # baseline number of instructions and the time the compilation took in
+    # seconds or None if the results came from the cache
+    insns_by_ident, compile_seconds = compile_tests_to_insns(
+        libsimdpp_path, test_dir, compiler, insn_set_config, baseline_tests,
+        cache, pch_path, timeout)
+    return get_baseline_insns(baseline_tests, insns_by_ident), compile_seconds
+
+
+async def perform_single_baseline_compilation_async(
+        libsimdpp_path, test_dir, compiler, insn_set_config, baseline_tests,
+        cache=None, pch_path=None, timeout=None):
+    # asyncio equivalent of perform_single_baseline_compilation
+    insns_by_ident, compile_seconds = await compile_tests_to_insns_async(
+        libsimdpp_path, test_dir, compiler, insn_set_config, baseline_tests,
+        cache, pch_path, timeout)
+    return get_baseline_insns(baseline_tests, insns_by_ident), compile_seconds
+
+
+def get_chunk_insns(tests_chunk, insns_by_ident):
+    # Returns a list of the raw InsnCount instances, one for each test in
+    # tests_chunk. The baseline is subtracted once all tests are compiled,
+    # see subtract_baseline_insns.
+    return [insns_by_ident[test.ident] for test in tests_chunk]
+
+
+def perform_single_compilation(libsimdpp_path, test_dir, compiler,
+                               insn_set_config, tests_chunk, cache=None,
+                               pch_path=None, timeout=None):
+    # Returns a tuple containing a list of InsnCount instances, one for each
+    # test in tests_chunk, and the time the compilation took in seconds or
+    # None if the results came from the cache. The tests are not modified.
+    insns_by_ident, compile_seconds = compile_tests_to_insns(
+        libsimdpp_path, test_dir, compiler, insn_set_config, tests_chunk,
+        cache, pch_path, timeout)
+    return get_chunk_insns(tests_chunk, insns_by_ident), compile_seconds
+
+
+async def perform_single_compilation_async(libsimdpp_path, test_dir,
+                                           compiler, insn_set_config,
+                                           tests_chunk, cache=None,
+                                           pch_path=None, timeout=None):
+    # asyncio equivalent of perform_single_compilation
+    insns_by_ident, compile_seconds = await compile_tests_to_insns_async(
+        libsimdpp_path, test_dir, compiler, insn_set_config, tests_chunk,
+        cache, pch_path, timeout)
+    return get_chunk_insns(tests_chunk, insns_by_ident), compile_seconds
+
+
+class TestSource:
+
+    ''' Provides worker processes with the tests to compile. The tests are
+        identified by the index of the config and the positions of the tests
+        within the flattened test list of that config, so that only these
+        need to be passed for each compilation.
+
+        If regenerate is set, the tests are not pickled at all. Instead, each
+        worker process generates them again from the test list, which gives
+        identical results as long as categories is the same. In this case
+        configs may also be added via add_config() after the workers have
+        been started.
+    '''
+
+    def __init__(self, test_and_config_list, regenerate=False,
+                 categories=None):
+        self.configs = [config for config, _ in test_and_config_list]
+        self.test_lists = [flatten_tests_by_cat(tests_by_cat)
+                           for _, tests_by_cat in test_and_config_list]
+        self.test_counts = [len(test_list) for test_list in self.test_lists]
+        self.regenerate = regenerate
+        self.categories = categories
+
+    @staticmethod
+    def for_regeneration(categories, test_counts):
+        # Returns a TestSource that generates the tests on demand. categories
+        # and test_counts must have the same values as in the TestSource that
+        # the test positions refer to.
+        source = TestSource([], regenerate=True, categories=categories)
+        source.test_lists = None
+        source.test_counts = test_counts
+        return source
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.regenerate:
+            state['test_lists'] = None
+        return state
+
+    def add_config(self, config, tests_by_cat):
+        # Adds the tests of another config and returns its index
+        self.configs.append(config)
+        self.test_lists.append(flatten_tests_by_cat(tests_by_cat))
+        self.test_counts.append(len(self.test_lists[-1]))
+        return len(self.configs) - 1
+
+    def get_test_list(self, config_index, config):
+        if self.test_lists is None:
+            self.test_lists = []
+        if config_index < len(self.test_lists) and \
+                self.test_lists[config_index] is not None:
+            return self.test_lists[config_index]
+
+        test_list = flatten_tests_by_cat(
+            generate_test_list(get_all_tests(config), self.categories))
+        # Configs added after this instance has been copied to the worker
+        # have unknown counts
+        if config_index < len(self.test_counts) and \
+                len(test_list) != self.test_counts[config_index]:
+            raise Exception('Regenerated test list for ' +
+                            config.to_short_str() + ' does not match')
+        self.test_lists += [None] * (config_index + 1 - len(self.test_lists))
+        self.test_lists[config_index] = test_list
+        return test_list
+
+    def get_tests(self, config_index, config, position_ranges):
+        test_list = self.get_test_list(config_index, config)
+        ret = []
+        for begin, end in position_ranges:
+            ret += test_list[begin:end]
+        return ret
+
+    def get_position_map(self, config_index=None):
+        # Returns a dict mapping id() of each test to a tuple containing the
+        # config index and the position of the test in its test list. By
+        # default includes the tests of all configs.
+        config_indexes = range(len(self.test_lists))
+        if config_index is not None:
+            config_indexes = [config_index]
+
+        ret = {}
+        for i in config_indexes:
+            for position, test in enumerate(self.test_lists[i]):
+                ret[id(test)] = (i, position)
+        return ret
+
+
+def get_position_ranges(positions):
+    # Compresses a sorted list of positions to a list of [begin, end) ranges
+    ret = []
+    for position in positions:
+        if len(ret) > 0 and ret[-1][1] == position:
+            ret[-1][1] = position + 1
+        else:
+            ret.append([position, position + 1])
+    return [tuple(r) for r in ret]
+
+
+class WorkerContext:
+
+    ''' Holds the data that is the same for all compilations. It is passed
+        to each worker process only once when the process is started.
+    '''
+
+    def __init__(self, libsimdpp_path, test_dir, compiler, test_source,
+                 cache=None, timeout=None):
+        self.libsimdpp_path = libsimdpp_path
+        self.test_dir = test_dir
+        self.compiler = compiler
+        self.test_source = test_source
+        self.cache = cache
+        self.timeout = timeout
+
+
+_worker_context = None
+
+
+def init_worker(context):
+    global _worker_context
+    _worker_context = context
+
+
+def run_detection_job(config):
+    # Returns the result of detect_insn_set_support for the given config
+    ctx = _worker_context
+    return detect_insn_set_support(ctx.libsimdpp_path, ctx.compiler, config)
+
+
+def run_baseline_compilation_job(config, baseline_tests, pch_path):
+    ctx = _worker_context
+    return perform_single_baseline_compilation(
+        ctx.libsimdpp_path, ctx.test_dir, ctx.compiler, config,
+        baseline_tests, ctx.cache, pch_path, ctx.timeout)
+
+
+def run_compilation_job(config_index, config, position_ranges, pch_path):
+    # Compiles the tests at the given positions of the test list of the given
+    # config. Returns a tuple containing the raw instruction counts encoded
+    # by encode_insn_counts and the compile time.
+    ctx = _worker_context
+    tests_chunk = ctx.test_source.get_tests(config_index, config,
+                                            position_ranges)
+    insns_list, compile_seconds = perform_single_compilation(
+        ctx.libsimdpp_path, ctx.test_dir, ctx.compiler, config, tests_chunk,
+        ctx.cache, pch_path, ctx.timeout)
+    return encode_insn_counts(insns_list), compile_seconds
+
+
+async def run_detection_job_async(config):
+    ctx = _worker_context
+    return await detect_insn_set_support_async(ctx.libsimdpp_path,
+                                               ctx.compiler, config)
+
+
+async def run_baseline_compilation_job_async(config, baseline_tests,
+                                             pch_path):
+    ctx = _worker_context
+    return await perform_single_baseline_compilation_async(
+        ctx.libsimdpp_path, ctx.test_dir, ctx.compiler, config,
+        baseline_tests, ctx.cache, pch_path, ctx.timeout)
+
+
+async def run_compilation_job_async(config_index, config, position_ranges,
+                                    pch_path):
+    # asyncio equivalent of run_compilation_job. The results are encoded in
+    # the same way even though they don't leave the process so that both
+    # can be handled identically.
+    ctx = _worker_context
+    tests_chunk = ctx.test_source.get_tests(config_index, config,
+                                            position_ranges)
+    insns_list, compile_seconds = await perform_single_compilation_async(
+        ctx.libsimdpp_path, ctx.test_dir, ctx.compiler, config, tests_chunk,
+        ctx.cache, pch_path, ctx.timeout)
+    return encode_insn_counts(insns_list), compile_seconds
+
+
+class EquivalentConfigs:
+
+    ''' Tracks the tests of instruction set configs that compile to
+        identical code, so that the tests need to be compiled only for one
+        config of each group of equivalent configs. See
+        InsnSetConfig.equivalence_key().
+    '''
+
+    def __init__(self):
+        # Maps equivalence keys to (config, tests_by_cat) tuples
+        self.configs_by_key = {}
+
+    def find(self, config):
+        # Returns a (config, tests_by_cat) tuple of a previously added config
+        # that is equivalent to the given one or None
+        key = config.equivalence_key()
+        if key is None:
+            return None
+        return self.configs_by_key.get(key)
+
+    def add(self, config, tests_by_cat):
+        key = config.equivalence_key()
+        if key is not None and key not in self.configs_by_key:
+            self.configs_by_key[key] = (config, tests_by_cat)
+
+
+def print_equivalent_config(config, equivalent_config, stdout):
+    print('Reusing the results of ' + ','.join(equivalent_config.short_ids()) +
+          ' for equivalent config ' + ','.join(config.short_ids()),
+          file=stdout)
+
+
+class ConfigDetection:
+
+    ''' Describes the instruction set configs whose support perform_all_tests
+        should detect before compiling their tests. For each supported config
+        get_tests_for_config(config) is called, which must return a tuple
+        containing the categorized tests of the config and the subset of
+        them that needs to be compiled.
+
+        After perform_all_tests completes, supported_configs contains the
+        supported configs with their capabilities set and
+        unsupported_configs contains (config, error) tuples, both in the
+        order of configs.
+
+        Supported configs that are equivalent to an already detected one are
+        not compiled. They get the tests of that config instead.
+    '''
+
+    def __init__(self, configs, get_tests_for_config):
+        self.configs = configs
+        self.get_tests_for_config = get_tests_for_config
+        self.results = [None] * len(configs)
+        self.equivalent_configs = EquivalentConfigs()
+
+    def set_result(self, index, is_supported, capabilities, fingerprint,
+                   error):
+        # Returns the supported config with capabilities set or None
+        config = self.configs[index]
+        if not is_supported:
+            self.results[index] = (None, error)
+            return None
+        config = copy.deepcopy(config)
+        config.capabilities = capabilities
+        config.fingerprint = fingerprint
+        self.results[index] = (config, None)
+        return config
+
+    def is_complete(self):
+        return all(result is not None for result in self.results)
+
+    @property
+    def supported_configs(self):
+        return [result[0] for result in self.results
+                if result is not None and result[0] is not None]
+
+    @property
+    def unsupported_configs(self):
+        return [(config, result[1])
+                for config, result in zip(self.configs, self.results)
+                if result is not None and result[0] is None]
+
+
+def print_test_failure(test, error, stdout, stderr):
+    types = ', '.join(t for t in [test.desc.rtype, test.desc.atype,
+                                  test.desc.btype, test.desc.ctype]
+                      if t is not None)
+    print(f'Failed to compile test "{test.desc.code}" with B={test.desc.bytes}'
+          f' and types {types}', file=stdout)
+    print(error, file=stderr)
+
+
+class JobFunctions:
+
+    ''' The functions that CompilationScheduler submits to the executor for
+        each kind of job. They must be suitable for the executor, i.e.
+        picklable functions for process pools and coroutine functions for
+        AsyncioExecutor.
+    '''
+
+    def __init__(self, detection, build_pch, baseline, compilation):
+        self.detection = detection
+        self.build_pch = build_pch
+        self.baseline = baseline
+        self.compilation = compilation
+
+
+def get_job_functions(use_asyncio):
+    if use_asyncio:
+        return JobFunctions(run_detection_job_async,
+                            build_precompiled_header_async,
+                            run_baseline_compilation_job_async,
+                            run_compilation_job_async)
+    return JobFunctions(run_detection_job, build_precompiled_header,
+                        run_baseline_compilation_job, run_compilation_job)
+
+
+class CompilationScheduler:
+
+    ''' Holds the state of a single perform_all_tests run. See
+        perform_all_tests for the description of the parameters.
+
+        Jobs move through a pipeline: the detection of configs, precompiled
+        headers, baselines and compilation chunks. The jobs of the earlier
+        stages are kept in queued_jobs and are submitted before any chunks.
+        The completion handler of each job queues the jobs it unblocks and
+        returns False if the run must be aborted.
+    '''
+
+    def __init__(self, context, executor, job_functions, resource_limiter,
+                 tests_per_file, stdout=sys.stdout, stderr=sys.stderr,
+                 use_pch=False, isolate_failures=False,
+                 chunk_target_seconds=None, compile_time_history=None,
+                 config_detection=None):
+        if compile_time_history is None:
+            compile_time_history = CompileTimeHistory(
+                compiler=context.compiler)
+        self.context = context
+        self.executor = executor
+        self.job_functions = job_functions
+        self.resource_limiter = resource_limiter
+        self.tests_per_file = tests_per_file
+        self.stdout = stdout
+        self.stderr = stderr
+        self.use_pch = use_pch
+        self.isolate_failures = isolate_failures
+        self.chunk_target_seconds = chunk_target_seconds
+        self.compile_time_history = compile_time_history
+        self.config_detection = config_detection
+
+        self.test_positions = context.test_source.get_position_map()
+        # Maps futures of submitted jobs to (submission order, completion
+        # handler) tuples
+        self.pending_jobs = {}
+        self.submission_counter = itertools.count()
+        # (job function, args, completion handler) tuples of the jobs of the
+        # earlier stages of the pipeline
+        self.queued_jobs = deque()
+        # The chunks that are expected to take longest are submitted first
+        # across all configs so that the run does not end with a few
+        # expensive compilations keeping most of the cores idle
+        self.queued_chunks = ChunkQueue(compile_time_history)
+        # (config, tests_by_cat) tuples of the detected configs by their
+        # index in config_detection.configs
+        self.detected_tests = {}
+        # The baseline instruction counts and the successfully compiled tests
+        # by config index
+        self.baselines = {}
+        self.compiled_tests = defaultdict(list)
+
+        self.total_test_count = 0
+        self.processed_test_count = 0
+
+    def print_failure(self, error):
+        print("Failed to compile...", file=self.stdout)
+        print(error, file=self.stderr)
+
+    def queue_detection(self):
+        for i, config in enumerate(self.config_detection.configs):
+            self.queued_jobs.append((
+                self.job_functions.detection, (config,),
+                functools.partial(self.on_detection_done, i)))
+
+    def start_config(self, config_index, config, tests_by_cat):
+        self.total_test_count += sum(len(tests)
+                                     for tests in tests_by_cat.values())
+        if not self.use_pch:
+            self.queue_baseline(config_index, config, tests_by_cat, None)
+            return
+        pch_dir = tempfile.mkdtemp(dir=self.context.test_dir)
+        self.queued_jobs.append((
+            self.job_functions.build_pch,
+            (self.context.libsimdpp_path, self.context.compiler, config,
+             pch_dir),
+            functools.partial(self.on_pch_done, config_index, config,
+                              tests_by_cat)))
+
+    def on_pch_done(self, config_index, config, tests_by_cat, future):
+        try:
+            pch_path = future.result()
+        except Exception:
+            # the tests are compiled without the precompiled header
+            print('Could not build precompiled header for ' +
+                  config.to_short_str(), file=self.stdout)
+            pch_path = None
+        self.queue_baseline(config_index, config, tests_by_cat, pch_path)
+        return True
+
+    def queue_baseline(self, config_index, config, tests_by_cat, pch_path):
+        # the baseline number of instructions depends only on the test
+        # signature, thus it's computed once for each config and signature
+        baseline_tests = get_baseline_tests(flatten_tests_by_cat(tests_by_cat))
+        self.queued_jobs.append((
+            self.job_functions.baseline, (config, baseline_tests, pch_path),
+            functools.partial(self.on_baseline_done, config_index, config)))
+
+        for categories, tests_chunk in split_tests_by_cat_into_chunks(
+                tests_by_cat, config, self.tests_per_file,
+                self.chunk_target_seconds, self.compile_time_history):
+            self.queued_chunks.push(CompilationChunk(
+                config_index, config, categories, tests_chunk, pch_path))
+
+    def on_baseline_done(self, config_index, config, future):
+        try:
+            self.baselines[config_index], compile_seconds = future.result()
+        except Exception as e:
+            if not self.isolate_failures:
+                self.print_failure(e)
+                return False
+            # The tests of this config can't be post-processed, thus its
+            # remaining chunks are dropped and all its tests are left marked
+            # as failed
+            print('Failed to compile baseline for ' + config.to_short_str(),
+                  file=self.stdout)
+            print(e, file=self.stderr)
+            dropped_chunks = self.queued_chunks.remove_if(
+                lambda chunk: chunk.config_index == config_index)
+            self.processed_test_count += sum(len(chunk.tests)
+                                             for chunk in dropped_chunks)
+            return True
+        if compile_seconds is not None:
+            self.compile_time_history.record_overhead(config, compile_seconds)
+        return True
+
+    def on_detection_done(self, detection_index, future):
+        try:
+            is_supported, capabilities, fingerprint, error = future.result()
+        except Exception as e:
+            is_supported, capabilities, fingerprint, error = \
+                False, [], None, str(e)
+        config_detection = self.config_detection
+        config = config_detection.set_result(detection_index, is_supported,
+                                             capabilities, fingerprint, error)
+        if config is None:
+            return True
+
+        equivalent = config_detection.equivalent_configs.find(config)
+        if equivalent is not None:
+            equivalent_config, tests_by_cat = equivalent
+            print_equivalent_config(config, equivalent_config, self.stdout)
+            self.detected_tests[detection_index] = (config, tests_by_cat)
+            return True
+
+        tests_by_cat, tests_by_cat_to_compile = \
+            config_detection.get_tests_for_config(config)
+        config_detection.equivalent_configs.add(config, tests_by_cat)
+        self.detected_tests[detection_index] = (config, tests_by_cat)
+        test_source = self.context.test_source
+        config_index = test_source.add_config(config, tests_by_cat)
+        self.test_positions.update(test_source.get_position_map(config_index))
+        self.start_config(config_index, config, tests_by_cat_to_compile)
+        return True
+
+    def on_chunk_done(self, chunk, future):
+        try:
+            encoded_insns, compile_seconds = future.result()
+        except Exception as e:
+            if not self.isolate_failures:
+                self.print_failure(e)
+                return False
+
+            if len(chunk.tests) > 1:
+                # Halves of failed chunks are submitted before other chunks
+                # to find the failing tests
+                for half in reversed(chunk.split()):
+                    self.queued_chunks.push(half, urgent=True)
+                return True
+
+            chunk.tests[0].insns = None
+            print_test_failure(chunk.tests[0], e, self.stdout, self.stderr)
+        else:
+            # The tests are sent to the worker sorted by position
+            tests_by_position = sorted(
+                chunk.tests, key=lambda test: self.test_positions[id(test)][1])
+            for test, insns in zip(tests_by_position,
+                                   decode_insn_counts(encoded_insns)):
+                test.insns = insns
+            self.compiled_tests[chunk.config_index].extend(chunk.tests)
+            if compile_seconds is not None:
+                self.compile_time_history.record_chunk(
+                    chunk.config, chunk.categories, compile_seconds)
+
+        self.processed_test_count += len(chunk.tests)
+        print(f'Compiled {self.processed_test_count}/'
+              f'{self.total_test_count}', file=self.stdout)
+        return True
+
+    def submit_chunk(self, chunk):
+        positions = sorted(self.test_positions[id(test)][1]
+                           for test in chunk.tests)
+        return self.executor.submit(self.job_functions.compilation,
+                                    chunk.config_index, chunk.config,
+                                    get_position_ranges(positions),
+                                    chunk.pch_path)
+
+    def has_queued_jobs(self):
+        return len(self.queued_jobs) > 0 or len(self.queued_chunks) > 0
+
+    def submit_queued_jobs(self):
+        # Jobs are submitted only when the resource limiter allows, so that
+        # memory-hungry compilations don't get the compilers killed
+        while self.has_queued_jobs() and \
+                self.resource_limiter.can_start_job(len(self.pending_jobs)):
+            if len(self.queued_jobs) > 0:
+                fn, args, on_done = self.queued_jobs.popleft()
+                future = self.executor.submit(fn, *args)
+            else:
+                chunk = self.queued_chunks.pop()
+                future = self.submit_chunk(chunk)
+                on_done = functools.partial(self.on_chunk_done, chunk)
+            self.pending_jobs[future] = (next(self.submission_counter),
+                                         on_done)
+
+    def handle_completed_jobs(self, done):
+        # Returns False if the run must be aborted
+        for future in sorted(done, key=lambda f: self.pending_jobs[f][0]):
+            _, on_done = self.pending_jobs.pop(future)
+            if not on_done(future):
+                for other_future in self.pending_jobs:
+                    other_future.cancel()
+                return False
+        return True
+
+    def postprocess_compiled_tests(self):
+        for config_index, tests in self.compiled_tests.items():
+            if config_index in self.baselines:
+                subtract_baseline_insns(tests, self.baselines[config_index])
+            else:
+                for test in tests:
+                    test.insns = None
+
+    def run(self, test_and_config_list):
+        ''' Compiles the tests of the given test and config list and of the
+            detected configs. The detected configs are appended to
+            test_and_config_list. Returns False if the run has been aborted.
+        '''
+        if self.config_detection is not None:
+            self.queue_detection()
+        for config_index, (config, tests_by_cat) in enumerate(
+                test_and_config_list):
+            self.start_config(config_index, config, tests_by_cat)
+
+        with self.resource_limiter, self.executor:
             try:
-                future.result()
-            except Exception as e:
-                for _, future in work_futures:
-                    future.cancel()
-                print("Failed to compile...", file=stdout)
-                print(e, file=stderr)
-                return
-            print(f'Compiled {processed_pos}/{total_test_count}', file=stdout)
+                self.submit_queued_jobs()
+
+                while len(self.pending_jobs) > 0:
+                    # While jobs are waiting for resources, we need to check
+                    # periodically whether they can be started
+                    wait_timeout = None
+                    if self.has_queued_jobs():
+                        wait_timeout = self.resource_limiter.get_poll_interval()
+                    done, _ = futures.wait(list(self.pending_jobs.keys()),
+                                           timeout=wait_timeout,
+                                           return_when=futures.FIRST_COMPLETED)
+                    if not self.handle_completed_jobs(done):
+                        return False
+
+                    self.resource_limiter.release_unused_tokens(
+                        len(self.pending_jobs))
+                    self.submit_queued_jobs()
+            finally:
+                self.postprocess_compiled_tests()
+                test_and_config_list.extend(
+                    self.detected_tests[i]
+                    for i in sorted(self.detected_tests.keys()))
+        return True
+
+
+def perform_all_tests(libsimdpp_path, compiler, test_and_config_list,
+                      tests_per_file, stdout=sys.stdout, stderr=sys.stderr,
+                      cache=None, use_pch=False, isolate_failures=False,
+                      timeout=None, chunk_target_seconds=None,
+                      compile_time_history=None, test_source=None,
+                      use_asyncio=False, jobs=None, max_memory=None,
+                      use_jobserver=True, executor_factory=None,
+                      config_detection=None):
+    ''' Compiles all tests in the given test and config list. By default the
+        whole run is aborted if any compilation fails. If isolate_failures is
+        set, a failing chunk is recursively split in halves until the failing
+        tests are found. These are marked as failed and all other tests still
+        complete. Compilations that run longer than timeout seconds are
+        treated as failed.
+
+        By default tests are split into chunks of tests_per_file tests. If
+        chunk_target_seconds is set, chunks are sized so that the estimated
+        compile time of each is close to the given value, with
+        tests_per_file acting as the upper limit. The estimates come from
+        compile_time_history, which is updated with the measured times.
+
+        Worker processes receive the tests from test_source, which must
+        contain all tests in test_and_config_list, with configs in the same
+        order. If it is None, a TestSource is created from
+        test_and_config_list. The results are returned from the workers in
+        compact form and are assigned to the insns member of the tests.
+
+        If use_asyncio is set, the compilers are run from an asyncio event
+        loop in the current process instead of a pool of worker processes.
+
+        At most jobs compilations run at once. By default the number of jobs
+        depends on the CPUs available to the process. New compilations are
+        started only while there is enough free memory for them, and, if
+        max_memory is set, while the compilers use less than max_memory
+        bytes in total. If use_jobserver is set and the process has been
+        started by GNU make with jobserver enabled, a token is acquired from
+        the jobserver for each compilation, except the first one.
+
+        If executor_factory is set, it is called with the WorkerContext and
+        must return the executor to run the compilations on. The executor
+        must support the job functions of the process pool. Such executor
+        is assumed to run the compilations elsewhere, thus neither the local
+        memory nor the jobserver limit the number of jobs.
+
+        If config_detection is set, the support of the instruction set
+        configs it describes is detected on the same executor. The tests of
+        each supported config are queued for compilation as soon as its
+        detection completes, so that the compilers don't idle while waiting
+        for the detection of other configs. The supported configs and their
+        tests are appended to test_and_config_list in the order of
+        config_detection.configs. Configs that are equivalent to an already
+        detected config are not compiled, they share the tests with that
+        config instead. test_source must have regenerate set in this case.
+
+        Precompiled headers and the detection of further configs unblock
+        more work, thus are started before any remaining chunks. The chunks
+        of a config don't wait for its baseline: the raw instruction counts
+        are collected and the baseline is subtracted from all tests of each
+        config in a single batch once the run completes. Tests of configs
+        whose baseline could not be compiled are left marked as failed.
+    '''
+    if test_source is None:
+        test_source = TestSource(test_and_config_list)
+    if config_detection is not None and not test_source.regenerate:
+        raise Exception('Config detection requires tests that can be ' +
+                        'regenerated by the workers')
+
+    if jobs is None:
+        jobs = get_default_job_count()
+    runs_locally = executor_factory is None
+    jobserver = None
+    if use_jobserver and runs_locally:
+        jobserver = JobserverClient.from_environment()
+    resource_limiter = ResourceLimiter(jobs, max_memory, jobserver=jobserver,
+                                       check_memory=runs_locally)
+    print(f"Using {jobs} threads\n", file=stdout)
+
+    # we deliberately don't use tempfile.TemporaryDirectory() so that
+    # the result of failed compilations is preserved if an exception is
+    # raised
+    tmp_dir = tempfile.mkdtemp()
+
+    worker_context = WorkerContext(libsimdpp_path, tmp_dir, compiler,
+                                   test_source, cache, timeout)
+
+    if executor_factory is not None:
+        executor = executor_factory(worker_context)
+    elif use_asyncio:
+        executor = AsyncioExecutor(max_workers=jobs,
+                                   initializer=init_worker,
+                                   initargs=(worker_context,))
+    else:
+        executor = futures.ProcessPoolExecutor(max_workers=jobs,
+                                               initializer=init_worker,
+                                               initargs=(worker_context,))
+    job_functions = get_job_functions(use_asyncio and
+                                      executor_factory is None)
 
+    scheduler = CompilationScheduler(
+        worker_context, executor, job_functions, resource_limiter,
+        tests_per_file, stdout=stdout, stderr=stderr, use_pch=use_pch,
+        isolate_failures=isolate_failures,
+        chunk_target_seconds=chunk_target_seconds,
+        compile_time_history=compile_time_history,
+        config_detection=config_detection)
+    if scheduler.run(test_and_config_list):
         shutil.rmtree(tmp_dir)
@@ -17,7 +17,11 @@
 
 from __future__ import print_function
 
+import bisect
+import itertools
 import re
+from array import array
+from types import MappingProxyType
 
 
 class AsmFunction:
@@ -63,73 +67,311 @@ def parse_function_name(line):
     if m is not None:
         return m.group(1)
 
-    m = re.match(r'_(\w*)\s*PROC.*', line)
+    m = re.match(r'_?(\w*)\s*PROC.*', line)
     if m is not None:
         return m.group(1)
 
     return None
 
 
-def parse_compiler_asm_output(output):
-    ''' Parses given compiler output string to a list of AsmFunction
+class AsmFunctionParser:
+
+    ''' Parses compiler output incrementally. The output may be passed to
+        parse() in any number of batches of lines, the parser state is kept
+        between the calls. finish() returns the last function, if any, once
+        all lines have been parsed. The arguments are as in
+        iter_compiler_asm_functions.
     '''
-    lines = output.split("\n")
 
-    functions = []
-    cur_function = None
+    def __init__(self, function_filter=None, canonical_insns=None):
+        if canonical_insns is None:
+            canonical_insns = {}
+        self.function_filter = function_filter
+        self.canonical_insns = canonical_insns
+        self.cur_function = None
+        self.skip_function = True
 
-    for line in lines:
-        if len(line) == 0:
-            continue
+    def parse(self, lines):
+        # Yields the AsmFunction instances that the given lines complete. The
+        # returned iterator must be consumed fully before parse() or
+        # finish() is called again.
+        function_filter = self.function_filter
+        canonical_insns = self.canonical_insns
+        cur_function = self.cur_function
+        skip_function = self.skip_function
 
-        insn = parse_instruction(line)
-        if insn:
-            if cur_function is None:
+        for line in lines:
+            if len(line) == 0:
                 continue
-            cur_function.add(insn)
-        else:
-            function_name = parse_function_name(line)
-            if function_name is not None:
-                if cur_function is not None:
-                    functions.append(cur_function)
-                cur_function = AsmFunction(function_name)
 
-    if cur_function is not None:
-        functions.append(cur_function)
-    return functions
+            if line[0] in ' \t':
+                if skip_function:
+                    continue
+                insn = parse_instruction(line)
+                if insn:
+                    cur_function.add(canonical_insns.get(insn, insn))
+            else:
+                function_name = parse_function_name(line)
+                if function_name is not None:
+                    if not skip_function:
+                        yield cur_function
+                    cur_function = AsmFunction(function_name)
+                    skip_function = function_filter is not None and \
+                        not function_filter(function_name)
+
+        self.cur_function = cur_function
+        self.skip_function = skip_function
+
+    def finish(self):
+        ret = None
+        if not self.skip_function:
+            ret = self.cur_function
+        self.cur_function = None
+        self.skip_function = True
+        return ret
+
+
+def iter_compiler_asm_functions(lines, function_filter=None,
+                                canonical_insns=None):
+    ''' Parses given lines of compiler output and yields AsmFunction instances
+        one at a time. If function_filter is given, only the functions whose
+        name it accepts are yielded. The instructions of the rest of the
+        functions are skipped without being parsed. If canonical_insns is
+        given, instructions that are present in it are replaced with the
+        corresponding canonical instructions, see get_canonical_insns.
+    '''
+    parser = AsmFunctionParser(function_filter, canonical_insns)
+    yield from parser.parse(lines)
+    function = parser.finish()
+    if function is not None:
+        yield function
+
+
+def parse_compiler_asm_output(output, canonical_insns=None):
+    ''' Parses given compiler output string to a list of AsmFunction
+    '''
+    return list(iter_compiler_asm_functions(output.split("\n"),
+                                            canonical_insns=canonical_insns))
+
+
+def parse_compiler_asm_file(path, function_filter=None,
+                            canonical_insns=None):
+    ''' Parses the compiler output stored in the given file and yields
+        AsmFunction instances one at a time. The file is read incrementally,
+        thus memory usage does not depend on the size of the file.
+    '''
+    with open(path, 'r', errors='ignore') as in_f:
+        for function in iter_compiler_asm_functions(in_f, function_filter,
+                                                    canonical_insns):
+            yield function
+
+
+# The vocabulary of instruction names that InsnCount instances refer to. Each
+# name is stored once per process, thus ids must not be passed to other
+# processes.
+_insn_ids = {}
+_insn_names = []
+
+
+def intern_insn(insn):
+    # Returns the id of the given instruction name
+    insn_id = _insn_ids.get(insn)
+    if insn_id is None:
+        insn_id = len(_insn_names)
+        _insn_ids[insn] = insn_id
+        _insn_names.append(insn)
+    return insn_id
+
+
+def get_insn_name(insn_id):
+    return _insn_names[insn_id]
 
 
 class InsnCount:
 
     ''' Represents a mapping between instruction name and instruction count.
+
+        The counts are stored as a sparse array of (id, count) pairs sorted
+        by the instruction id as returned by intern_insn(). Only nonzero
+        counts are stored. A single flat array per instance takes a fraction
+        of the memory of a dict, which matters when the results of all tests
+        of all configs are held in memory. The insns property provides a
+        read-only dict view for convenience; counts are modified via the
+        methods of this class.
     '''
 
+    __slots__ = ('data',)
+
     def __init__(self):
-        self.insns = {}
+        # Contains id0, count0, id1, count1, ...
+        self.data = array('i')
 
     @staticmethod
-    def from_insn_list(insns):
+    def from_sorted_pairs(pairs):
+        # Creates an instance from (id, count) pairs sorted by id. The counts
+        # must be nonzero.
         ic = InsnCount()
-        for insn in insns:
-            ic.add_insn(insn)
+        ic.data = array('i', itertools.chain.from_iterable(pairs))
         return ic
 
+    @staticmethod
+    def from_dict(insns):
+        return InsnCount.from_sorted_pairs(sorted(
+            (intern_insn(insn), count) for insn, count in insns.items()
+            if count != 0))
+
+    @staticmethod
+    def from_insn_list(insns):
+        counts = {}
+        for insn in insns:
+            counts[insn] = counts.get(insn, 0) + 1
+        return InsnCount.from_dict(counts)
+
+    @property
+    def insns(self):
+        return MappingProxyType(self.to_dict())
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def items(self):
+        return [(_insn_names[insn_id], count)
+                for insn_id, count in zip(self.data[0::2], self.data[1::2])]
+
+    def find_insn_id(self, insn_id):
+        # Returns the index of the pair with the given id within data or the
+        # index at which such pair would be inserted
+        data = self.data
+        lo = 0
+        hi = len(data) // 2
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if data[2 * mid] < insn_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        return 2 * lo
+
+    def get(self, insn):
+        insn_id = _insn_ids.get(insn)
+        if insn_id is None:
+            return 0
+        pos = self.find_insn_id(insn_id)
+        if pos < len(self.data) and self.data[pos] == insn_id:
+            return self.data[pos + 1]
+        return 0
+
     def add_insn(self, insn, count=1):
-        if insn in self.insns:
-            self.insns[insn] += count
-            if self.insns[insn] == 0:
-                del self.insns[insn]
-        elif count != 0:
-            self.insns[insn] = count
+        self.add_insn_id(intern_insn(insn), count)
 
     def sub_insn(self, insn, count=1):
-        if insn in self.insns:
-            self.insns[insn] -= count
-            if self.insns[insn] == 0:
-                del self.insns[insn]
+        self.add_insn(insn, -count)
+
+    def add_insn_id(self, insn_id, count):
+        data = self.data
+        pos = self.find_insn_id(insn_id)
+        if pos < len(data) and data[pos] == insn_id:
+            new_count = data[pos + 1] + count
+            if new_count == 0:
+                del data[pos:pos + 2]
+            else:
+                data[pos + 1] = new_count
         elif count != 0:
-            self.insns[insn] = -count
+            data[pos:pos] = array('i', (insn_id, count))
+
+    def merge(self, other, factor=1):
+        ''' Adds the counts of other multiplied by factor to the counts of
+            this instance. The result is built in a single pass over the
+            sorted pairs: the runs of pairs of this instance between the
+            instructions of other are copied as whole slices, which is
+            efficient when other has few instructions, such as the baseline
+            that is subtracted from each test.
+        '''
+        data = self.data
+        other_data = other.data
+        if len(other_data) == 0 or factor == 0:
+            return
+        ids = data[0::2]
+        size = len(data)
+        ret = array('i')
+        pos = 0
+        for i in range(0, len(other_data), 2):
+            insn_id = other_data[i]
+            next_pos = 2 * bisect.bisect_left(ids, insn_id, pos // 2)
+            ret += data[pos:next_pos]
+            count = other_data[i + 1] * factor
+            if next_pos < size and ids[next_pos // 2] == insn_id:
+                count += data[next_pos + 1]
+                next_pos += 2
+            if count != 0:
+                ret.append(insn_id)
+                ret.append(count)
+            pos = next_pos
+        ret += data[pos:]
+        self.data = ret
+
+    def add(self, other):
+        self.merge(other, 1)
 
     def sub(self, other):
-        for insn, count in other.insns.items():
-            self.sub_insn(insn, count)
+        self.merge(other, -1)
+
+    def __eq__(self, other):
+        if not isinstance(other, InsnCount):
+            return NotImplemented
+        return self.data == other.data
+
+    def __repr__(self):
+        return f'InsnCount({self.to_dict()})'
+
+    def __deepcopy__(self, memo):
+        ic = InsnCount()
+        ic.data = array('i', self.data)
+        return ic
+
+    # The ids are valid only within the current process, thus the counts are
+    # pickled by instruction names
+    def __getstate__(self):
+        return self.to_dict()
+
+    def __setstate__(self, state):
+        self.data = InsnCount.from_dict(state).data
+
+
+def encode_insn_counts(insn_counts):
+    ''' Encodes a list of InsnCount instances into a compact form that is
+        cheap to pass between processes. Instruction names are stored only
+        once and the counts are stored in flat integer arrays.
+    '''
+    # Maps the ids of the vocabulary of this process to the ids within the
+    # encoded data
+    vocabulary = {}
+    offsets = array('i', [0])
+    insn_ids = array('i')
+    counts = array('i')
+    for insn_count in insn_counts:
+        for insn_id in insn_count.data[0::2]:
+            encoded_id = vocabulary.get(insn_id)
+            if encoded_id is None:
+                encoded_id = len(vocabulary)
+                vocabulary[insn_id] = encoded_id
+            insn_ids.append(encoded_id)
+        counts.extend(insn_count.data[1::2])
+        offsets.append(len(insn_ids))
+
+    names = [get_insn_name(insn_id)
+             for insn_id in sorted(vocabulary, key=vocabulary.get)]
+    return (names, offsets, insn_ids, counts)
+
+
+def decode_insn_counts(data):
+    ''' Decodes the value returned by encode_insn_counts back to a list of
+        InsnCount instances
+    '''
+    names, offsets, insn_ids, counts = data
+    local_ids = [intern_insn(name) for name in names]
+    ret = []
+    for begin, end in zip(offsets[:-1], offsets[1:]):
+        ret.append(InsnCount.from_sorted_pairs(sorted(
+            (local_ids[insn_ids[i]], counts[i]) for i in range(begin, end))))
+    return ret
@@ -0,0 +1,109 @@
+#   Copyright (C) 2018  Povilas Kanapickas <povilas@radix.lt>
+#
+#   This file is part of libsimdpp asm tests
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see http://www.gnu.org/licenses/.
+
+from __future__ import print_function
+
+import asyncio
+import multiprocessing
+import threading
+from concurrent import futures
+
+
+class AsyncioExecutor(futures.Executor):
+
+    ''' An executor that runs coroutine functions on an asyncio event loop in
+        a background thread. The futures returned by submit() are regular
+        concurrent.futures.Future instances, so this executor can be used in
+        place of ProcessPoolExecutor as long as the submitted functions are
+        coroutine functions.
+
+        At most max_workers submitted functions run at once. They are started
+        in the order they were submitted. CPU-bound work such as parsing of
+        compiler output should be passed to loop.run_in_executor(None, ...)
+        which runs it on a pool of parse_workers threads so that the event
+        loop is not blocked.
+    '''
+
+    def __init__(self, max_workers, initializer=None, initargs=(),
+                 parse_workers=None):
+        if parse_workers is None:
+            parse_workers = min(4, multiprocessing.cpu_count())
+
+        self._loop = asyncio.new_event_loop()
+        self._parse_executor = futures.ThreadPoolExecutor(
+            max_workers=max(1, parse_workers))
+        self._loop.set_default_executor(self._parse_executor)
+        self._tasks = set()
+        self._shutdown = False
+
+        self._thread = threading.Thread(target=self._run_loop, daemon=True)
+        self._thread.start()
+
+        # the semaphore must be created within the running loop on older
+        # python versions
+        self._semaphore = self._call_in_loop(
+            self._create_semaphore(max(1, max_workers)))
+
+        # All functions run in the same process, thus the initializer needs
+        # to be called only once
+        if initializer is not None:
+            initializer(*initargs)
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def _call_in_loop(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    async def _create_semaphore(self, max_workers):
+        return asyncio.Semaphore(max_workers)
+
+    async def _run(self, fn, args, kwargs):
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        try:
+            async with self._semaphore:
+                return await fn(*args, **kwargs)
+        finally:
+            self._tasks.discard(task)
+
+    async def _wait_all_tasks(self, cancel):
+        if cancel:
+            for task in self._tasks:
+                task.cancel()
+        while len(self._tasks) > 0:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def submit(self, fn, *args, **kwargs):
+        if self._shutdown:
+            raise RuntimeError('cannot schedule new futures after shutdown')
+        return asyncio.run_coroutine_threadsafe(self._run(fn, args, kwargs),
+                                                self._loop)
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        if self._shutdown:
+            return
+        self._shutdown = True
+
+        # Tasks of cancelled futures may still be cleaning up, e.g. killing
+        # their subprocesses, so we wait for them even if wait is False
+        self._call_in_loop(self._wait_all_tasks(cancel_futures))
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._parse_executor.shutdown(wait=wait)
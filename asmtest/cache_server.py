@@ -0,0 +1,130 @@
+#   Copyright (C) 2018  Povilas Kanapickas <povilas@radix.lt>
+#
+#   This file is part of libsimdpp asm tests
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see http://www.gnu.org/licenses/.
+
+''' A simple HTTP key-value store for RemoteResultCache.
+
+    GET /<key> returns the entry for the given key or 404 if there's none.
+    PUT /<key> stores the request body as the entry for the given key. The
+    entries are stored in the same layout as used by ResultCache, so an
+    existing --cache_dir can be served directly.
+
+    Usage: python3 -m asmtest.cache_server <cache_dir> [--host H] [--port P]
+'''
+
+from __future__ import print_function
+
+import argparse
+import os
+from http import server
+
+from asmtest.result_cache import decode_cache_entry
+from asmtest.result_cache import get_cache_entry_path
+from asmtest.result_cache import is_valid_cache_key
+from asmtest.utils import write_file_atomically
+
+MAX_ENTRY_SIZE = 64 * 1024 * 1024
+
+
+class CacheRequestHandler(server.BaseHTTPRequestHandler):
+
+    def get_key(self):
+        # Returns the key from the request path or None after sending an
+        # error response
+        key = self.path.lstrip('/')
+        if not is_valid_cache_key(key):
+            self.send_error(400, 'Invalid key')
+            return None
+        return key
+
+    def send_body(self, code, body):
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        key = self.get_key()
+        if key is None:
+            return
+        try:
+            path = get_cache_entry_path(self.server.cache_dir, key)
+            with open(path, 'rb') as in_f:
+                body = in_f.read()
+        except (IOError, OSError):
+            self.send_error(404)
+            return
+        self.send_body(200, body)
+
+    def do_PUT(self):
+        key = self.get_key()
+        if key is None:
+            return
+        size = int(self.headers.get('Content-Length', 0))
+        if size > MAX_ENTRY_SIZE:
+            self.send_error(413)
+            return
+        data = self.rfile.read(size).decode('utf-8', errors='replace')
+        if decode_cache_entry(data) is None:
+            self.send_error(400, 'Invalid cache entry')
+            return
+        write_file_atomically(
+            get_cache_entry_path(self.server.cache_dir, key), data)
+        self.send_body(201, b'')
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class CacheServer(server.ThreadingHTTPServer):
+
+    def __init__(self, address, cache_dir, verbose=False):
+        super().__init__(address, CacheRequestHandler)
+        self.cache_dir = cache_dir
+        self.verbose = verbose
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='cache_server')
+    parser.add_argument(
+        'cache_dir', type=str,
+        help='The directory to store the cache entries in')
+    parser.add_argument(
+        '--host', type=str, default='127.0.0.1',
+        help='The address to listen on')
+    parser.add_argument(
+        '--port', type=int, default=8642,
+        help='The port to listen on')
+    parser.add_argument(
+        '--verbose', action='store_true', default=False,
+        help='If set, logs each request')
+    args = parser.parse_args()
+
+    cache_dir = os.path.abspath(args.cache_dir)
+    httpd = CacheServer((args.host, args.port), cache_dir,
+                        verbose=args.verbose)
+    print(f'Serving {cache_dir} at http://{args.host}:{httpd.server_port}')
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
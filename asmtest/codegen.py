@@ -125,3 +125,27 @@ def get_code_for_testing_insn_set_support(insn_set_config, capabilities):
         parts.append(get_code_for_single_capability(cap))
 
     return ''.join(parts)
+
+
+def get_code_for_single_capability_macro(cap):
+    return '''
+#ifdef SIMDPP_HAS_{0}
+#if SIMDPP_HAS_{0}
+#define asmtest_has_{0}_cap
+#else
+#define asmtest_has_no_{0}_cap
+#endif
+#endif
+'''.format(cap)
+
+
+def get_code_for_preprocessing_insn_set_support(insn_set_config,
+                                                capabilities):
+    # The same as get_code_for_testing_insn_set_support, except that the
+    # capabilities are reported as macros, so that they can be read from
+    # the macro definitions output by the preprocessor
+    parts = [get_code_for_file_header(insn_set_config)]
+    for cap in capabilities:
+        parts.append(get_code_for_single_capability_macro(cap))
+
+    return ''.join(parts)
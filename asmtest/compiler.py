@@ -17,30 +17,48 @@
 
 from __future__ import print_function
 
-import copy
-import multiprocessing
+import asyncio
+import hashlib
 import os
 import re
 import sys
 import tempfile
-from concurrent import futures
 
 from asmtest.asm_parser import parse_compiler_asm_output
+from asmtest.codegen import get_code_for_file_header
+from asmtest.codegen import get_code_for_preprocessing_insn_set_support
 from asmtest.codegen import get_code_for_testing_insn_set_support
 from asmtest.insn_set import InsnSet
 from asmtest.insn_set import get_all_capabilities
-from asmtest.insn_set import get_all_insn_set_configs
 from asmtest.utils import call_program
+from asmtest.utils import call_program_async
+from asmtest.utils import iter_program_output_lines
+from asmtest.utils import iter_program_output_lines_async
 from asmtest.utils import rmtree_with_retry
 
 
 class CompilerInvocation:
 
-    def __init__(self, insn_set, simdpp_path, src_path, dst_path):
+    def __init__(self, insn_set, simdpp_path, src_path, dst_path,
+                 pch_path=None, is_pch_build=False, is_pipe=False,
+                 is_preprocess=False):
         self.insn_set = insn_set
         self.simdpp_path = simdpp_path
         self.src_path = src_path
         self.dst_path = dst_path
+        # If set, identifies precompiled header to use. The value is the path
+        # returned by build_precompiled_header()
+        self.pch_path = pch_path
+        # If set, src_path refers to a header which is compiled to a
+        # precompiled header at dst_path
+        self.is_pch_build = is_pch_build
+        # If set, the source is read from standard input and the assembly is
+        # written to standard output. src_path and dst_path are ignored.
+        self.is_pipe = is_pipe
+        # If set, the source is only preprocessed. Only supported together
+        # with is_pipe, in which case the macros defined at the end of the
+        # source are written to standard output instead of the assembly.
+        self.is_preprocess = is_preprocess
 
 
 class CompilerBase(object):
@@ -54,6 +72,29 @@ class CompilerBase(object):
     def write_command_file(self, invocation, path):
         raise NotImplementedError()
 
+    def supports_pch(self):
+        return False
+
+    def get_pch_output_path(self, header_path):
+        raise NotImplementedError()
+
+    def supports_pipe_compilation(self):
+        return False
+
+    def get_pipe_command(self, invocation):
+        raise NotImplementedError()
+
+    def supports_preprocessor_probe(self):
+        # Whether the instruction set support can be detected by only
+        # preprocessing the code via preprocess_code()
+        return False
+
+    def get_component_paths(self):
+        # Returns the paths of the programs other than the one at path that
+        # produce the compiler output, such as the compiler proper behind a
+        # driver
+        return []
+
     def add_insn_set_flags(self, insn_to_flags, flags, insn_sets):
         for insn_set in insn_sets:
             found = False
@@ -74,14 +115,67 @@ class CompilerGccBase(CompilerBase):
         cmd = ['"{0}"'.format(arg) for arg in cmd]
         return ' '.join(cmd)
 
+    def supports_pch(self):
+        return self.name in ['gcc', 'clang']
+
+    def get_pch_output_path(self, header_path):
+        if self.name == 'clang':
+            return header_path + '.pch'
+        # GCC looks for the precompiled header next to the included header
+        return header_path + '.gch'
+
+    def supports_pipe_compilation(self):
+        return self.name in ['gcc', 'clang'] and \
+            sys.platform.startswith('linux')
+
+    def get_pipe_command(self, invocation):
+        return [self.path] + self.get_flags(invocation)
+
+    def supports_preprocessor_probe(self):
+        return self.supports_pipe_compilation()
+
+    def get_component_paths(self):
+        # The GCC driver runs cc1plus, which may change without the driver
+        # changing. clang compiles within the driver binary itself. GCC
+        # prints just the name if it can't find the program.
+        if self.name != 'gcc':
+            return []
+        try:
+            path = call_program([self.path, '-print-prog-name=cc1plus'])
+        except Exception:
+            return []
+        path = path.strip()
+        if not os.path.isabs(path) or not os.path.isfile(path):
+            return []
+        return [path]
+
+    def get_pch_use_flags(self, header_path):
+        if self.name == 'clang':
+            return ['-include-pch', self.get_pch_output_path(header_path)]
+        return ['-include', header_path, '-Winvalid-pch']
+
     def get_flags(self, invocation):
-        return [
-            '-c', invocation.src_path, '-o', invocation.dst_path,
+        if invocation.is_pch_build:
+            flags = ['-x', 'c++-header', invocation.src_path,
+                     '-o', invocation.dst_path]
+        else:
+            if invocation.is_pipe:
+                output_flags = ['-S']
+                if invocation.is_preprocess:
+                    output_flags = ['-E', '-dM']
+                flags = ['-x', 'c++', '-'] + output_flags + ['-o', '-']
+            else:
+                flags = ['-c', invocation.src_path, '-o', invocation.dst_path,
+                         '--save-temps']
+            if invocation.pch_path is not None:
+                flags += self.get_pch_use_flags(invocation.pch_path)
+
+        # Flags must be the same when building and using precompiled headers
+        return flags + [
             # Needed for successful compilation
             '-std=c++11', '-I' + invocation.simdpp_path,
             # Needed to get clean asm output
-            '-O2', '-g0', '--save-temps', '-fomit-frame-pointer',
-            '-fno-stack-protector'
+            '-O2', '-g0', '-fomit-frame-pointer', '-fno-stack-protector'
         ]
 
 
@@ -339,51 +433,203 @@ def detect_compiler(compiler_path_or_id):
     return None
 
 
-def call_program_file(path, cwd):
+def get_program_file_command(path):
     if sys.platform == 'win32':
-        cmd = ['cmd', '/C', path]
-    else:
-        cmd = ['/bin/bash', path]
-    call_program(cmd, check_returncode=True, cwd=cwd)
+        return ['cmd', '/C', path]
+    return ['/bin/bash', path]
 
 
-def compile_code_to_asm(libsimdpp_path, compiler, insn_set_config,
-                        code, test_dir):
-    # returns output assembly or raises exception on error. The artifacts are
-    # put into test_dir
-    src_path = os.path.join(test_dir, 'test.cc')
-    dst_path = os.path.join(test_dir, 'test.o')
+def call_program_file(path, cwd, timeout=None):
+    call_program(get_program_file_command(path), check_returncode=True,
+                 cwd=cwd, timeout=timeout)
+
+
+def write_compiler_command_file(compiler, invocation, test_dir):
     command_path = os.path.join(test_dir, 'compiler.cmd')
+    with open(command_path, 'w') as out_f:
+        out_f.write(compiler.get_command(invocation) + '\n')
+    return command_path
 
-    asm_extensions = ['.s', '.asm']
-    asm_paths = [os.path.join(test_dir, 'test'+ext)
-                 for ext in asm_extensions]
+
+def run_compiler_invocation(compiler, invocation, test_dir, timeout=None):
+    command_path = write_compiler_command_file(compiler, invocation, test_dir)
+    call_program_file(command_path, test_dir, timeout=timeout)
+
+
+async def run_compiler_invocation_async(compiler, invocation, test_dir,
+                                        timeout=None):
+    command_path = write_compiler_command_file(compiler, invocation, test_dir)
+    await call_program_async(get_program_file_command(command_path),
+                             cwd=test_dir, timeout=timeout)
+
+
+def create_precompiled_header_invocation(libsimdpp_path, compiler,
+                                         insn_set_config, pch_dir):
+    # Writes the header to precompile to pch_dir and returns a tuple
+    # containing the path to the header and the compiler invocation that
+    # builds the precompiled header
+    header_path = os.path.join(pch_dir, 'simdpp_pch.h')
+    with open(header_path, 'w') as out_f:
+        out_f.write(get_code_for_file_header(insn_set_config))
+
+    invocation = CompilerInvocation(insn_set_config, libsimdpp_path,
+                                    header_path,
+                                    compiler.get_pch_output_path(header_path),
+                                    is_pch_build=True)
+    return header_path, invocation
+
+
+def build_precompiled_header(libsimdpp_path, compiler, insn_set_config,
+                             pch_dir):
+    # returns the path to pass as pch_path to compile_code_to_asm or None if
+    # the compiler does not support precompiled headers. Raises exception on
+    # error.
+    if not compiler.supports_pch():
+        return None
+
+    header_path, invocation = create_precompiled_header_invocation(
+        libsimdpp_path, compiler, insn_set_config, pch_dir)
+    run_compiler_invocation(compiler, invocation, pch_dir)
+    return header_path
+
+
+async def build_precompiled_header_async(libsimdpp_path, compiler,
+                                         insn_set_config, pch_dir):
+    # asyncio equivalent of build_precompiled_header
+    if not compiler.supports_pch():
+        return None
+
+    header_path, invocation = create_precompiled_header_invocation(
+        libsimdpp_path, compiler, insn_set_config, pch_dir)
+    await run_compiler_invocation_async(compiler, invocation, pch_dir)
+    return header_path
+
+
+def create_asm_file_invocation(libsimdpp_path, compiler, insn_set_config,
+                               code, test_dir, pch_path=None):
+    # Writes the code to test_dir and returns the compiler invocation that
+    # compiles it
+    src_path = os.path.join(test_dir, 'test.cc')
+    dst_path = os.path.join(test_dir, 'test.o')
 
     with open(src_path, 'w') as out_f:
         out_f.write(code)
 
-    invocation = CompilerInvocation(insn_set_config, libsimdpp_path,
-                                    src_path, dst_path)
+    return CompilerInvocation(insn_set_config, libsimdpp_path,
+                              src_path, dst_path, pch_path=pch_path)
 
-    with open(command_path, 'w') as out_f:
-        out_f.write(compiler.get_command(invocation) + '\n')
 
-    call_program_file(command_path, test_dir)
+def find_asm_output_file(test_dir):
+    asm_extensions = ['.s', '.asm']
+    asm_paths = [os.path.join(test_dir, 'test'+ext)
+                 for ext in asm_extensions]
 
     for asm_path in asm_paths:
-        try:
-            with open(asm_path, 'r') as in_f:
-                return in_f.read()
-        except Exception:
-            pass
+        if os.path.isfile(asm_path):
+            return asm_path
 
     raise Exception('Could not find assembly output file')
 
 
-def parse_supported_capabilities(asm, capabilities):
-    functions = parse_compiler_asm_output(asm)
-    function_names = [f.name for f in functions]
+def compile_code_to_asm_file(libsimdpp_path, compiler, insn_set_config,
+                             code, test_dir, pch_path=None, timeout=None):
+    # returns the path to the output assembly file or raises exception on
+    # error. The artifacts are put into test_dir
+    invocation = create_asm_file_invocation(libsimdpp_path, compiler,
+                                            insn_set_config, code, test_dir,
+                                            pch_path=pch_path)
+    run_compiler_invocation(compiler, invocation, test_dir, timeout=timeout)
+    return find_asm_output_file(test_dir)
+
+
+async def compile_code_to_asm_file_async(libsimdpp_path, compiler,
+                                         insn_set_config, code, test_dir,
+                                         pch_path=None, timeout=None):
+    # asyncio equivalent of compile_code_to_asm_file
+    invocation = create_asm_file_invocation(libsimdpp_path, compiler,
+                                            insn_set_config, code, test_dir,
+                                            pch_path=pch_path)
+    await run_compiler_invocation_async(compiler, invocation, test_dir,
+                                        timeout=timeout)
+    return find_asm_output_file(test_dir)
+
+
+def compile_code_to_asm(libsimdpp_path, compiler, insn_set_config,
+                        code, test_dir, pch_path=None, timeout=None):
+    # returns output assembly or raises exception on error. The artifacts are
+    # put into test_dir
+    asm_path = compile_code_to_asm_file(libsimdpp_path, compiler,
+                                        insn_set_config, code, test_dir,
+                                        pch_path=pch_path, timeout=timeout)
+    with open(asm_path, 'r') as in_f:
+        return in_f.read()
+
+
+def compile_code_to_asm_lines(libsimdpp_path, compiler, insn_set_config,
+                              code, pch_path=None, timeout=None):
+    # returns an iterator over the lines of output assembly. The code is
+    # passed to the compiler via a pipe and nothing is written to disk. Must
+    # be used only if compiler.supports_pipe_compilation() returns True. An
+    # exception is raised on error once the output has been consumed.
+    invocation = CompilerInvocation(insn_set_config, libsimdpp_path,
+                                    None, None, pch_path=pch_path,
+                                    is_pipe=True)
+    return iter_program_output_lines(compiler.get_pipe_command(invocation),
+                                     input=code, timeout=timeout)
+
 
+def compile_code_to_asm_lines_async(libsimdpp_path, compiler,
+                                    insn_set_config, code, pch_path=None,
+                                    timeout=None):
+    # asyncio equivalent of compile_code_to_asm_lines. Returns an
+    # asynchronous iterator over the lines of output assembly.
+    invocation = CompilerInvocation(insn_set_config, libsimdpp_path,
+                                    None, None, pch_path=pch_path,
+                                    is_pipe=True)
+    return iter_program_output_lines_async(
+        compiler.get_pipe_command(invocation), input=code, timeout=timeout)
+
+
+async def compile_code_to_asm_async(libsimdpp_path, compiler, insn_set_config,
+                                    code, test_dir, pch_path=None,
+                                    timeout=None):
+    # asyncio equivalent of compile_code_to_asm. Compiles via a pipe if the
+    # compiler supports that.
+    if compiler.supports_pipe_compilation():
+        return ''.join([line async for line in compile_code_to_asm_lines_async(
+            libsimdpp_path, compiler, insn_set_config, code,
+            pch_path=pch_path, timeout=timeout)])
+
+    asm_path = await compile_code_to_asm_file_async(
+        libsimdpp_path, compiler, insn_set_config, code, test_dir,
+        pch_path=pch_path, timeout=timeout)
+    with open(asm_path, 'r') as in_f:
+        return in_f.read()
+
+
+def preprocess_code(libsimdpp_path, compiler, insn_set_config, code,
+                    timeout=None):
+    # returns the #define directives of all macros defined at the end of the
+    # code, one per line. Must be used only if
+    # compiler.supports_preprocessor_probe() returns True.
+    invocation = CompilerInvocation(insn_set_config, libsimdpp_path,
+                                    None, None, is_pipe=True,
+                                    is_preprocess=True)
+    return call_program(compiler.get_pipe_command(invocation),
+                        input=code, timeout=timeout)
+
+
+async def preprocess_code_async(libsimdpp_path, compiler, insn_set_config,
+                                code, timeout=None):
+    # asyncio equivalent of preprocess_code
+    invocation = CompilerInvocation(insn_set_config, libsimdpp_path,
+                                    None, None, is_pipe=True,
+                                    is_preprocess=True)
+    return await call_program_async(compiler.get_pipe_command(invocation),
+                                    input=code, timeout=timeout)
+
+
+def select_supported_capabilities(function_names, capabilities, output):
     supported_capabilities = []
 
     for cap in capabilities:
@@ -393,11 +639,76 @@ def parse_supported_capabilities(asm, capabilities):
             pass
         else:
             raise Exception('Did not find capability in functions: '
-                            '"{0}"\n\nCompiler output:\n{1}'.format(cap, asm))
+                            '"{0}"\n\nCompiler output:\n{1}'.format(
+                                cap, output))
     return supported_capabilities
 
 
+def parse_supported_capabilities(asm, capabilities):
+    functions = parse_compiler_asm_output(asm)
+    function_names = [f.name for f in functions]
+    return select_supported_capabilities(function_names, capabilities, asm)
+
+
+def parse_preprocessed_capabilities(macros, capabilities):
+    # The markers are defined by the code generated by
+    # get_code_for_preprocessing_insn_set_support
+    function_names = set(re.findall(r'^#define asmtest_(has_\w+_cap)\b',
+                                    macros, re.MULTILINE))
+    return select_supported_capabilities(function_names, capabilities,
+                                         macros)
+
+
+def get_preprocessed_fingerprint(macros):
+    # Returns a hash of the macros defined by the compiler and libsimdpp.
+    # libsimdpp selects the code to use based on the macros it derives from
+    # the SIMDPP_ARCH_* macros of the config, and the compiler selects the
+    # instructions it may use for the rest of the code based on the flags,
+    # which are reflected in the predefined macros. The SIMDPP_ARCH_* macros
+    # themselves identify the config and are excluded, so that configs that
+    # end up with the same code have the same fingerprint.
+    lines = sorted(line for line in macros.splitlines()
+                   if not line.startswith('#define SIMDPP_ARCH_'))
+    return hashlib.sha256('\n'.join(lines).encode('utf-8')).hexdigest()
+
+
+def probe_insn_set_support(libsimdpp_path, compiler, insn_set_config):
+    # The same as detect_insn_set_support, except that the code is only
+    # preprocessed, which is much faster than compiling it. Unsupported
+    # instruction sets are rejected either by the compiler options or by
+    # #error directives within libsimdpp headers.
+    caps = get_all_capabilities()
+    code = get_code_for_preprocessing_insn_set_support(insn_set_config, caps)
+    try:
+        macros = preprocess_code(libsimdpp_path, compiler, insn_set_config,
+                                 code)
+    except Exception as e:
+        return False, [], None, str(e)
+    return (True, parse_preprocessed_capabilities(macros, caps),
+            get_preprocessed_fingerprint(macros), None)
+
+
+async def probe_insn_set_support_async(libsimdpp_path, compiler,
+                                       insn_set_config):
+    # asyncio equivalent of probe_insn_set_support
+    caps = get_all_capabilities()
+    code = get_code_for_preprocessing_insn_set_support(insn_set_config, caps)
+    try:
+        macros = await preprocess_code_async(libsimdpp_path, compiler,
+                                             insn_set_config, code)
+    except Exception as e:
+        return False, [], None, str(e)
+    return (True, parse_preprocessed_capabilities(macros, caps),
+            get_preprocessed_fingerprint(macros), None)
+
+
 def detect_insn_set_support(libsimdpp_path, compiler, insn_set_config):
+    # Returns a tuple (is_supported, capabilities, fingerprint, error). Only
+    # the preprocessor is run if the compiler supports that. Otherwise the
+    # fingerprint is None.
+    if compiler.supports_preprocessor_probe():
+        return probe_insn_set_support(libsimdpp_path, compiler,
+                                      insn_set_config)
     try:
         tmp_dir = tempfile.mkdtemp()
         caps = get_all_capabilities()
@@ -409,9 +720,9 @@ def detect_insn_set_support(libsimdpp_path, compiler, insn_set_config):
             asm = compile_code_to_asm(libsimdpp_path, compiler,
                                       insn_set_config, code, tmp_dir)
         except Exception as e:
-            return False, [], str(e)
+            return False, [], None, str(e)
 
-        return True, parse_supported_capabilities(asm, caps), None
+        return True, parse_supported_capabilities(asm, caps), None, None
 
     finally:
         # MSVC likes to keep files locked even after returning control to the
@@ -419,24 +730,27 @@ def detect_insn_set_support(libsimdpp_path, compiler, insn_set_config):
         rmtree_with_retry(tmp_dir)
 
 
-def detect_supported_insn_sets(libsimdpp_path, compiler):
-    supported_configs = []
-    unsupported_configs = []
-    all_configs = get_all_insn_set_configs()
-
-    num_threads = multiprocessing.cpu_count() + 1
-    with futures.ProcessPoolExecutor(max_workers=num_threads) as executor:
-        work_futures = [(config,
-                         executor.submit(detect_insn_set_support,
-                                         libsimdpp_path, compiler, config))
-                        for config in all_configs]
-
-        for config, future in work_futures:
-            is_supported, capabilities, error = future.result()
-            if is_supported:
-                config = copy.deepcopy(config)
-                config.capabilities = capabilities
-                supported_configs.append(config)
-            else:
-                unsupported_configs.append((config, error))
-    return supported_configs, unsupported_configs
+async def detect_insn_set_support_async(libsimdpp_path, compiler,
+                                        insn_set_config):
+    # asyncio equivalent of detect_insn_set_support
+    if compiler.supports_preprocessor_probe():
+        return await probe_insn_set_support_async(libsimdpp_path, compiler,
+                                                  insn_set_config)
+    loop = asyncio.get_running_loop()
+    try:
+        tmp_dir = tempfile.mkdtemp()
+        caps = get_all_capabilities()
+        code = get_code_for_testing_insn_set_support(insn_set_config, caps)
+        try:
+            asm = await compile_code_to_asm_async(libsimdpp_path, compiler,
+                                                  insn_set_config, code,
+                                                  tmp_dir)
+        except Exception as e:
+            return False, [], None, str(e)
+
+        capabilities = await loop.run_in_executor(
+            None, parse_supported_capabilities, asm, caps)
+        return True, capabilities, None, None
+
+    finally:
+        await loop.run_in_executor(None, rmtree_with_retry, tmp_dir)
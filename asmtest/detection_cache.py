@@ -0,0 +1,162 @@
+#   Copyright (C) 2018  Povilas Kanapickas <povilas@radix.lt>
+#
+#   This file is part of libsimdpp asm tests
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see http://www.gnu.org/licenses/.
+
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+
+from asmtest.compiler import create_compiler_by_name
+from asmtest.fingerprint import find_compiler_binary
+from asmtest.fingerprint import find_program
+from asmtest.fingerprint import get_file_fingerprint
+from asmtest.insn_set import InsnSetConfig
+from asmtest.utils import write_file_atomically
+
+
+def get_default_detection_cache_path():
+    cache_root = os.environ.get('XDG_CACHE_HOME')
+    if not cache_root:
+        cache_root = os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_root, 'libsimdpp-asm-tests', 'detection.json')
+
+
+def hash_strings(strings):
+    return hashlib.sha256('\n'.join(strings).encode('utf-8')).hexdigest()
+
+
+class DetectionCache:
+
+    ''' Persists the detected compiler and the instruction set configs it
+        supports in a JSON file, so that repeated runs don't need to run the
+        compiler to detect them.
+
+        Compilers are keyed by the path, size and modification time of the
+        compiler binary. The binary is not hashed, so that a run that finds
+        everything in the cache does not need to read it. The supported
+        configs are additionally keyed by the fingerprint of the libsimdpp
+        headers. Compilers that are not
+        given as a path to the binary, such as MSVC generator names, are not
+        cached.
+    '''
+
+    format_version = 3
+
+    def __init__(self, path):
+        self.path = path
+        self.compilers = {}
+        self.insn_sets = {}
+
+    @staticmethod
+    def load(path):
+        # Returns an empty cache if the file does not exist or is invalid
+        cache = DetectionCache(path)
+        try:
+            with open(path, 'r') as in_f:
+                json_data = json.load(in_f)
+        except (IOError, OSError, ValueError):
+            return cache
+        if not isinstance(json_data, dict) or \
+                json_data.get('format_version') != cache.format_version:
+            return cache
+        cache.compilers = json_data.get('compilers', {})
+        cache.insn_sets = json_data.get('insn_sets', {})
+        return cache
+
+    def save(self):
+        json_data = {
+            'format_version': self.format_version,
+            'compilers': self.compilers,
+            'insn_sets': self.insn_sets,
+        }
+        write_file_atomically(self.path, json.dumps(json_data, indent=2,
+                                                    sort_keys=True))
+
+    def get_binary_fingerprint(self, binary_path):
+        if binary_path is None:
+            return None
+        try:
+            return get_file_fingerprint(binary_path)
+        except (IOError, OSError):
+            return None
+
+    def get_compiler_key(self, compiler_path):
+        fingerprint = self.get_binary_fingerprint(find_program(compiler_path))
+        if fingerprint is None:
+            return None
+        return hash_strings([fingerprint])
+
+    def get_compiler(self, compiler_path):
+        ''' Returns the compiler previously stored for the given path or None
+            if the compiler binary has changed since then.
+        '''
+        key = self.get_compiler_key(compiler_path)
+        if key is None or key not in self.compilers:
+            return None
+        entry = self.compilers[key]
+        compiler = create_compiler_by_name(entry['name'])
+        compiler.name = entry['name']
+        compiler.path = compiler_path
+        compiler.target_arch = entry['target_arch']
+        compiler.version = entry['version']
+        return compiler
+
+    def put_compiler(self, compiler_path, compiler):
+        key = self.get_compiler_key(compiler_path)
+        if key is None:
+            return
+        self.compilers[key] = {
+            'name': compiler.name,
+            'target_arch': compiler.target_arch,
+            'version': compiler.version,
+        }
+
+    def get_insn_sets_key(self, compiler, libsimdpp_fingerprint):
+        fingerprint = self.get_binary_fingerprint(
+            find_compiler_binary(compiler))
+        if fingerprint is None:
+            return None
+        return hash_strings([fingerprint, str(compiler.name),
+                             str(compiler.version), str(compiler.target_arch),
+                             libsimdpp_fingerprint])
+
+    def get_insn_sets(self, compiler, libsimdpp_fingerprint):
+        ''' Returns a tuple containing a list of supported instruction set
+            configs and a list of (config, error) tuples for unsupported
+            ones, as collected by ConfigDetection, or None if there
+            are no results for the given compiler and libsimdpp.
+        '''
+        key = self.get_insn_sets_key(compiler, libsimdpp_fingerprint)
+        if key is None or key not in self.insn_sets:
+            return None
+        entry = self.insn_sets[key]
+        supported = [InsnSetConfig.from_json(c) for c in entry['supported']]
+        unsupported = [(InsnSetConfig.from_json(c), error)
+                       for c, error in entry['unsupported']]
+        return supported, unsupported
+
+    def put_insn_sets(self, compiler, libsimdpp_fingerprint, supported,
+                      unsupported):
+        key = self.get_insn_sets_key(compiler, libsimdpp_fingerprint)
+        if key is None:
+            return
+        self.insn_sets[key] = {
+            'supported': [config.to_json() for config in supported],
+            'unsupported': [[config.to_json(), error]
+                            for config, error in unsupported],
+        }
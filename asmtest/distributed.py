@@ -0,0 +1,537 @@
+#   Copyright (C) 2018  Povilas Kanapickas <povilas@radix.lt>
+#
+#   This file is part of libsimdpp asm tests
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see http://www.gnu.org/licenses/.
+
+''' Distributes the compilation of test chunks across multiple hosts.
+
+    The coordinator listens on a TCP socket and worker processes connect to
+    it. Each worker compiles tests with its own compiler and libsimdpp copy,
+    which must match the coordinator's. The tests themselves are not sent;
+    jobs identify them by config and position ranges, and workers
+    regenerate them from the test list. Instruction set support detection
+    runs on the workers too.
+
+    Messages are JSON objects prefixed by their length as a 32-bit big
+    endian integer.
+'''
+
+from __future__ import print_function
+
+import itertools
+import json
+import queue
+import shutil
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+from concurrent import futures
+
+from asmtest.asm_collect import TestSource
+from asmtest.asm_collect import WorkerContext
+from asmtest.asm_collect import create_baseline_tests
+from asmtest.asm_collect import get_test_signature
+from asmtest.asm_collect import init_worker
+from asmtest.asm_collect import run_baseline_compilation_job
+from asmtest.asm_collect import run_compilation_job
+from asmtest.asm_collect import run_detection_job
+from asmtest.asm_parser import InsnCount
+from asmtest.fingerprint import get_libsimdpp_fingerprint
+from asmtest.insn_set import InsnSetConfig
+from asmtest.resources import get_default_job_count
+
+PROTOCOL_VERSION = 2
+
+# The coordinator does not run compilers itself, so the number of chunks
+# that are handed to it at once is not limited by the local resources
+DEFAULT_COORDINATOR_JOBS = 1024
+
+
+def parse_address(address):
+    # Parses host:port string into a (host, port) tuple
+    host, _, port = address.rpartition(':')
+    if host == '' or port == '':
+        raise Exception(f'Invalid address {address}, expected host:port')
+    return (host, int(port))
+
+
+def send_message(sock, message):
+    data = json.dumps(message).encode('utf-8')
+    sock.sendall(struct.pack('!I', len(data)) + data)
+
+
+def recv_exactly(sock, size):
+    # Returns None if the connection has been closed
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 1024 * 1024))
+        if len(chunk) == 0:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def recv_message(sock):
+    # Returns None if the connection has been closed
+    header = recv_exactly(sock, 4)
+    if header is None:
+        return None
+    data = recv_exactly(sock, struct.unpack('!I', header)[0])
+    if data is None:
+        return None
+    return json.loads(data.decode('utf-8'))
+
+
+def get_compiler_version_info(compiler):
+    # The compiler path and binary differ across hosts, thus only the
+    # version is compared
+    return {
+        'name': compiler.name,
+        'version': compiler.version,
+        'target_arch': compiler.target_arch,
+    }
+
+
+def encode_baseline_insns(baseline_insns):
+    return [[list(signature), insns.to_dict()]
+            for signature, insns in baseline_insns.items()]
+
+
+def decode_baseline_insns(data):
+    ret = {}
+    for signature, insns_dict in data:
+        ret[tuple(signature)] = InsnCount.from_dict(insns_dict)
+    return ret
+
+
+def encode_job(fn, args):
+    # Returns the message describing the call of the given job function.
+    # Precompiled headers are local to the coordinator and are not used by
+    # the workers.
+    if fn is run_compilation_job:
+        config_index, config, position_ranges, _ = args
+        return {
+            'job': 'compile',
+            'config_index': config_index,
+            'config': config.to_json(),
+            'ranges': [list(r) for r in position_ranges],
+        }
+    if fn is run_baseline_compilation_job:
+        config, baseline_tests, _ = args
+        return {
+            'job': 'baseline',
+            'config': config.to_json(),
+            'signatures': [list(get_test_signature(test.desc))
+                           for test in baseline_tests],
+        }
+    if fn is run_detection_job:
+        config, = args
+        return {
+            'job': 'detect',
+            'config': config.to_json(),
+        }
+    raise Exception(f'Function {fn.__name__} can not be run remotely')
+
+
+def decode_job(message):
+    # Returns a (function, args) tuple for the given job message
+    config = InsnSetConfig.from_json(message['config'])
+    if message['job'] == 'compile':
+        return (run_compilation_job,
+                (message['config_index'], config,
+                 [tuple(r) for r in message['ranges']], None))
+    if message['job'] == 'baseline':
+        signatures = [tuple(s) for s in message['signatures']]
+        return (run_baseline_compilation_job,
+                (config, create_baseline_tests(signatures), None))
+    if message['job'] == 'detect':
+        return (run_detection_job, (config,))
+    raise Exception(f'Unknown job {message["job"]}')
+
+
+def encode_result(job, result):
+    if job == 'compile':
+        (names, offsets, insn_ids, counts), compile_seconds = result
+        return [[names, list(offsets), list(insn_ids), list(counts)],
+                compile_seconds]
+    if job == 'detect':
+        return list(result)
+    baseline_insns, compile_seconds = result
+    return [encode_baseline_insns(baseline_insns), compile_seconds]
+
+
+def decode_result(job, data):
+    if job == 'compile':
+        encoded_insns, compile_seconds = data
+        return tuple(encoded_insns), compile_seconds
+    if job == 'detect':
+        return tuple(data)
+    baseline_insns, compile_seconds = data
+    return decode_baseline_insns(baseline_insns), compile_seconds
+
+
+class RemoteJob:
+
+    def __init__(self, future, message):
+        self.future = future
+        self.message = message
+        # Set once the job has been sent to a worker for the first time
+        self.started = False
+        # The number of workers that disconnected while running the job
+        self.lost_count = 0
+
+
+class DistributedExecutor(futures.Executor):
+
+    ''' An executor that hands the job functions of perform_all_tests to
+        remote workers started via run_worker(). Jobs are queued until a
+        worker has a free slot. If a worker disconnects or sends an invalid
+        message, its unfinished jobs are given to other workers. A job that
+        has been lost by max_job_attempts workers fails, as it likely crashes
+        the workers. If jobs are queued while no workers are connected for
+        worker_timeout seconds, the queued jobs fail.
+
+        Workers whose compiler version, libsimdpp fingerprint or protocol
+        version differ from those of the coordinator are rejected.
+    '''
+
+    poll_interval = 0.5
+
+    max_job_attempts = 3
+
+    def __init__(self, address, worker_context, stdout=sys.stdout,
+                 worker_timeout=600):
+        self.stdout = stdout
+        self.worker_timeout = worker_timeout
+        self.compiler_info = get_compiler_version_info(worker_context.compiler)
+        self.libsimdpp_fingerprint = get_libsimdpp_fingerprint(
+            worker_context.libsimdpp_path)
+
+        test_source = worker_context.test_source
+        if not test_source.regenerate:
+            raise Exception('Distributed execution requires tests that ' +
+                            'can be regenerated by the workers')
+        self.test_source = test_source
+        self.timeout = worker_context.timeout
+
+        self.jobs = queue.Queue()
+        self.job_ids = itertools.count()
+        self.closed = threading.Event()
+        self.lock = threading.Lock()
+        self.connections = []
+        self.threads = []
+
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(address)
+        self.server.listen(16)
+        self.server.settimeout(self.poll_interval)
+        self.address = self.server.getsockname()
+
+        self.start_thread(self.accept_workers)
+
+    def start_thread(self, target, *args):
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def log(self, message):
+        with self.lock:
+            print(message, file=self.stdout)
+
+    def accept_workers(self):
+        idle_since = time.time()
+        while not self.closed.is_set():
+            try:
+                sock, peer = self.server.accept()
+            except socket.timeout:
+                with self.lock:
+                    has_workers = len(self.connections) > 0
+                if has_workers or self.jobs.empty():
+                    idle_since = time.time()
+                elif time.time() - idle_since >= self.worker_timeout:
+                    # Jobs queued later fail too until a worker connects
+                    self.fail_queued_jobs(
+                        f'No workers connected for {self.worker_timeout} '
+                        'seconds')
+                continue
+            except OSError:
+                return
+            sock.settimeout(None)
+            self.start_thread(self.serve_worker, sock, peer)
+
+    def fail_queued_jobs(self, reason):
+        while True:
+            try:
+                job = self.jobs.get_nowait()
+            except queue.Empty:
+                return
+            if job.future.done():
+                continue
+            if job.started or job.future.set_running_or_notify_cancel():
+                job.future.set_exception(Exception(reason))
+
+    def check_worker(self, hello):
+        # Returns the reason to reject the worker or None
+        if hello is None or hello.get('type') != 'hello':
+            return 'invalid handshake'
+        if hello.get('protocol') != PROTOCOL_VERSION:
+            return 'protocol version mismatch'
+        if hello.get('compiler') != self.compiler_info:
+            return (f'compiler mismatch: {hello.get("compiler")} != ' +
+                    str(self.compiler_info))
+        if hello.get('libsimdpp') != self.libsimdpp_fingerprint:
+            return 'libsimdpp fingerprint mismatch'
+        return None
+
+    def serve_worker(self, sock, peer):
+        try:
+            hello = recv_message(sock)
+            reason = self.check_worker(hello)
+            if reason is not None:
+                self.log(f'Rejected worker {peer[0]}:{peer[1]}: {reason}')
+                send_message(sock, {'type': 'rejected', 'reason': reason})
+                sock.close()
+                return
+            # Configs may be added to the test source during the run. The
+            # workers check the counts of the tests they regenerate for the
+            # configs that are already known.
+            send_message(sock, {
+                'type': 'welcome',
+                'categories': self.test_source.categories,
+                'test_counts': list(self.test_source.test_counts),
+                'timeout': self.timeout,
+            })
+        except (OSError, ValueError):
+            sock.close()
+            return
+
+        slots = max(1, int(hello.get('slots', 1)))
+        self.log(f'Worker {peer[0]}:{peer[1]} connected with {slots} slots')
+
+        with self.lock:
+            self.connections.append(sock)
+
+        outstanding = {}
+        free_slots = threading.Semaphore(slots)
+        disconnected = threading.Event()
+        self.start_thread(self.send_jobs, sock, outstanding, free_slots,
+                          disconnected)
+
+        try:
+            while True:
+                message = recv_message(sock)
+                if message is None:
+                    break
+                job = self.pop_result_job(message, outstanding)
+                if job is None:
+                    self.log(f'Invalid message from worker {peer[0]}:'
+                             f'{peer[1]}')
+                    break
+                if 'error' in message:
+                    job.future.set_exception(Exception(message['error']))
+                else:
+                    try:
+                        result = decode_result(job.message['job'],
+                                               message['result'])
+                    except (KeyError, TypeError, ValueError):
+                        # the job is given to other workers below
+                        with self.lock:
+                            outstanding[message['id']] = job
+                        self.log(f'Invalid result from worker {peer[0]}:'
+                                 f'{peer[1]}')
+                        break
+                    job.future.set_result(result)
+                free_slots.release()
+        except (OSError, ValueError):
+            pass
+        finally:
+            disconnected.set()
+            with self.lock:
+                if sock in self.connections:
+                    self.connections.remove(sock)
+                unfinished = list(outstanding.values())
+                outstanding.clear()
+            sock.close()
+
+        if not self.closed.is_set():
+            self.log(f'Worker {peer[0]}:{peer[1]} disconnected')
+        for job in unfinished:
+            if job.future.done():
+                continue
+            job.lost_count += 1
+            if job.lost_count >= self.max_job_attempts:
+                job.future.set_exception(Exception(
+                    f'The job was lost by {job.lost_count} workers'))
+            else:
+                self.jobs.put(job)
+
+    def pop_result_job(self, message, outstanding):
+        # Returns the job that the given result message is for or None if
+        # the message is invalid
+        if not isinstance(message, dict) or \
+                not isinstance(message.get('id'), int) or \
+                ('result' not in message and 'error' not in message):
+            return None
+        with self.lock:
+            return outstanding.pop(message['id'], None)
+
+    def send_jobs(self, sock, outstanding, free_slots, disconnected):
+        while not self.closed.is_set() and not disconnected.is_set():
+            if not free_slots.acquire(timeout=self.poll_interval):
+                continue
+            try:
+                job = self.jobs.get(timeout=self.poll_interval)
+            except queue.Empty:
+                free_slots.release()
+                continue
+
+            if not job.started:
+                if not job.future.set_running_or_notify_cancel():
+                    free_slots.release()
+                    continue
+                job.started = True
+
+            job_id = next(self.job_ids)
+            message = dict(job.message)
+            message['type'] = 'job'
+            message['id'] = job_id
+            with self.lock:
+                outstanding[job_id] = job
+            try:
+                send_message(sock, message)
+            except OSError:
+                # serve_worker will give the job to other workers
+                return
+
+    def submit(self, fn, *args, **kwargs):
+        if self.closed.is_set():
+            raise RuntimeError('cannot schedule new futures after shutdown')
+        future = futures.Future()
+        try:
+            message = encode_job(fn, args)
+        except Exception as e:
+            future.set_exception(e)
+            return future
+        self.jobs.put(RemoteJob(future, message))
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        if self.closed.is_set():
+            return
+        self.closed.set()
+
+        while True:
+            try:
+                job = self.jobs.get_nowait()
+            except queue.Empty:
+                break
+            job.future.cancel()
+
+        with self.lock:
+            connections = list(self.connections)
+        for sock in connections:
+            try:
+                send_message(sock, {'type': 'done'})
+            except OSError:
+                pass
+        self.server.close()
+
+        if wait:
+            for thread in self.threads:
+                thread.join()
+
+
+def connect_to_coordinator(address, retry_seconds):
+    # Workers may be started before the coordinator, thus connection is
+    # retried for up to retry_seconds
+    deadline = time.time() + retry_seconds
+    while True:
+        try:
+            return socket.create_connection(address)
+        except OSError:
+            if time.time() >= deadline:
+                raise
+            time.sleep(0.2)
+
+
+def run_worker(address, libsimdpp_path, compiler, jobs=None, cache=None,
+               stdout=sys.stdout, retry_seconds=60):
+    ''' Connects to the coordinator at the given (host, port) address and
+        compiles the jobs it sends until the coordinator finishes. At most
+        jobs compilations run at once. If cache is set, the results are
+        looked up in and stored to the given ResultCache. Raises an
+        exception if the coordinator rejects the worker.
+    '''
+    if jobs is None:
+        jobs = get_default_job_count()
+
+    sock = connect_to_coordinator(address, retry_seconds)
+    try:
+        send_message(sock, {
+            'type': 'hello',
+            'protocol': PROTOCOL_VERSION,
+            'compiler': get_compiler_version_info(compiler),
+            'libsimdpp': get_libsimdpp_fingerprint(libsimdpp_path),
+            'slots': jobs,
+        })
+        welcome = recv_message(sock)
+        if welcome is None:
+            raise Exception('Coordinator closed the connection')
+        if welcome['type'] == 'rejected':
+            raise Exception('Rejected by coordinator: ' + welcome['reason'])
+
+        print(f'Connected to {address[0]}:{address[1]}', file=stdout)
+
+        test_source = TestSource.for_regeneration(welcome['categories'],
+                                                  welcome['test_counts'])
+
+        tmp_dir = tempfile.mkdtemp()
+        context = WorkerContext(libsimdpp_path, tmp_dir, compiler,
+                                test_source, cache, welcome['timeout'])
+        send_lock = threading.Lock()
+
+        def send_result(job_id, job, future):
+            try:
+                reply = {'type': 'result', 'id': job_id,
+                         'result': encode_result(job, future.result())}
+            except Exception as e:
+                reply = {'type': 'result', 'id': job_id, 'error': str(e)}
+            try:
+                with send_lock:
+                    send_message(sock, reply)
+            except OSError:
+                pass  # the coordinator has gone away
+
+        with futures.ProcessPoolExecutor(max_workers=jobs,
+                                         initializer=init_worker,
+                                         initargs=(context,)) as executor:
+            while True:
+                message = recv_message(sock)
+                if message is None or message['type'] == 'done':
+                    break
+                fn, args = decode_job(message)
+                future = executor.submit(fn, *args)
+                future.add_done_callback(
+                    lambda f, job_id=message['id'], job=message['job']:
+                    send_result(job_id, job, f))
+
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    finally:
+        sock.close()
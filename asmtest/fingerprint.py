@@ -0,0 +1,141 @@
+#   Copyright (C) 2018  Povilas Kanapickas <povilas@radix.lt>
+#
+#   This file is part of libsimdpp asm tests
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see http://www.gnu.org/licenses/.
+
+from __future__ import print_function
+
+import hashlib
+import os
+import shutil
+
+
+def hash_file(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as in_f:
+        while True:
+            data = in_f.read(1 << 20)
+            if len(data) == 0:
+                break
+            hasher.update(data)
+    return hasher
+
+
+# Maps (real path, size, modification time) tuples of files to the hashes of
+# their contents
+_file_hashes = {}
+
+
+def get_file_hash(path):
+    ''' Returns the SHA-256 hash of the contents of the given file. Each
+        version of a file, as identified by its real path, size and
+        modification time, is hashed only once per process, thus e.g. the
+        compiler binary is read once even though several caches identify
+        the compiler.
+    '''
+    stat = os.stat(path)
+    key = (os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+    ret = _file_hashes.get(key)
+    if ret is None:
+        ret = hash_file(path).hexdigest()
+        _file_hashes[key] = ret
+    return ret
+
+
+# Maps the paths of compiler binaries to the paths of their components, see
+# CompilerBase.get_component_paths
+_compiler_component_paths = {}
+
+
+def find_program(path):
+    # Returns the absolute path to the given program or None if it can't be
+    # found. The path may be just a program name that is looked up in PATH.
+    if os.path.isfile(path):
+        return os.path.abspath(path)
+    return shutil.which(path)
+
+
+def find_compiler_binary(compiler):
+    ''' Returns the absolute path to the compiler executable or None if it
+        can't be found. The compiler path may be just a program name that is
+        looked up in PATH.
+    '''
+    if compiler.path is None:
+        return None
+    return find_program(compiler.path)
+
+
+def get_file_fingerprint(path):
+    ''' Returns a string identifying the given file by its path, size and
+        modification time. Symlinks are followed. The contents are not read,
+        thus the fingerprint is cheap to compute even for large files.
+    '''
+    stat = os.stat(path)
+    return '\n'.join([
+        f'path: {path}',
+        f'real_path: {os.path.realpath(path)}',
+        f'size: {stat.st_size}',
+        f'mtime_ns: {stat.st_mtime_ns}',
+    ])
+
+
+def get_compiler_identity(compiler):
+    ''' Returns a string that identifies the given compiler. Two compilers
+        with the same identity are expected to produce identical output. The
+        location of the compiler is not part of the identity so that the
+        same compiler installed in different locations, e.g. on different
+        hosts sharing a remote cache, shares the cached results. The contents
+        of the compiler binary and of the programs it runs to compile the
+        code, such as cc1plus behind the GCC driver, are part of it.
+    '''
+    binary_hash = None
+    component_hashes = []
+    binary_path = find_compiler_binary(compiler)
+    if binary_path is not None:
+        binary_hash = get_file_hash(binary_path)
+        if binary_path not in _compiler_component_paths:
+            _compiler_component_paths[binary_path] = \
+                compiler.get_component_paths()
+        component_hashes = [get_file_hash(path) for path in
+                            _compiler_component_paths[binary_path]]
+
+    return '\n'.join([
+        f'name: {compiler.name}',
+        f'version: {compiler.version}',
+        f'target_arch: {compiler.target_arch}',
+        f'binary_hash: {binary_hash}',
+        f'component_hashes: {",".join(component_hashes)}',
+    ])
+
+
+def get_libsimdpp_fingerprint(libsimdpp_path):
+    ''' Returns a hash of the names and contents of all files within the
+        simdpp directory of the given libsimdpp checkout. The files are
+        hashed via get_file_hash, thus only once per process.
+    '''
+    hasher = hashlib.sha256()
+    headers_root = os.path.join(libsimdpp_path, 'simdpp')
+
+    paths = []
+    for root, dirs, files in os.walk(headers_root):
+        dirs.sort()
+        for fn in files:
+            paths.append(os.path.join(root, fn))
+
+    for path in sorted(paths):
+        rel_path = os.path.relpath(path, headers_root).replace(os.sep, '/')
+        hasher.update(rel_path.encode('utf-8') + b'\0' +
+                      get_file_hash(path).encode('utf-8') + b'\0')
+    return hasher.hexdigest()
@@ -0,0 +1,111 @@
+#   Copyright (C) 2018  Povilas Kanapickas <povilas@radix.lt>
+#
+#   This file is part of libsimdpp asm tests
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see http://www.gnu.org/licenses/.
+
+from __future__ import print_function
+
+import hashlib
+import json
+import re
+
+# Groups of effectively equivalent instructions for each architecture family.
+# The compiler is free to choose any instruction of a group, thus counting
+# them separately would only add noise to the results. Each group maps the
+# canonical instruction name to the names that are counted as it.
+EQUIVALENT_INSNS = {
+    'x86': {
+        'movaps': ['movapd', 'movdqa'],
+        'movups': ['movupd', 'movdqu'],
+        'vmovaps': ['vmovapd', 'vmovdqa', 'vmovdqa32', 'vmovdqa64'],
+        'vmovups': ['vmovupd', 'vmovdqu', 'vmovdqu8', 'vmovdqu16',
+                    'vmovdqu32', 'vmovdqu64'],
+        # EVEX encoded bitwise operations differ only in the granularity of
+        # the write mask
+        'vpand': ['vpandd', 'vpandq'],
+        'vpandn': ['vpandnd', 'vpandnq'],
+        'vpor': ['vpord', 'vporq'],
+        'vpxor': ['vpxord', 'vpxorq'],
+    },
+    # Only the mnemonics are counted, thus instructions are merged only if
+    # all their forms are equivalent. For example, vld1 of different element
+    # sizes is equivalent only for full register lists, while the lane and
+    # duplicating forms differ. Similarly, the vector mvn is an alias of
+    # not, but the scalar mvn is an alias of orn.
+    'arm': {
+        'vldm': ['vldmia'],
+        'vstm': ['vstmia'],
+    },
+    'aarch64': {},
+    'power': {
+        'vor': ['vmr'],
+        'vnor': ['vnot'],
+        'xxlor': ['xxmr'],
+    },
+}
+
+
+def get_arch_family(target_arch):
+    ''' Returns the key of EQUIVALENT_INSNS for the given target architecture
+        as reported by the compiler, or None if it is not known.
+    '''
+    if target_arch is None:
+        return None
+    if re.match(r'(x86|x86_64|amd64|i[3-7]86)$', target_arch):
+        return 'x86'
+    if re.match(r'arm(?!.*eb$)', target_arch):
+        return 'arm'
+    if re.match(r'aarch64(?!_be)', target_arch):
+        return 'aarch64'
+    if re.match(r'(powerpc|ppc)', target_arch):
+        return 'power'
+    return None
+
+
+def build_canonical_insns(families):
+    ret = {}
+    for family in families:
+        for canonical_insn, eq_insns in EQUIVALENT_INSNS[family].items():
+            for eq_insn in eq_insns:
+                ret[eq_insn] = canonical_insn
+    return ret
+
+
+# Maps architecture families to the dicts returned by get_canonical_insns
+_canonical_insns_by_family = {}
+
+
+def get_canonical_insns(target_arch):
+    ''' Returns a dict mapping the names of instructions to the names of the
+        canonical instructions they are equivalent to on the given target
+        architecture. Instructions that are canonical themselves are not
+        included. If the architecture is not known, the groups of all
+        architectures are used, as the instruction names of different
+        architectures don't clash. The dicts are built once per process.
+    '''
+    family = get_arch_family(target_arch)
+    if family not in _canonical_insns_by_family:
+        families = [family] if family is not None else EQUIVALENT_INSNS
+        _canonical_insns_by_family[family] = build_canonical_insns(families)
+    return _canonical_insns_by_family[family]
+
+
+def get_insn_equivalence_fingerprint():
+    ''' Returns a hash of EQUIVALENT_INSNS. The instructions are merged
+        while parsing the compiler output, thus cached results are valid
+        only for the same groups.
+    '''
+    data = json.dumps(EQUIVALENT_INSNS, sort_keys=True)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
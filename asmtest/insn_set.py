@@ -17,6 +17,8 @@
 
 from __future__ import print_function
 
+import itertools
+
 
 class InsnSet:
     X86_SSE2 = 1
@@ -47,6 +49,32 @@ class InsnSetConfig:
     def __init__(self, insn_sets):
         self.insn_sets = insn_sets
         self.capabilities = []
+        # Identifies the code the compiler sees for this config. Set during
+        # detection if the compiler supports that, None otherwise. Configs
+        # with the same capabilities and fingerprint compile to identical
+        # code.
+        self.fingerprint = None
+
+    def to_json(self):
+        return {
+            'insn_sets': list(self.insn_sets),
+            'capabilities': list(self.capabilities),
+            'fingerprint': self.fingerprint,
+        }
+
+    @staticmethod
+    def from_json(json_data):
+        config = InsnSetConfig(list(json_data['insn_sets']))
+        config.capabilities = list(json_data['capabilities'])
+        config.fingerprint = json_data.get('fingerprint')
+        return config
+
+    def equivalence_key(self):
+        # Returns a key that is equal for configs that compile to identical
+        # code or None if that is not known
+        if self.fingerprint is None:
+            return None
+        return (self.fingerprint, tuple(sorted(self.capabilities)))
 
     def defines(self):
         insn_set_to_predefined_macro = {
@@ -81,6 +109,7 @@ class InsnSetConfig:
             InsnSet.X86_SSE3: "sse3",
             InsnSet.X86_SSSE3: "ssse3",
             InsnSet.X86_SSE4_1: "sse4.1",
+            InsnSet.X86_POPCNT: "popcnt",
             InsnSet.X86_AVX: "avx",
             InsnSet.X86_AVX2: "avx2",
             InsnSet.X86_FMA3: "fma3",
@@ -138,7 +167,36 @@ class InsnSetConfig:
         return '\n'.join(lines)
 
 
-def get_all_insn_set_configs():
+def get_insn_set_lattice():
+    # Returns a list of (levels, extensions, standalone) tuples, one for each
+    # architecture. Each level implies the preceding ones. An extension is
+    # given as (insn_set, first_level, last_level) and may be combined with
+    # the levels in that range. standalone lists the instruction sets that
+    # are additionally tested on their own.
+    return [
+        ([InsnSet.X86_SSE2, InsnSet.X86_SSE3, InsnSet.X86_SSSE3,
+          InsnSet.X86_SSE4_1, InsnSet.X86_AVX, InsnSet.X86_AVX2,
+          InsnSet.X86_AVX512F],
+         [(InsnSet.X86_POPCNT, InsnSet.X86_SSE4_1, InsnSet.X86_AVX512F),
+          (InsnSet.X86_FMA3, InsnSet.X86_AVX, InsnSet.X86_AVX512F),
+          (InsnSet.X86_FMA4, InsnSet.X86_AVX, InsnSet.X86_AVX),
+          (InsnSet.X86_XOP, InsnSet.X86_AVX, InsnSet.X86_AVX),
+          (InsnSet.X86_AVX512BW, InsnSet.X86_AVX512F, InsnSet.X86_AVX512F),
+          (InsnSet.X86_AVX512DQ, InsnSet.X86_AVX512F, InsnSet.X86_AVX512F),
+          (InsnSet.X86_AVX512VL, InsnSet.X86_AVX512F, InsnSet.X86_AVX512F)],
+         [InsnSet.X86_FMA3, InsnSet.X86_FMA4, InsnSet.X86_XOP]),
+        ([InsnSet.ARM_NEON, InsnSet.ARM_NEON_FLT_SP], [], []),
+        ([InsnSet.ARM64_NEON], [], []),
+        ([InsnSet.MIPS_MSA], [], []),
+        ([InsnSet.POWER_ALTIVEC, InsnSet.POWER_VSX_206,
+          InsnSet.POWER_VSX_207], [], []),
+    ]
+
+
+def get_basic_insn_set_configs():
+    # Returns the configs that are tested when equivalent configs can't be
+    # detected: each instruction set level on its own and the commonly used
+    # combinations of extensions
     return [
         InsnSetConfig([InsnSet.X86_SSE2]),
         InsnSetConfig([InsnSet.X86_SSE3]),
@@ -169,6 +227,33 @@ def get_all_insn_set_configs():
     ]
 
 
+def get_all_insn_set_configs(use_lattice=True):
+    ''' Returns all combinations of instruction sets described by
+        get_insn_set_lattice(). Many of them compile to identical code, which
+        is detected at runtime via InsnSetConfig.equivalence_key(). That
+        requires a fingerprint, which is available only for compilers that
+        support preprocessor probes. For other compilers use_lattice should
+        be False, in which case only get_basic_insn_set_configs() are
+        returned, as compiling the tests for every combination would take
+        far too long.
+    '''
+    if not use_lattice:
+        return get_basic_insn_set_configs()
+    configs = []
+    for levels, extensions, standalone in get_insn_set_lattice():
+        for level_index, level in enumerate(levels):
+            allowed_extensions = [
+                insn_set for insn_set, first, last in extensions
+                if levels.index(first) <= level_index <= levels.index(last)]
+            for count in range(len(allowed_extensions) + 1):
+                for combination in itertools.combinations(allowed_extensions,
+                                                          count):
+                    configs.append(InsnSetConfig([level] + list(combination)))
+        for insn_set in standalone:
+            configs.append(InsnSetConfig([insn_set]))
+    return configs
+
+
 def get_all_capabilities():
     return [
         'INT8_SIMD',
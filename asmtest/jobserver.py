@@ -0,0 +1,147 @@
+#   Copyright (C) 2018  Povilas Kanapickas <povilas@radix.lt>
+#
+#   This file is part of libsimdpp asm tests
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see http://www.gnu.org/licenses/.
+
+from __future__ import print_function
+
+import os
+import select
+import sys
+
+
+def parse_jobserver_auth(makeflags):
+    ''' Parses the jobserver specification out of the value of the MAKEFLAGS
+        environment variable. Returns ('fifo', path), ('fds', read_fd,
+        write_fd) or None if there's no jobserver. Both the --jobserver-auth
+        option of GNU make 4.2 and later and the --jobserver-fds option of
+        older versions are supported.
+    '''
+    if makeflags is None:
+        return None
+
+    auth = None
+    for flag in makeflags.split():
+        for prefix in ['--jobserver-auth=', '--jobserver-fds=']:
+            if flag.startswith(prefix):
+                # the last occurrence wins
+                auth = flag[len(prefix):]
+    if auth is None:
+        return None
+
+    if auth.startswith('fifo:'):
+        return ('fifo', auth[len('fifo:'):])
+
+    fds = auth.split(',')
+    if len(fds) != 2:
+        # e.g. the semaphore name used on Windows
+        return None
+    try:
+        read_fd, write_fd = int(fds[0]), int(fds[1])
+    except ValueError:
+        return None
+    if read_fd < 0 or write_fd < 0:
+        return None
+    return ('fds', read_fd, write_fd)
+
+
+class JobserverClient:
+
+    ''' A client of the GNU make jobserver. Each process started by make
+        implicitly owns a single job slot. Each additional concurrently
+        running job requires a token to be read from the jobserver; the token
+        must be written back once the job completes.
+
+        Tokens are acquired without blocking so that the caller can keep
+        handling completed jobs while it waits for tokens. The read end is
+        opened as a separate non-blocking file description so that other
+        clients sharing the jobserver are not affected.
+    '''
+
+    def __init__(self, read_fd, write_fd, use_select=False, owned_fds=()):
+        self.read_fd = read_fd
+        self.write_fd = write_fd
+        # If set, read_fd is blocking and shared with other clients
+        self.use_select = use_select
+        # The file descriptors to close in close()
+        self.owned_fds = list(owned_fds)
+        self.tokens = []
+
+    @staticmethod
+    def from_environment(environ=None):
+        # Returns a JobserverClient if the process was started by make with
+        # jobserver enabled or None otherwise
+        if environ is None:
+            environ = os.environ
+        if sys.platform == 'win32':
+            return None
+
+        auth = parse_jobserver_auth(environ.get('MAKEFLAGS'))
+        if auth is None:
+            return None
+
+        if auth[0] == 'fifo':
+            try:
+                fd = os.open(auth[1], os.O_RDWR | os.O_NONBLOCK)
+            except OSError:
+                return None
+            return JobserverClient(fd, fd, owned_fds=[fd])
+
+        _, read_fd, write_fd = auth
+        try:
+            # make does not pass the file descriptors unless the command is
+            # recognized as recursive make invocation
+            os.fstat(read_fd)
+            os.fstat(write_fd)
+        except OSError:
+            return None
+
+        try:
+            fd = os.open(f'/proc/self/fd/{read_fd}',
+                         os.O_RDONLY | os.O_NONBLOCK)
+            return JobserverClient(fd, write_fd, owned_fds=[fd])
+        except OSError:
+            # Not on Linux. Another client may read the token between the
+            # select() and read() calls in which case we block until a token
+            # becomes available.
+            return JobserverClient(read_fd, write_fd, use_select=True)
+
+    def try_acquire(self):
+        # Returns True if a token has been acquired
+        if self.use_select:
+            readable, _, _ = select.select([self.read_fd], [], [], 0)
+            if len(readable) == 0:
+                return False
+        try:
+            token = os.read(self.read_fd, 1)
+        except BlockingIOError:
+            return False
+        if len(token) == 0:
+            return False
+        self.tokens.append(token)
+        return True
+
+    def release(self):
+        os.write(self.write_fd, self.tokens.pop())
+
+    def get_token_count(self):
+        return len(self.tokens)
+
+    def close(self):
+        while len(self.tokens) > 0:
+            self.release()
+        for fd in self.owned_fds:
+            os.close(fd)
+        self.owned_fds = []
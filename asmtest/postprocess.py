@@ -0,0 +1,162 @@
+#   Copyright (C) 2018  Povilas Kanapickas <povilas@radix.lt>
+#
+#   This file is part of libsimdpp asm tests
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see http://www.gnu.org/licenses/.
+
+from __future__ import print_function
+
+from array import array
+
+from asmtest.asm_parser import InsnCount
+from asmtest.asm_parser import get_insn_name
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def has_numpy():
+    return numpy is not None
+
+
+def get_count_entries(insn_counts):
+    ''' Returns the nonzero entries of the count matrix of the given
+        InsnCount instances, which has a row for each InsnCount and a column
+        for each instruction id. The entries are returned as a tuple of
+        rows, ids and counts arrays, sorted by row and then by id. Requires
+        NumPy.
+    '''
+    lengths = numpy.array([len(insns.data) // 2 for insns in insn_counts],
+                          dtype=numpy.intp)
+    flat = numpy.frombuffer(
+        b''.join(insns.data.tobytes() for insns in insn_counts),
+        dtype=numpy.intc)
+    rows = numpy.repeat(numpy.arange(len(insn_counts)), lengths)
+    return rows, flat[0::2], flat[1::2].astype(numpy.int64)
+
+
+def store_count_entries(insn_counts, rows, ids, counts):
+    # The inverse of get_count_entries: sets the counts of each InsnCount to
+    # the corresponding row of the count matrix. Zero entries are dropped.
+    nonzero = counts != 0
+    rows = rows[nonzero]
+    pairs = numpy.empty((len(rows), 2), dtype=numpy.intc)
+    pairs[:, 0] = ids[nonzero]
+    pairs[:, 1] = counts[nonzero]
+    data = pairs.tobytes()
+
+    pair_size = 2 * pairs.itemsize
+    ends = numpy.cumsum(numpy.bincount(rows, minlength=len(insn_counts)))
+    begin = 0
+    for insns, end in zip(insn_counts, ends.tolist()):
+        insns.data = array('i')
+        insns.data.frombytes(data[begin * pair_size:end * pair_size])
+        begin = end
+
+
+def sum_duplicate_entries(rows, ids, counts):
+    # Sums the counts of entries with the same row and id. Returns the
+    # entries sorted by row and then by id.
+    keys = rows.astype(numpy.int64) * (int(ids.max()) + 1) + ids
+    order = numpy.argsort(keys, kind='stable')
+    keys = keys[order]
+    starts = numpy.flatnonzero(numpy.concatenate(
+        [[True], keys[1:] != keys[:-1]]))
+    return (rows[order][starts], ids[order][starts],
+            numpy.add.reduceat(counts[order], starts))
+
+
+def expand_baselines(baselines):
+    # Returns the entries of a count matrix whose i-th row is the negated
+    # count of baselines[i]. Each distinct baseline is converted only once.
+    unique_baselines = []
+    unique_rows_by_id = {}
+    unique_rows = []
+    for baseline in baselines:
+        row = unique_rows_by_id.get(id(baseline))
+        if row is None:
+            row = len(unique_baselines)
+            unique_rows_by_id[id(baseline)] = row
+            unique_baselines.append(baseline)
+        unique_rows.append(row)
+
+    unique_entry_rows, ids, counts = get_count_entries(unique_baselines)
+    lengths = numpy.bincount(unique_entry_rows,
+                             minlength=len(unique_baselines))
+    offsets = numpy.cumsum(lengths) - lengths
+
+    # The indices of the entries of each unique baseline are repeated for
+    # each row that refers to it
+    unique_rows = numpy.array(unique_rows, dtype=numpy.intp)
+    row_lengths = lengths[unique_rows]
+    row_ends = numpy.cumsum(row_lengths)
+    indices = numpy.arange(row_ends[-1] if len(row_ends) else 0) + \
+        numpy.repeat(offsets[unique_rows] - (row_ends - row_lengths),
+                     row_lengths)
+    rows = numpy.repeat(numpy.arange(len(baselines)), row_lengths)
+    return rows, ids[indices], -counts[indices]
+
+
+def postprocess_with_numpy(insn_counts, baselines):
+    test_entries = get_count_entries(insn_counts)
+    baseline_entries = expand_baselines(baselines)
+    rows, ids, counts = (numpy.concatenate([a, b]) for a, b in
+                         zip(test_entries, baseline_entries))
+    if len(ids) == 0:
+        return
+    store_count_entries(insn_counts, *sum_duplicate_entries(rows, ids, counts))
+
+
+def postprocess_insn_counts(insn_counts, baselines, use_numpy=None):
+    ''' Subtracts baselines[i] from insn_counts[i]. The instances in
+        insn_counts are modified.
+
+        If NumPy is available, all counts are processed at once as a sparse
+        matrix with a row for each test and a column for each instruction.
+        This can be disabled by setting use_numpy to False.
+    '''
+    if use_numpy is None:
+        use_numpy = has_numpy()
+    if len(insn_counts) == 0:
+        return
+    if use_numpy:
+        postprocess_with_numpy(insn_counts, baselines)
+        return
+    for insns, baseline in zip(insn_counts, baselines):
+        insns.sub(baseline)
+
+
+def get_insn_totals(insn_counts, use_numpy=None):
+    ''' Returns a dict mapping instruction names to their total count in
+        insn_counts. NumPy is used in the same way as in
+        postprocess_insn_counts.
+    '''
+    if use_numpy is None:
+        use_numpy = has_numpy()
+    if use_numpy:
+        _, ids, counts = get_count_entries(insn_counts)
+        if len(ids) == 0:
+            return {}
+        totals = numpy.zeros(int(ids.max()) + 1, dtype=numpy.int64)
+        numpy.add.at(totals, ids, counts)
+        return {get_insn_name(insn_id): total
+                for insn_id, total in enumerate(totals.tolist())
+                if total != 0}
+
+    totals = InsnCount()
+    for insns in insn_counts:
+        totals.add(insns)
+    return totals.to_dict()
@@ -0,0 +1,313 @@
+#   Copyright (C) 2018  Povilas Kanapickas <povilas@radix.lt>
+#
+#   This file is part of libsimdpp asm tests
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see http://www.gnu.org/licenses/.
+
+from __future__ import print_function
+
+import math
+import multiprocessing
+import os
+import re
+import time
+from collections import deque
+
+DEFAULT_CGROUP_ROOT = '/sys/fs/cgroup'
+DEFAULT_PROC_ROOT = '/proc'
+
+
+def read_file_or_none(path):
+    try:
+        with open(path, 'r') as in_f:
+            return in_f.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def parse_memory_size(value):
+    ''' Parses a memory size such as 512M, 8G or 1073741824 into the number
+        of bytes. Suffixes are powers of 1024.
+    '''
+    m = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([kmgt]?)i?b?\s*$', value,
+                 re.IGNORECASE)
+    if m is None:
+        raise Exception(f'Invalid memory size {value}')
+    multipliers = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3,
+                   't': 1024 ** 4}
+    return int(float(m.group(1)) * multipliers[m.group(2).lower()])
+
+
+def get_cgroup_cpu_limit(cgroup_root=DEFAULT_CGROUP_ROOT):
+    # Returns the number of CPUs the CPU quota of the current cgroup allows
+    # to use as a float, or None if there's no quota. Both cgroup v2 and v1
+    # are supported.
+    cpu_max = read_file_or_none(os.path.join(cgroup_root, 'cpu.max'))
+    if cpu_max is not None:
+        quota, period = (cpu_max.split() + ['100000'])[:2]
+        if quota == 'max':
+            return None
+        return int(quota) / int(period)
+
+    for cpu_dir in ['cpu', 'cpu,cpuacct']:
+        quota = read_file_or_none(
+            os.path.join(cgroup_root, cpu_dir, 'cpu.cfs_quota_us'))
+        period = read_file_or_none(
+            os.path.join(cgroup_root, cpu_dir, 'cpu.cfs_period_us'))
+        if quota is not None and period is not None:
+            if int(quota) <= 0:
+                return None
+            return int(quota) / int(period)
+    return None
+
+
+def get_available_cpu_count(cgroup_root=DEFAULT_CGROUP_ROOT):
+    # Returns the number of CPUs the current process may actually use taking
+    # CPU affinity and cgroup CPU quota into account
+    try:
+        count = len(os.sched_getaffinity(0))
+    except AttributeError:
+        count = multiprocessing.cpu_count()
+
+    limit = get_cgroup_cpu_limit(cgroup_root)
+    if limit is not None:
+        count = min(count, max(1, int(math.ceil(limit))))
+    return count
+
+
+def get_default_job_count():
+    # One more job than there are CPUs so that CPUs don't idle while a job is
+    # starting or finishing
+    return get_available_cpu_count() + 1
+
+
+def get_cgroup_available_memory(cgroup_root=DEFAULT_CGROUP_ROOT):
+    # Returns the number of bytes that may still be allocated before
+    # reaching the memory limit of the current cgroup, or None if there's no
+    # limit
+    paths = [
+        ('memory.max', 'memory.current'),
+        ('memory/memory.limit_in_bytes', 'memory/memory.usage_in_bytes'),
+    ]
+    for limit_path, usage_path in paths:
+        limit = read_file_or_none(os.path.join(cgroup_root, limit_path))
+        usage = read_file_or_none(os.path.join(cgroup_root, usage_path))
+        if limit is None or usage is None:
+            continue
+        # cgroup v1 reports a huge number when there's no limit
+        if limit == 'max' or int(limit) >= 2 ** 60:
+            return None
+        return int(limit) - int(usage)
+    return None
+
+
+def get_system_available_memory(proc_root=DEFAULT_PROC_ROOT):
+    # Returns MemAvailable from /proc/meminfo in bytes or None if unknown
+    meminfo = read_file_or_none(os.path.join(proc_root, 'meminfo'))
+    if meminfo is None:
+        return None
+    m = re.search(r'^MemAvailable:\s*(\d+)\s*kB', meminfo, re.MULTILINE)
+    if m is None:
+        return None
+    return int(m.group(1)) * 1024
+
+
+def get_available_memory(cgroup_root=DEFAULT_CGROUP_ROOT,
+                         proc_root=DEFAULT_PROC_ROOT):
+    values = [value for value in [get_cgroup_available_memory(cgroup_root),
+                                  get_system_available_memory(proc_root)]
+              if value is not None]
+    if len(values) == 0:
+        return None
+    return min(values)
+
+
+def get_compiler_memory(pid=None, proc_root=DEFAULT_PROC_ROOT):
+    ''' Returns a dict mapping session ids to the total resident memory in
+        bytes of the descendants of the process with the given pid, by
+        default the current process, that run in these sessions. Programs
+        are started in their own sessions (see start_program), thus each
+        entry corresponds to a single compiler invocation including the
+        processes the compiler driver starts. The worker processes, which
+        share the session of the current process, are not counted. Returns
+        None if the information is not available on this platform.
+    '''
+    if pid is None:
+        pid = os.getpid()
+    if not os.path.isdir(proc_root):
+        return None
+
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    children = {}
+    stats = {}
+    for entry in os.listdir(proc_root):
+        if not entry.isdigit():
+            continue
+        stat = read_file_or_none(os.path.join(proc_root, entry, 'stat'))
+        if stat is None:
+            continue  # the process has exited in the mean time
+        # the command name may contain spaces and parentheses
+        fields = stat[stat.rindex(')') + 2:].split()
+        ppid = int(fields[1])
+        children.setdefault(ppid, []).append(int(entry))
+        stats[int(entry)] = (int(fields[3]), int(fields[21]) * page_size)
+
+    own_session = stats[pid][0] if pid in stats else None
+    ret = {}
+    pending = list(children.get(pid, []))
+    while len(pending) > 0:
+        child = pending.pop()
+        session, rss = stats[child]
+        if session != own_session:
+            ret[session] = ret.get(session, 0) + rss
+        pending += children.get(child, [])
+    return ret
+
+
+class ResourceLimiter:
+
+    ''' Decides whether another compiler job may be started. At most
+        max_jobs jobs run at once. Additionally, a new job is started only if
+        the memory it is expected to use fits both within max_memory, if set,
+        and within the memory that is actually available in the system or
+        the cgroup. A job is always allowed to start when nothing is running
+        so that progress is made even if the limits are very low.
+
+        The memory a job needs is estimated as the peak resident memory of
+        the running compilers and the last peak_history completed ones, and
+        is never assumed to be lower than default_job_memory. Thus the
+        estimate decreases again once a few expensive compilations are
+        over. The compilers are found by scanning /proc, which is done at
+        most once per memory_poll_interval seconds.
+
+        If jobserver is set, each job except the first one additionally
+        requires a token from the make jobserver. release_unused_tokens()
+        must be called whenever jobs complete. The limiter must be closed
+        after use so that the tokens are returned.
+
+        If check_memory is not set, only the number of jobs is limited. This
+        is useful when the jobs do not run on the current host.
+    '''
+
+    default_job_memory = 512 * 1024 * 1024
+
+    peak_history = 16
+
+    memory_poll_interval = 0.2
+
+    # How often, in seconds, to check whether more jobs can be started
+    # while waiting for running jobs to complete
+    poll_interval = 0.5
+
+    def __init__(self, max_jobs, max_memory=None,
+                 cgroup_root=DEFAULT_CGROUP_ROOT,
+                 proc_root=DEFAULT_PROC_ROOT, jobserver=None,
+                 check_memory=True):
+        self.max_jobs = max_jobs
+        self.max_memory = max_memory
+        self.cgroup_root = cgroup_root
+        self.proc_root = proc_root
+        self.job_memory_estimate = self.default_job_memory
+        self.jobserver = jobserver
+        self.check_memory = check_memory
+        # The peak memory of the running compilers by session id and of the
+        # recently completed ones
+        self.running_peaks = {}
+        self.completed_peaks = deque(maxlen=self.peak_history)
+        self.last_scan_time = None
+        self.last_compiler_memory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.jobserver is not None:
+            self.jobserver.close()
+
+    def get_compiler_memory(self):
+        now = time.monotonic()
+        if self.last_scan_time is None or \
+                now - self.last_scan_time >= self.memory_poll_interval:
+            self.last_scan_time = now
+            self.last_compiler_memory = get_compiler_memory(
+                proc_root=self.proc_root)
+        return self.last_compiler_memory
+
+    def update_job_memory_estimate(self, compiler_memory):
+        for session, rss in compiler_memory.items():
+            self.running_peaks[session] = max(
+                self.running_peaks.get(session, 0), rss)
+        for session in list(self.running_peaks.keys()):
+            if session not in compiler_memory:
+                self.completed_peaks.append(self.running_peaks.pop(session))
+        self.job_memory_estimate = max(
+            [self.default_job_memory] + list(self.completed_peaks) +
+            list(self.running_peaks.values()))
+
+    def get_used_memory(self):
+        # Returns the memory used by the running compilers in bytes or None
+        # if unknown
+        compiler_memory = self.get_compiler_memory()
+        if compiler_memory is None:
+            return None
+        self.update_job_memory_estimate(compiler_memory)
+        return sum(compiler_memory.values())
+
+    def get_available_memory(self):
+        return get_available_memory(self.cgroup_root, self.proc_root)
+
+    def can_start_job(self, running_jobs):
+        if running_jobs >= self.max_jobs:
+            return False
+        if running_jobs == 0:
+            return True
+        if not self.check_memory:
+            return True
+
+        used = self.get_used_memory()
+        expected_growth = 0
+        if used is not None:
+            # The running jobs are likely still growing
+            expected_used = max(used, running_jobs * self.job_memory_estimate)
+            expected_growth = expected_used - used
+            if self.max_memory is not None and \
+                    expected_used + self.job_memory_estimate > self.max_memory:
+                return False
+
+        available = self.get_available_memory()
+        if available is not None and \
+                available - expected_growth < self.job_memory_estimate:
+            return False
+
+        if self.jobserver is not None and \
+                self.jobserver.get_token_count() < running_jobs:
+            return self.jobserver.try_acquire()
+        return True
+
+    def release_unused_tokens(self, running_jobs):
+        # The first job runs in the job slot that make has given us
+        if self.jobserver is None:
+            return
+        while self.jobserver.get_token_count() > max(0, running_jobs - 1):
+            self.jobserver.release()
+
+    def get_poll_interval(self):
+        # Tokens may be returned to the jobserver at any time, so we need to
+        # check more often
+        if self.jobserver is not None:
+            return min(self.poll_interval, 0.05)
+        return self.poll_interval
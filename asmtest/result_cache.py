@@ -0,0 +1,230 @@
+#   Copyright (C) 2018  Povilas Kanapickas <povilas@radix.lt>
+#
+#   This file is part of libsimdpp asm tests
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see http://www.gnu.org/licenses/.
+
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+import sys
+from urllib import error as urllib_error
+from urllib import request as urllib_request
+
+from asmtest.asm_parser import InsnCount
+from asmtest.compiler import CompilerInvocation
+from asmtest.fingerprint import get_compiler_identity
+from asmtest.fingerprint import get_libsimdpp_fingerprint
+from asmtest.insn_equivalence import get_insn_equivalence_fingerprint
+from asmtest.utils import write_file_atomically
+
+
+def encode_cache_entry(insns_by_ident):
+    json_data = {
+        'insns': {ident: insn_count.to_dict()
+                  for ident, insn_count in insns_by_ident.items()},
+    }
+    return json.dumps(json_data, sort_keys=True)
+
+
+def decode_cache_entry(data):
+    # Returns a dict mapping test idents to InsnCount instances or None if
+    # the data is not a valid cache entry
+    try:
+        json_data = json.loads(data)
+        ret = {}
+        for ident, insns in json_data['insns'].items():
+            ret[ident] = InsnCount.from_dict(insns)
+        return ret
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+
+def get_cache_entry_path(cache_dir, key):
+    return os.path.join(cache_dir, key[:2], key + '.json')
+
+
+def is_valid_cache_key(key):
+    return len(key) == 64 and all(c in '0123456789abcdef' for c in key)
+
+
+class ResultCache:
+
+    ''' Persistent on-disk cache of instruction counts of compiled tests.
+        Each entry stores the instruction counts for all tests in a single
+        compiled source file and is addressed by the hash of everything that
+        affects the results: the compiler identity, the compiler flags, the
+        libsimdpp headers, the source code itself and the groups of
+        equivalent instructions that are merged while parsing.
+    '''
+
+    format_version = 2
+
+    def __init__(self, cache_dir, compiler_identity, libsimdpp_fingerprint):
+        self.cache_dir = cache_dir
+        self.compiler_identity = compiler_identity
+        self.libsimdpp_fingerprint = libsimdpp_fingerprint
+        self.insn_equivalence_fingerprint = get_insn_equivalence_fingerprint()
+
+    @staticmethod
+    def create(cache_dir, compiler, libsimdpp_path):
+        return ResultCache(cache_dir, get_compiler_identity(compiler),
+                           get_libsimdpp_fingerprint(libsimdpp_path))
+
+    def get_key(self, compiler, insn_set_config, code):
+        # The paths are replaced with placeholders so that the key does not
+        # depend on the location of temporary files or libsimdpp checkout
+        invocation = CompilerInvocation(insn_set_config, 'libsimdpp',
+                                        'test.cc', 'test.o')
+        key_data = json.dumps([
+            self.format_version,
+            self.compiler_identity,
+            compiler.get_flags(invocation),
+            self.libsimdpp_fingerprint,
+            self.insn_equivalence_fingerprint,
+            code,
+        ])
+        return hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+
+    def _get_entry_path(self, key):
+        return get_cache_entry_path(self.cache_dir, key)
+
+    def load_entry(self, key):
+        # Returns the serialized entry for the given key or None
+        try:
+            with open(self._get_entry_path(key), 'r') as in_f:
+                return in_f.read()
+        except (IOError, OSError):
+            return None
+
+    def store_entry(self, key, data):
+        write_file_atomically(self._get_entry_path(key), data)
+
+    def get(self, key):
+        ''' Returns a dict mapping test idents to InsnCount instances or None
+            if there's no entry for the given key.
+        '''
+        data = self.load_entry(key)
+        if data is None:
+            return None
+        return decode_cache_entry(data)
+
+    def put(self, key, insns_by_ident):
+        self.store_entry(key, encode_cache_entry(insns_by_ident))
+
+
+class RemoteResultCache(ResultCache):
+
+    ''' A ResultCache that stores the entries in a HTTP key-value store,
+        such as the one in asmtest.cache_server, so that the results can be
+        shared between multiple hosts. Entries are read via GET and written
+        via PUT requests to <url>/<key>.
+
+        The cache is only an optimization, thus failed requests are treated
+        as cache misses. After the first connection failure the server is
+        not contacted again by the current process.
+    '''
+
+    def __init__(self, url, compiler_identity, libsimdpp_fingerprint,
+                 timeout=10):
+        super().__init__(None, compiler_identity, libsimdpp_fingerprint)
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.disabled = False
+
+    @staticmethod
+    def create(url, compiler, libsimdpp_path):
+        return RemoteResultCache(url, get_compiler_identity(compiler),
+                                 get_libsimdpp_fingerprint(libsimdpp_path))
+
+    def _handle_connection_error(self, e):
+        if not self.disabled:
+            print(f'Disabling remote cache at {self.url}: {e}',
+                  file=sys.stderr)
+        self.disabled = True
+
+    def load_entry(self, key):
+        if self.disabled:
+            return None
+        try:
+            with urllib_request.urlopen(f'{self.url}/{key}',
+                                        timeout=self.timeout) as response:
+                return response.read().decode('utf-8')
+        except urllib_error.HTTPError:
+            return None  # most likely 404, i.e. a cache miss
+        except (urllib_error.URLError, OSError) as e:
+            self._handle_connection_error(e)
+            return None
+
+    def store_entry(self, key, data):
+        if self.disabled:
+            return
+        req = urllib_request.Request(
+            f'{self.url}/{key}', data=data.encode('utf-8'), method='PUT',
+            headers={'Content-Type': 'application/json'})
+        try:
+            with urllib_request.urlopen(req, timeout=self.timeout):
+                pass
+        except urllib_error.HTTPError:
+            pass
+        except (urllib_error.URLError, OSError) as e:
+            self._handle_connection_error(e)
+
+
+class CombinedResultCache:
+
+    ''' Combines a local and a remote ResultCache. Entries are looked up in
+        the local cache first. Entries found only in the remote cache are
+        copied to the local cache. New entries are stored to both caches.
+    '''
+
+    def __init__(self, local_cache, remote_cache):
+        self.local_cache = local_cache
+        self.remote_cache = remote_cache
+
+    def get_key(self, compiler, insn_set_config, code):
+        return self.local_cache.get_key(compiler, insn_set_config, code)
+
+    def get(self, key):
+        ret = self.local_cache.get(key)
+        if ret is not None:
+            return ret
+        ret = self.remote_cache.get(key)
+        if ret is not None:
+            self.local_cache.put(key, ret)
+        return ret
+
+    def put(self, key, insns_by_ident):
+        self.local_cache.put(key, insns_by_ident)
+        self.remote_cache.put(key, insns_by_ident)
+
+
+def create_result_cache(compiler, libsimdpp_path, cache_dir=None,
+                        remote_url=None):
+    # Returns the cache configured by the given options or None if neither
+    # is set
+    if cache_dir is None and remote_url is None:
+        return None
+    if remote_url is None:
+        return ResultCache.create(cache_dir, compiler, libsimdpp_path)
+    remote_cache = RemoteResultCache.create(remote_url, compiler,
+                                            libsimdpp_path)
+    if cache_dir is None:
+        return remote_cache
+    return CombinedResultCache(
+        ResultCache(cache_dir, remote_cache.compiler_identity,
+                    remote_cache.libsimdpp_fingerprint),
+        remote_cache)
@@ -0,0 +1,251 @@
+#   Copyright (C) 2018  Povilas Kanapickas <povilas@radix.lt>
+#
+#   This file is part of libsimdpp asm tests
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see http://www.gnu.org/licenses/.
+
+from __future__ import print_function
+
+import os
+import sqlite3
+
+SCHEMA = '''
+CREATE TABLE results (
+    id INTEGER PRIMARY KEY,
+    compiler TEXT NOT NULL,
+    arch TEXT NOT NULL,
+    config TEXT NOT NULL,
+    category TEXT NOT NULL,
+    code TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    vr TEXT,
+    va TEXT,
+    vb TEXT,
+    vc TEXT,
+    -- The total number of instructions or NULL if the test failed
+    total INTEGER
+);
+CREATE INDEX results_by_settings ON results (compiler, arch, config,
+                                             category);
+CREATE INDEX results_by_code ON results (code, vr, va, vb, vc);
+
+-- The types of each test, so that tests with any of their types matching a
+-- pattern can be found via an index
+CREATE TABLE types (
+    result_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    PRIMARY KEY (result_id, position)
+) WITHOUT ROWID;
+CREATE INDEX types_by_type ON types (type);
+
+CREATE TABLE insns (
+    result_id INTEGER NOT NULL,
+    insn TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (result_id, insn)
+) WITHOUT ROWID;
+CREATE INDEX insns_by_insn ON insns (insn);
+'''
+
+# Upgrades the schema of version 1 databases, whose types were stored only
+# in the results table
+UPGRADE_SCHEMA_1 = '''
+DROP INDEX results_by_type;
+CREATE TABLE types (
+    result_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    PRIMARY KEY (result_id, position)
+) WITHOUT ROWID;
+CREATE INDEX types_by_type ON types (type);
+INSERT INTO types (result_id, position, type)
+    SELECT id, 0, vr FROM results WHERE vr IS NOT NULL UNION ALL
+    SELECT id, 1, va FROM results WHERE va IS NOT NULL UNION ALL
+    SELECT id, 2, vb FROM results WHERE vb IS NOT NULL UNION ALL
+    SELECT id, 3, vc FROM results WHERE vc IS NOT NULL;
+'''
+
+# The columns that identify the results written to a single file by
+# write_results_to_files
+SETTINGS_COLUMNS = ['compiler', 'arch', 'config', 'category']
+
+TEST_COLUMNS = ['code', 'bytes', 'vr', 'va', 'vb', 'vc']
+
+# The columns that query results can be filtered or grouped by
+QUERY_COLUMNS = SETTINGS_COLUMNS + TEST_COLUMNS
+
+
+class ResultsDb:
+
+    ''' Stores the results written by write_results_to_files in a SQLite
+        database, so that the results for all compilers and instruction set
+        configs can be queried without parsing the result files. Storing the
+        results of a compiler, architecture, config and category replaces
+        the results previously stored for them, thus the database holds
+        only the latest results.
+    '''
+
+    schema_version = 2
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    @staticmethod
+    def open(path):
+        if path != ':memory:':
+            db_dir = os.path.dirname(os.path.abspath(path))
+            if not os.path.exists(db_dir):
+                os.makedirs(db_dir)
+        connection = sqlite3.connect(path)
+        version = connection.execute('PRAGMA user_version').fetchone()[0]
+        if version == 0:
+            with connection:
+                connection.executescript(SCHEMA)
+                connection.execute(
+                    f'PRAGMA user_version = {ResultsDb.schema_version}')
+        elif version == 1:
+            with connection:
+                connection.executescript(UPGRADE_SCHEMA_1)
+                connection.execute(
+                    f'PRAGMA user_version = {ResultsDb.schema_version}')
+        elif version != ResultsDb.schema_version:
+            connection.close()
+            raise Exception(f'Unsupported results database version {version}')
+        return ResultsDb(connection)
+
+    def close(self):
+        self.connection.close()
+
+    def put_results(self, compiler, arch, config, category, test_list):
+        ''' Replaces the results of the given settings with the results of
+            the given Test instances. The changes are visible to other
+            connections only after commit() is called.
+        '''
+        settings = (compiler, arch, config, category)
+        cursor = self.connection.cursor()
+        for table in ['insns', 'types']:
+            cursor.execute(f'''
+                DELETE FROM {table} WHERE result_id IN (
+                    SELECT id FROM results WHERE compiler = ? AND arch = ? AND
+                        config = ? AND category = ?)''', settings)
+        cursor.execute('''
+            DELETE FROM results WHERE compiler = ? AND arch = ? AND
+                config = ? AND category = ?''', settings)
+
+        # The ids are assigned here so that the rows can be inserted in
+        # batches
+        next_id = cursor.execute(
+            'SELECT COALESCE(MAX(id), 0) + 1 FROM results').fetchone()[0]
+        result_rows = []
+        type_rows = []
+        insn_rows = []
+        for result_id, test in enumerate(test_list, next_id):
+            desc = test.desc
+            for position, type_name in enumerate(
+                    [desc.rtype, desc.atype, desc.btype, desc.ctype]):
+                if type_name is not None:
+                    type_rows.append((result_id, position, type_name))
+            total = None
+            if test.insns is not None:
+                total = 0
+                for insn, count in test.insns.items():
+                    if count != 0:
+                        insn_rows.append((result_id, insn, count))
+                        total += count
+            result_rows.append((result_id,) + settings +
+                               (desc.code, desc.bytes, desc.rtype, desc.atype,
+                                desc.btype, desc.ctype, total))
+
+        cursor.executemany('''
+            INSERT INTO results (id, compiler, arch, config, category, code,
+                                 bytes, vr, va, vb, vc, total)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', result_rows)
+        cursor.executemany(
+            'INSERT INTO types (result_id, position, type) VALUES (?, ?, ?)',
+            type_rows)
+        cursor.executemany(
+            'INSERT INTO insns (result_id, insn, count) VALUES (?, ?, ?)',
+            insn_rows)
+
+    def commit(self):
+        self.connection.commit()
+
+    def query(self, filters=None, type_pattern=None, insn=None,
+              group_by=None):
+        ''' Returns a tuple containing a list of column names and a list of
+            rows of the matching results.
+
+            filters is a dict mapping the columns in QUERY_COLUMNS to glob
+            patterns the values must match. If type_pattern is given, at
+            least one of the types of the test must match it. The counted
+            value is the total number of instructions, or the number of
+            the given instruction if insn is set.
+
+            If group_by is not set, a row is returned for each test. The
+            instructions of the test are listed in the insns column, unless
+            insn is set. Otherwise group_by is a list of columns in
+            QUERY_COLUMNS and a row is returned for each group with the
+            number of tests, the number of failed tests and the sum, minimum
+            and maximum of the counted values of the successful tests.
+        '''
+        conditions = []
+        params = []
+        for column, pattern in sorted((filters or {}).items()):
+            if column not in QUERY_COLUMNS:
+                raise Exception(f'Unknown column {column}')
+            conditions.append(f'CAST({column} AS TEXT) GLOB ?'
+                              if column == 'bytes' else f'{column} GLOB ?')
+            params.append(str(pattern))
+        if type_pattern is not None:
+            conditions.append(
+                'id IN (SELECT result_id FROM types WHERE type GLOB ?)')
+            params.append(type_pattern)
+        where = ''
+        if len(conditions) > 0:
+            where = 'WHERE ' + ' AND '.join(conditions)
+
+        if insn is None:
+            value = 'total'
+        else:
+            value = '''CASE WHEN total IS NULL THEN NULL ELSE
+                COALESCE((SELECT count FROM insns
+                          WHERE result_id = id AND insn = ?), 0) END'''
+            params = [insn] + params
+
+        if group_by is None:
+            columns = SETTINGS_COLUMNS + TEST_COLUMNS + ['count']
+            select = ', '.join(SETTINGS_COLUMNS + TEST_COLUMNS) + \
+                f', {value}'
+            order = ', '.join(SETTINGS_COLUMNS + TEST_COLUMNS)
+            if insn is None:
+                columns.append('insns')
+                select += ''', (
+                    SELECT group_concat(insn || ':' || count, ' ') FROM (
+                        SELECT insn, count FROM insns WHERE result_id = id
+                        ORDER BY insn))'''
+            sql = f'SELECT {select} FROM results {where} ORDER BY {order}'
+        else:
+            for column in group_by:
+                if column not in QUERY_COLUMNS:
+                    raise Exception(f'Unknown column {column}')
+            group = ', '.join(group_by)
+            columns = group_by + ['tests', 'failed', 'sum', 'min', 'max']
+            sql = f'''
+                SELECT {group}, COUNT(*), COUNT(*) - COUNT(value),
+                    SUM(value), MIN(value), MAX(value)
+                FROM (SELECT *, {value} AS value FROM results {where})
+                GROUP BY {group} ORDER BY {group}'''
+
+        return columns, self.connection.execute(sql, params).fetchall()
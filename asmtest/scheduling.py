@@ -0,0 +1,274 @@
+#   Copyright (C) 2018  Povilas Kanapickas <povilas@radix.lt>
+#
+#   This file is part of libsimdpp asm tests
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see http://www.gnu.org/licenses/.
+
+from __future__ import print_function
+
+import heapq
+import itertools
+import json
+import os
+
+
+def get_default_category_weight(category):
+    # Relative compile cost of a test of the given category. Used until actual
+    # compile times are known.
+    category_weights = {
+        'bitwise': 1.0,
+        'math': 2.0,
+        'convert': 3.0,
+        'shuffle': 3.0,
+    }
+    return category_weights.get(category, 2.0)
+
+
+class CompileTimeHistory:
+
+    ''' Stores the estimated time it takes to compile tests for given
+        instruction set config with the given compiler. The compile time of
+        a chunk is modeled as a fixed overhead of compiling any file, which
+        is dominated by parsing the libsimdpp headers, plus the sum of the
+        times of its tests. The overhead is measured by the baseline
+        compilation of each config, which compiles a file with empty tests.
+
+        The time of a test is estimated per category rather than per test.
+        Tests are compiled in chunks, thus only the times of whole chunks can
+        be measured, and each chunk contains tests of one or a few
+        categories. The tests of a category are variations of the same
+        operations on different types and have comparable costs, so the
+        category averages are what the measurements can resolve.
+
+        The estimates are refined using the compile times measured during
+        each run and can be persisted to a file so that subsequent runs can
+        use them. The estimates of multiple compilers may share a file.
+    '''
+
+    # Used when nothing is known about the compile times at all
+    default_seconds_per_test = 0.05
+    default_overhead_seconds = 1.0
+
+    # The weight of the new measurement when updating an existing estimate
+    update_weight = 0.5
+
+    def __init__(self, path=None, compiler=None):
+        self.path = path
+        self.compiler_key = self.get_compiler_key(compiler)
+        self.seconds_per_test = {}
+        self.overhead_seconds = {}
+
+    @staticmethod
+    def load(path, compiler=None):
+        history = CompileTimeHistory(path, compiler)
+        if os.path.isfile(path):
+            with open(path, 'r') as in_f:
+                data = json.load(in_f)
+            # Files written before the overhead was modeled separately contain
+            # only per-test times with the overhead folded in. These are
+            # discarded.
+            if 'seconds_per_test' in data:
+                history.seconds_per_test = data['seconds_per_test']
+                history.overhead_seconds = data['overhead_seconds']
+        return history
+
+    def save(self):
+        if self.path is None:
+            return
+        with open(self.path, 'w') as out_f:
+            json.dump({'seconds_per_test': self.seconds_per_test,
+                       'overhead_seconds': self.overhead_seconds},
+                      out_f, sort_keys=True, indent=2)
+
+    @staticmethod
+    def get_compiler_key(compiler):
+        if compiler is None:
+            return 'unknown'
+        target_arch = compiler.target_arch or 'unknown'
+        return f'{compiler.name}_{compiler.version}_{target_arch}'
+
+    def get_config_key(self, config):
+        short_ids = config.short_ids()
+        if len(short_ids) == 0:
+            short_ids = ['none']
+        return self.compiler_key + '/' + '_'.join(short_ids)
+
+    def get_key(self, config, category):
+        return self.get_config_key(config) + '/' + category
+
+    def get_estimate(self, config, category):
+        key = self.get_key(config, category)
+        if key in self.seconds_per_test:
+            return self.seconds_per_test[key]
+
+        # Unknown category or config. The average across other configs for
+        # the same category, preferably of the same compiler, or across
+        # everything that is known is likely a better guess than a fixed
+        # default.
+        values = [value for k, value in self.seconds_per_test.items()
+                  if k.startswith(self.compiler_key + '/') and
+                  k.endswith('/' + category)]
+        if len(values) == 0:
+            values = [value for k, value in self.seconds_per_test.items()
+                      if k.endswith('/' + category)]
+        if len(values) == 0:
+            values = list(self.seconds_per_test.values())
+        if len(values) > 0:
+            return sum(values) / len(values)
+        return (self.default_seconds_per_test *
+                get_default_category_weight(category))
+
+    def get_overhead(self, config):
+        # Returns the estimated time it takes to compile a file without
+        # tests. Unknown configs use the average of the same compiler or of
+        # everything that is known.
+        key = self.get_config_key(config)
+        if key in self.overhead_seconds:
+            return self.overhead_seconds[key]
+        values = [value for k, value in self.overhead_seconds.items()
+                  if k.startswith(self.compiler_key + '/')]
+        if len(values) == 0:
+            values = list(self.overhead_seconds.values())
+        if len(values) > 0:
+            return sum(values) / len(values)
+        return self.default_overhead_seconds
+
+    def estimate_chunk(self, config, categories):
+        return self.get_overhead(config) + sum(
+            self.get_estimate(config, category) for category in categories)
+
+    def update(self, estimates, key, measured):
+        if key in estimates:
+            measured = (estimates[key] * (1 - self.update_weight) +
+                        measured * self.update_weight)
+        estimates[key] = measured
+
+    def record_overhead(self, config, seconds):
+        ''' Records the time it took to compile a file that contains only
+            empty tests, such as the baseline of a config.
+        '''
+        self.update(self.overhead_seconds, self.get_config_key(config),
+                    seconds)
+
+    def record_chunk(self, config, categories, seconds):
+        ''' Records the time it took to compile a chunk of tests. categories
+            contains the category of each test in the chunk. The estimated
+            overhead is subtracted and, as the compilation time of
+            individual tests can't be measured, the rest is distributed
+            across categories proportionally to the current estimates.
+        '''
+        if len(categories) == 0:
+            return
+        seconds = max(seconds - self.get_overhead(config), 0)
+
+        estimates = {}
+        counts = {}
+        for category in categories:
+            if category not in estimates:
+                estimates[category] = self.get_estimate(config, category)
+                counts[category] = 0
+            counts[category] += 1
+
+        total_estimate = sum(estimates[cat] * counts[cat]
+                             for cat in estimates)
+
+        for category, count in counts.items():
+            if total_estimate > 0:
+                share = estimates[category] * count / total_estimate
+            else:
+                share = count / len(categories)
+            self.update(self.seconds_per_test, self.get_key(config, category),
+                        seconds * share / count)
+
+
+def sort_chunks_longest_first(chunks, history):
+    ''' Sorts chunks so that the ones that are expected to take the longest to
+        compile come first. Each chunk must have config and categories
+        members. Submitting expensive work first minimizes the time when only
+        a few long compilations are still running at the end.
+    '''
+    return sorted(chunks, reverse=True,
+                  key=lambda chunk: history.estimate_chunk(chunk.config,
+                                                           chunk.categories))
+
+
+class ChunkQueue:
+
+    ''' Holds the chunks that wait to be compiled in the order of
+        sort_chunks_longest_first, across everything that has been pushed so
+        far. Urgent chunks, such as the halves of failed chunks that are
+        compiled to find the failing tests, come before all other chunks, the
+        most recently pushed first. The estimate of a chunk is computed once
+        when it is pushed.
+    '''
+
+    def __init__(self, history):
+        self.history = history
+        # Contains (tier, order, sequence number, chunk) tuples
+        self.heap = []
+        self.counter = itertools.count()
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, chunk, urgent=False):
+        seq = next(self.counter)
+        if urgent:
+            entry = (0, -seq, seq, chunk)
+        else:
+            estimate = self.history.estimate_chunk(chunk.config,
+                                                   chunk.categories)
+            entry = (1, -estimate, seq, chunk)
+        heapq.heappush(self.heap, entry)
+
+    def pop(self):
+        return heapq.heappop(self.heap)[-1]
+
+    def remove_if(self, predicate):
+        # Removes the chunks for which predicate returns True and returns
+        # them
+        removed = [entry[-1] for entry in self.heap if predicate(entry[-1])]
+        if len(removed) > 0:
+            self.heap = [entry for entry in self.heap
+                         if not predicate(entry[-1])]
+            heapq.heapify(self.heap)
+        return removed
+
+
+def split_tests_into_adaptive_chunks(tests_with_categories, config, history,
+                                     target_seconds, max_tests_per_file):
+    ''' Splits a list of (category, test) tuples into chunks whose estimated
+        compile time, including the overhead of compiling a file, is close
+        to target_seconds, but with no more than max_tests_per_file tests in
+        each. Yields lists of (category, test) tuples.
+    '''
+    # If the overhead takes most of the target, packing the tests into the
+    # remaining time would produce many tiny chunks, each paying the
+    # overhead again. The tests get at least half of the target instead.
+    test_seconds = max(target_seconds - history.get_overhead(config),
+                       target_seconds / 2)
+    chunk = []
+    chunk_seconds = 0
+    for category, test in tests_with_categories:
+        estimate = history.get_estimate(config, category)
+        if len(chunk) > 0 and (chunk_seconds + estimate > test_seconds or
+                               len(chunk) >= max_tests_per_file):
+            yield chunk
+            chunk = []
+            chunk_seconds = 0
+        chunk.append((category, test))
+        chunk_seconds += estimate
+
+    if len(chunk) > 0:
+        yield chunk
@@ -20,6 +20,8 @@ from __future__ import print_function
 import itertools
 from collections import OrderedDict
 
+from asmtest.asm_parser import InsnCount
+
 
 def flatten_list(arg):
     ret = []
@@ -151,13 +153,27 @@ class Test:
         self.ident = ident
         self.insns = None
 
+    @staticmethod
+    def from_json(json_data, ident):
+        ''' Creates a test from data produced by to_json. The code key may be
+            missing if the test is a part of a group, in which case it must be
+            added before calling this function.
+        '''
+        types = [json_data.get('vr'), json_data.get('va'),
+                 json_data.get('vb'), json_data.get('vc')]
+        test = Test(TestDesc(json_data['code'], json_data['bytes'], types),
+                    ident)
+        if json_data.get('success', True):
+            test.insns = InsnCount.from_dict(json_data.get('zinsns', {}))
+        return test
+
     def to_json(self):
         ret = {
             'code': self.desc.code,
             'bytes': self.desc.bytes,
         }
         if self.insns is not None:
-            sorted_insns = sorted(self.insns.insns.items(), key=lambda x: x[0])
+            sorted_insns = sorted(self.insns.items(), key=lambda x: x[0])
             ret['zinsns'] = {insn: count for (insn, count) in sorted_insns
                              if count != 0}
         else:
@@ -17,16 +17,60 @@
 
 from __future__ import print_function
 
+import asyncio
+import io
+import os
 import shutil
+import signal
 import subprocess
 import sys
+import tempfile
+import threading
 import time
 
 
-def call_program(args, check_returncode=True, cwd=None):
-    pr = subprocess.Popen(args, stdout=subprocess.PIPE,
-                          stderr=subprocess.PIPE, cwd=cwd)
-    out, err = pr.communicate()
+def get_start_program_kwargs(kwargs):
+    # The program is started in a new session so that kill_program can kill
+    # the whole process tree and so that the memory used by each program can
+    # be measured separately, see get_compiler_memory. This matters when the
+    # program is a shell script or a compiler driver.
+    if sys.platform != 'win32':
+        kwargs['start_new_session'] = True
+    return kwargs
+
+
+def start_program(args, **kwargs):
+    return subprocess.Popen(args, **get_start_program_kwargs(kwargs))
+
+
+def kill_program(pr):
+    if sys.platform != 'win32':
+        try:
+            os.killpg(pr.pid, signal.SIGKILL)
+            return
+        except OSError:
+            pass
+    pr.kill()
+
+
+def get_timeout_message(args, timeout):
+    return 'Program {0} did not finish in {1} seconds'.format(args[0],
+                                                              timeout)
+
+
+def call_program(args, input=None, check_returncode=True, cwd=None,
+                 timeout=None):
+    # If input is not None, it is passed to the standard input of the program
+    stdin = None if input is None else subprocess.PIPE
+    pr = start_program(args, stdin=stdin, stdout=subprocess.PIPE,
+                       stderr=subprocess.PIPE, cwd=cwd)
+    input_data = None if input is None else input.encode('utf-8')
+    try:
+        out, err = pr.communicate(input_data, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        kill_program(pr)
+        pr.communicate()
+        raise Exception(get_timeout_message(args, timeout))
 
     # on python2 the 'str' type only supports ascii. We don't want to limit
     # python3 users to that, but at the same time it does not make sense to
@@ -34,13 +78,182 @@ def call_program(args, check_returncode=True, cwd=None):
     out_encoding = 'utf-8' if sys.version_info >= (3, 0) else 'ascii'
 
     if check_returncode and pr.returncode != 0:
-        msg = '\ncode: {0}\nstdout:\n{1}\nstderr:\n{2}\n'.format(
+        raise Exception(get_program_error_message(pr.returncode, out, err,
+                                                  out_encoding))
+
+    return out.decode(out_encoding, errors='ignore')
+
+
+def get_program_error_message(returncode, out, err, encoding='utf-8'):
+    return '\ncode: {0}\nstdout:\n{1}\nstderr:\n{2}\n'.format(
+        str(returncode),
+        out.decode(encoding, errors='ignore'),
+        err.decode(encoding, errors='ignore'))
+
+
+async def call_program_async(args, input=None, check_returncode=True,
+                             cwd=None, timeout=None):
+    ''' Equivalent of call_program for use within asyncio event loop. If
+        input is not None, it is passed to the standard input of the program.
+    '''
+    stdin = None if input is None else subprocess.PIPE
+    pr = await asyncio.create_subprocess_exec(
+        *args, **get_start_program_kwargs({
+            'stdin': stdin,
+            'stdout': subprocess.PIPE,
+            'stderr': subprocess.PIPE,
+            'cwd': cwd,
+        }))
+
+    input_data = None if input is None else input.encode('utf-8')
+    try:
+        out, err = await asyncio.wait_for(pr.communicate(input_data),
+                                          timeout)
+    except asyncio.TimeoutError:
+        kill_async_program(pr)
+        await pr.wait()
+        raise Exception(get_timeout_message(args, timeout))
+    except asyncio.CancelledError:
+        kill_async_program(pr)
+        raise
+
+    if check_returncode and pr.returncode != 0:
+        raise Exception(get_program_error_message(pr.returncode, out, err))
+
+    return out.decode('utf-8', errors='ignore')
+
+
+def kill_async_program(pr):
+    try:
+        kill_program(pr)
+    except ProcessLookupError:
+        pass  # the program has already exited
+
+
+def iter_program_output_lines(args, input=None, cwd=None, timeout=None):
+    ''' Runs the given program, passes input to its standard input and yields
+        lines of its standard output as soon as they are produced. Raises
+        an exception after the output has been consumed if the program
+        returns non-zero exit code or does not finish within timeout seconds.
+    '''
+    pr = start_program(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                       stderr=subprocess.PIPE, cwd=cwd)
+
+    timed_out = []
+
+    def kill_on_timeout():
+        timed_out.append(True)
+        kill_program(pr)
+
+    timer = None
+    if timeout is not None:
+        timer = threading.Timer(timeout, kill_on_timeout)
+        timer.start()
+
+    # stdin and stderr are handled in separate threads so that the program
+    # does not block on a full pipe while we're reading its stdout
+    err_chunks = []
+
+    def write_input():
+        try:
+            if input is not None:
+                pr.stdin.write(input.encode('utf-8'))
+            pr.stdin.close()
+        except (IOError, OSError):
+            pass  # the program exited early, the error is reported below
+
+    def read_error():
+        err_chunks.append(pr.stderr.read())
+
+    threads = [threading.Thread(target=write_input),
+               threading.Thread(target=read_error)]
+    for thread in threads:
+        thread.start()
+
+    try:
+        for line in io.TextIOWrapper(pr.stdout, encoding='utf-8',
+                                     errors='ignore'):
+            yield line
+        pr.wait()
+    finally:
+        if timer is not None:
+            timer.cancel()
+        if pr.poll() is None:
+            kill_program(pr)
+            pr.wait()
+        for thread in threads:
+            thread.join()
+
+    if len(timed_out) > 0:
+        raise Exception(get_timeout_message(args, timeout))
+
+    if pr.returncode != 0:
+        msg = '\ncode: {0}\nstderr:\n{1}\n'.format(
             str(pr.returncode),
-            out.decode(out_encoding, errors='ignore'),
-            err.decode(out_encoding, errors='ignore'))
+            b''.join(err_chunks).decode('utf-8', errors='ignore'))
         raise Exception(msg)
 
-    return out.decode(out_encoding, errors='ignore')
+
+async def iter_program_output_lines_async(args, input=None, cwd=None,
+                                          timeout=None):
+    ''' asyncio equivalent of iter_program_output_lines. The lines are read
+        from the standard output of the program as they are produced, thus
+        the output is never held in memory as a whole.
+    '''
+    pr = await asyncio.create_subprocess_exec(
+        *args, **get_start_program_kwargs({
+            'stdin': subprocess.PIPE,
+            'stdout': subprocess.PIPE,
+            'stderr': subprocess.PIPE,
+            'cwd': cwd,
+        }))
+
+    timed_out = []
+
+    def kill_on_timeout():
+        timed_out.append(True)
+        kill_async_program(pr)
+
+    timer = None
+    if timeout is not None:
+        timer = asyncio.get_running_loop().call_later(timeout,
+                                                      kill_on_timeout)
+
+    async def write_input():
+        try:
+            if input is not None:
+                pr.stdin.write(input.encode('utf-8'))
+                await pr.stdin.drain()
+            pr.stdin.close()
+        except (IOError, OSError):
+            pass  # the program exited early, the error is reported below
+
+    input_task = asyncio.ensure_future(write_input())
+    error_task = asyncio.ensure_future(pr.stderr.read())
+
+    try:
+        while True:
+            line = await pr.stdout.readline()
+            if not line:
+                break
+            yield line.decode('utf-8', errors='ignore')
+        await pr.wait()
+    finally:
+        if timer is not None:
+            timer.cancel()
+        if pr.returncode is None:
+            kill_async_program(pr)
+            await pr.wait()
+        await asyncio.gather(input_task, error_task, return_exceptions=True)
+
+    if len(timed_out) > 0:
+        raise Exception(get_timeout_message(args, timeout))
+
+    if pr.returncode != 0:
+        msg = '\ncode: {0}\nstderr:\n{1}\n'.format(
+            str(pr.returncode),
+            error_task.result().decode('utf-8', errors='ignore'))
+        raise Exception(msg)
 
 
 def rmtree_with_retry(path, retries=10):
@@ -52,3 +265,20 @@ def rmtree_with_retry(path, retries=10):
             time.sleep(0.5)
     raise Exception('Could not delete path {0} even after {1} retries'.format(
         path, retries))
+
+
+def write_file_atomically(path, data):
+    # Writes to a temporary file first so that concurrent readers never see
+    # partially written files
+    path_dir = os.path.dirname(path)
+    if not os.path.exists(path_dir):
+        os.makedirs(path_dir, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=path_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as out_f:
+            out_f.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
@@ -0,0 +1,151 @@
+#   Copyright (C) 2018  Povilas Kanapickas <povilas@radix.lt>
+#
+#   This file is part of libsimdpp asm tests
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see http://www.gnu.org/licenses/.
+
+''' Compares write_results with the NoIndentJsonEncoder based writer it
+    replaced. Both write a synthetic category file to disk; the outputs are
+    checked to be identical.
+
+    Usage: python3 -m benchmarks.write_results [--tests N] [--repeat R]
+'''
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from asmtest.asm_collect import group_tests_by_code
+from asmtest.asm_collect import test_sort_key
+from asmtest.asm_collect import write_results
+from asmtest.asm_parser import InsnCount
+from asmtest.json_utils import NoIndent
+from asmtest.json_utils import NoIndentJsonEncoder
+from asmtest.test_desc import Test
+from asmtest.test_desc import TestDesc
+
+INSNS = ['movaps', 'movups', 'addps', 'mulps', 'paddd', 'pshufd', 'pand',
+         'por', 'pxor', 'shufps', 'cvtdq2ps', 'vmovaps', 'vaddps', 'mov',
+         'lea', 'ret', 'vpermq', 'vpshufb', 'vzeroupper', 'pmulld']
+
+TYPES = ['int8', 'int16', 'int32', 'int64', 'uint8', 'uint16', 'uint32',
+         'uint64', 'float32', 'float64', 'mask_int32', 'mask_float32']
+
+
+def create_tests(count, seed=0):
+    # Creates tests in groups of tests with the same code and different
+    # types, similar to the ones produced by generate_test_list
+    rng = random.Random(seed)
+    tests = []
+    while len(tests) < count:
+        code = f'vr = op{len(tests)}(va, vb);'
+        for type_name in TYPES:
+            for size in [16, 32, 64]:
+                vector_type = f'{type_name}<{size * 8 // 64}>'
+                test = Test(TestDesc(code, size, [vector_type] * 3),
+                            f'id{len(tests)}')
+                if rng.random() > 0.02:
+                    test.insns = InsnCount.from_dict(
+                        {insn: rng.randint(1, 8)
+                         for insn in rng.sample(INSNS, rng.randint(1, 8))})
+                tests.append(test)
+    return tests[:count]
+
+
+def write_results_with_encoder(test_list, file):
+    # write_results as implemented before the streaming writer
+    json_data = []
+    for group in group_tests_by_code(test_list):
+        if len(group) > 1:
+            json_group_tests = [test.to_json()
+                                for test in sorted(group, key=test_sort_key)]
+            for json_test in json_group_tests:
+                json_test.pop('code')
+            json_group = {
+                'code': group[0].desc.code,
+                'tests': [NoIndent(json_test)
+                          for json_test in json_group_tests],
+            }
+            json_data.append(json_group)
+        else:
+            json_data.append(NoIndent(group[0].to_json()))
+
+    json.dump(json_data, file, sort_keys=True, indent=2,
+              cls=NoIndentJsonEncoder)
+
+
+def measure(write_fn, tests, path, repeat):
+    # Returns the best time in seconds and the peak memory allocated in bytes
+    best_seconds = None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        with open(path, 'w') as out_f:
+            write_fn(tests, out_f)
+        seconds = time.perf_counter() - start_time
+        if best_seconds is None or seconds < best_seconds:
+            best_seconds = seconds
+
+    tracemalloc.start()
+    with open(path, 'w') as out_f:
+        write_fn(tests, out_f)
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best_seconds, peak_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='write_results')
+    parser.add_argument(
+        '--tests', type=int, default=50000,
+        help='The number of tests in the written file')
+    parser.add_argument(
+        '--repeat', type=int, default=3,
+        help='The number of times each writer is run')
+    args = parser.parse_args()
+
+    tests = create_tests(args.tests)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        encoder_path = os.path.join(tmp_dir, 'encoder.json')
+        streaming_path = os.path.join(tmp_dir, 'streaming.json')
+        encoder_seconds, encoder_bytes = measure(
+            write_results_with_encoder, tests, encoder_path, args.repeat)
+        streaming_seconds, streaming_bytes = measure(
+            write_results, tests, streaming_path, args.repeat)
+
+        with open(encoder_path, 'rb') as encoder_f, \
+                open(streaming_path, 'rb') as streaming_f:
+            if encoder_f.read() != streaming_f.read():
+                raise Exception('The outputs of the writers differ')
+        size = os.path.getsize(streaming_path)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    print(f'{len(tests)} tests, {size / 1024 / 1024:.1f} MiB of output')
+    print(f'NoIndentJsonEncoder: {encoder_seconds:.3f}s, '
+          f'peak {encoder_bytes / 1024 / 1024:.1f} MiB')
+    print(f'write_results:       {streaming_seconds:.3f}s, '
+          f'peak {streaming_bytes / 1024 / 1024:.1f} MiB')
+    print(f'Speedup: {encoder_seconds / streaming_seconds:.1f}x')
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
 #!/bin/bash
-flake8 --config=config/flake8rc asm_collect.py asmtest tests
-pylint --rcfile=config/pylintrc asm_collect.py asmtest tests
+flake8 --config=config/flake8rc asm_collect.py asmtest tests benchmarks
+pylint --rcfile=config/pylintrc asm_collect.py asmtest tests benchmarks
 python -m unittest discover
-isort --recursive --apply asmtest tests asm_collect.py
+isort --recursive --apply asmtest tests benchmarks asm_collect.py
@@ -17,22 +17,44 @@
 
 from __future__ import print_function
 
+import json
+import pickle
 import sys
 import unittest
+import weakref
 from concurrent import futures
 
+from asmtest.asm_collect import CompilationChunk
+from asmtest.asm_collect import CompilationScheduler
+from asmtest.asm_collect import ConfigDetection
+from asmtest.asm_collect import JobFunctions
+from asmtest.asm_collect import TestSource
+from asmtest.asm_collect import WorkerContext
+from asmtest.asm_collect import build_test_insns_index
+from asmtest.asm_collect import generate_test_list
+from asmtest.asm_collect import get_baseline_tests
 from asmtest.asm_collect import get_output_location_for_settings
-from asmtest.asm_collect import merge_equivalent_insns
+from asmtest.asm_collect import get_position_ranges
+from asmtest.asm_collect import get_test_signature
+from asmtest.asm_collect import group_tests_by_code
 from asmtest.asm_collect import parse_insn_sets
 from asmtest.asm_collect import parse_test_insns
 from asmtest.asm_collect import perform_all_tests
+from asmtest.asm_collect import read_results
+from asmtest.asm_collect import subtract_baseline_insns
 from asmtest.asm_collect import write_results
+from asmtest.asm_parser import AsmFunction
 from asmtest.asm_parser import InsnCount
+from asmtest.asm_parser import encode_insn_counts
 from asmtest.compiler import CompilerBase
+from asmtest.insn_equivalence import get_canonical_insns
 from asmtest.insn_set import InsnSet
 from asmtest.insn_set import InsnSetConfig
+from asmtest.json_utils import NoIndent
+from asmtest.json_utils import NoIndentJsonEncoder
 from asmtest.test_desc import Test
 from asmtest.test_desc import TestDesc
+from asmtest.test_list import get_all_tests
 
 if sys.version_info[0] < 3:
     # io.StringIO only supports unicode strings
@@ -98,56 +120,11 @@ class TestParseInsnSets(unittest.TestCase):
         self.assertEqual(expected,
                          parse_insn_sets('HAS_FMA3,HAS_FMA4').insn_sets)
 
+    def test_popcnt(self):
+        expected = [InsnSet.X86_POPCNT, InsnSet.X86_SSE4_1]
 
-class TestMergeEquivalentInsns(unittest.TestCase):
-
-    def test_no_eq(self):
-        count = InsnCount()
-        count.insns = {'movapd': 3}
-
-        merge_equivalent_insns(count)
-
-        expected = {'movaps': 3}
-
-        self.assertEqual(expected, count.insns)
-
-    def test_eq_same_group(self):
-        count = InsnCount()
-        count.insns = {'movapd': 3, 'movaps': 2}
-
-        merge_equivalent_insns(count)
-
-        expected = {'movaps': 5}
-
-        self.assertEqual(expected, count.insns)
-
-    def test_eq_same_group_neg(self):
-        count = InsnCount()
-        count.insns = {'movapd': 3, 'movaps': -2}
-
-        merge_equivalent_insns(count)
-
-        expected = {'movaps': 1}
-
-        self.assertEqual(expected, count.insns)
-
-    def test_eq_different_group(self):
-        count = InsnCount()
-        count.insns = {'movapd': 3, 'vmovapd': 2}
-
-        merge_equivalent_insns(count)
-
-        expected = {'movaps': 3, 'vmovaps': 2}
-
-        self.assertEqual(expected, count.insns)
-
-    def test_does_not_leave_zero(self):
-        count = InsnCount()
-        count.insns = {'movapd': 3, 'movaps': -3}
-
-        merge_equivalent_insns(count)
-
-        self.assertEqual({}, count.insns)
+        self.assertEqual(expected,
+                         parse_insn_sets('HAS_SSE4_1,HAS_POPCNT').insn_sets)
 
 
 class TestWriteResults(unittest.TestCase):
@@ -169,8 +146,7 @@ class TestWriteResults(unittest.TestCase):
     def test_success(self):
         desc = TestDesc('code;code', 16, ['float32<4>', 'int32<4>'])
         test = Test(desc, 'id123')
-        insns = InsnCount()
-        insns.insns = {'movaps': 3, 'mulps': 2}
+        insns = InsnCount.from_dict({'movaps': 3, 'mulps': 2})
         test.insns = insns
 
         file = StringIO()
@@ -183,6 +159,148 @@ class TestWriteResults(unittest.TestCase):
 
         self.assertEqual(expected, file.getvalue())
 
+    def test_empty(self):
+        file = StringIO()
+        write_results([], file)
+        self.assertEqual('[]', file.getvalue())
+
+    def test_groups(self):
+        test1 = Test(TestDesc('code;', 32, ['float32<8>']), 'a')
+        test1.insns = InsnCount.from_dict({'vmovaps': 1})
+        test2 = Test(TestDesc('code;', 16, ['float32<4>']), 'b')
+        test3 = Test(TestDesc('code2;', 16, ['int32<4>']), 'c')
+        test3.insns = InsnCount()
+
+        file = StringIO()
+        write_results([test1, test2, test3], file)
+
+        expected = '''\
+[
+  {
+    "code": "code;",
+    "tests": [
+      {"bytes": 16, "success": false, "vr": "float32<4>"},
+      {"bytes": 32, "vr": "float32<8>", "zinsns": {"vmovaps": 1}}
+    ]
+  },
+  {"bytes": 16, "code": "code2;", "vr": "int32<4>", "zinsns": {}}
+]'''
+
+        self.assertEqual(expected, file.getvalue())
+
+    def test_same_as_noindent_encoder(self):
+        tests = []
+        for i in range(20):
+            desc = TestDesc(f'r = "\\{i % 3}\u00e9";', 16 << (i % 2),
+                            [f'int{8 << (i % 4)}<4>', 'int32<4>'])
+            test = Test(desc, f'id{i}')
+            if i % 5 != 0:
+                test.insns = InsnCount.from_dict({'mov': i, 'paddd': 1})
+            tests.append(test)
+
+        json_data = []
+        for group in group_tests_by_code(tests):
+            json_tests = [test.to_json() for test in sorted(
+                group, key=lambda t: (t.desc.bytes, t.desc.rtype))]
+            if len(group) == 1:
+                json_data.append(NoIndent(json_tests[0]))
+                continue
+            for json_test in json_tests:
+                json_test.pop('code')
+            json_data.append({
+                'code': group[0].desc.code,
+                'tests': [NoIndent(json_test) for json_test in json_tests],
+            })
+        expected = StringIO()
+        json.dump(json_data, expected, sort_keys=True, indent=2,
+                  cls=NoIndentJsonEncoder)
+
+        file = StringIO()
+        write_results(tests, file)
+        self.assertEqual(expected.getvalue(), file.getvalue())
+
+
+class TestReadResults(unittest.TestCase):
+
+    def test_roundtrip(self):
+        test1 = Test(TestDesc('code;', 16, ['float32<4>', 'int32<4>']), 'a')
+        test1.insns = InsnCount.from_dict({'movaps': 3, 'mulps': 2})
+        test2 = Test(TestDesc('code;', 32, ['float32<4>', 'int32<4>']), 'b')
+        test3 = Test(TestDesc('code2;', 16, [None, 'int32<4>']), 'c')
+        test3.insns = InsnCount()
+
+        file = StringIO()
+        write_results([test1, test2, test3], file)
+        file.seek(0)
+        result = read_results(file)
+
+        def get_desc(test):
+            return (test.desc.code, test.desc.bytes, test.desc.rtype,
+                    test.desc.atype, test.desc.btype, test.desc.ctype)
+
+        self.assertEqual([get_desc(t) for t in [test1, test2, test3]],
+                         [get_desc(t) for t in result])
+        self.assertEqual({'movaps': 3, 'mulps': 2}, result[0].insns.insns)
+        self.assertIsNone(result[1].insns)
+        self.assertEqual({}, result[2].insns.insns)
+
+
+class TestGetBaselineTests(unittest.TestCase):
+
+    def test_unique_signatures(self):
+        tests = [
+            Test(TestDesc('code1;', 16, ['float32<4>', 'int32<4>']), 'id1'),
+            Test(TestDesc('code2;', 16, ['float32<4>', 'int32<4>']), 'id2'),
+            Test(TestDesc('code1;', 32, ['float32<4>', 'int32<4>']), 'id3'),
+            Test(TestDesc('code1;', 16, ['float32<4>']), 'id4'),
+        ]
+
+        result = get_baseline_tests(tests)
+
+        self.assertEqual(['base0', 'base1', 'base2'],
+                         [test.ident for test in result])
+        self.assertEqual(['', '', ''], [test.desc.code for test in result])
+        self.assertEqual([get_test_signature(tests[0].desc),
+                          get_test_signature(tests[2].desc),
+                          get_test_signature(tests[3].desc)],
+                         [get_test_signature(test.desc) for test in result])
+
+
+class TestBuildTestInsnsIndex(unittest.TestCase):
+
+    def test_decorated_names(self):
+        functions = [
+            AsmFunction('test_id_id1_end'),
+            AsmFunction('_test_id_id2_end'),
+            AsmFunction('test_id_id3_base_end'),
+            AsmFunction('other_function'),
+            AsmFunction('test_id_id4_end_other'),
+        ]
+        functions[0].add('mov')
+        functions[0].add('mov')
+        functions[1].add('ret')
+
+        result = build_test_insns_index(functions)
+
+        self.assertEqual({'id1': {'mov': 2}, 'id2': {'ret': 1}, 'id3_base': {}},
+                         {ident: dict(insns.insns)
+                          for ident, insns in result.items()})
+
+    def test_functions_not_retained(self):
+        refs = []
+
+        def iter_functions():
+            for i in range(3):
+                function = AsmFunction(f'test_id_id{i}_end')
+                function.add('mov')
+                refs.append(weakref.ref(function))
+                yield function
+
+        result = build_test_insns_index(iter_functions())
+        # only the counts are kept
+        self.assertEqual([None] * 3, [ref() for ref in refs])
+        self.assertEqual(['id0', 'id1', 'id2'], sorted(result.keys()))
+
 
 class TestParseTestInsns(unittest.TestCase):
 
@@ -205,7 +323,12 @@ test_id_id123_base_end:
     mov
 '''
 
-        parse_test_insns(asm, [test], [test_base])
+        insns = parse_test_insns(asm, [test, test_base],
+                                 get_canonical_insns('x86_64'))
+        test.insns = insns['id123']
+        subtract_baseline_insns([test], {
+            get_test_signature(desc): insns['id123_base']
+        })
         self.assertEqual({'mov': 1}, test.insns.insns)
 
     def test_simple_msvc(self):
@@ -229,20 +352,85 @@ _test_id_id123_base_end PROC        ; COMDAT
 _test_id_id123_base_end ENDP
 '''
 
-        parse_test_insns(asm, [test], [test_base])
+        insns = parse_test_insns(asm, [test, test_base],
+                                 get_canonical_insns('x86_64'))
+        test.insns = insns['id123']
+        subtract_baseline_insns([test], {
+            get_test_signature(desc): insns['id123_base']
+        })
         self.assertEqual({'mov': 1}, test.insns.insns)
 
 
+class TestGetPositionRanges(unittest.TestCase):
+
+    def test_ranges(self):
+        self.assertEqual([], get_position_ranges([]))
+        self.assertEqual([(0, 3), (5, 6), (7, 9)],
+                         get_position_ranges([0, 1, 2, 5, 7, 8]))
+
+
+class TestTestSource(unittest.TestCase):
+
+    def test_regenerate(self):
+        config = InsnSetConfig([InsnSet.X86_SSE2])
+        categories = ['math']
+        test_and_config_list = [
+            (config,
+             generate_test_list(get_all_tests(config), categories))
+        ]
+
+        source = TestSource(test_and_config_list, regenerate=True,
+                            categories=categories)
+        regenerated = pickle.loads(pickle.dumps(source))
+        self.assertIsNone(regenerated.__dict__['test_lists'])
+
+        expected = source.get_tests(0, config, [(0, 2), (5, 6)])
+        actual = regenerated.get_tests(0, config, [(0, 2), (5, 6)])
+        self.assertEqual(3, len(actual))
+        self.assertEqual([(t.ident, t.desc.code) for t in expected],
+                         [(t.ident, t.desc.code) for t in actual])
+
+    def test_add_config_after_pickling(self):
+        config = InsnSetConfig([InsnSet.X86_AVX])
+        categories = ['math']
+
+        source = TestSource([], regenerate=True, categories=categories)
+        regenerated = pickle.loads(pickle.dumps(source))
+
+        config_index = source.add_config(
+            config, generate_test_list(get_all_tests(config), categories))
+        self.assertEqual(0, config_index)
+        self.assertEqual(source.test_counts[0],
+                         len(source.get_position_map(0)))
+
+        expected = source.get_tests(0, config, [(1, 4)])
+        actual = regenerated.get_tests(0, config, [(1, 4)])
+        self.assertEqual([(t.ident, t.desc.code) for t in expected],
+                         [(t.ident, t.desc.code) for t in actual])
+
+
+def compile_empty_baseline(*args):
+    return ({get_test_signature(test.desc): InsnCount() for test in args[4]},
+            None)
+
+
 class TestPerformAllTests(unittest.TestCase):
 
     @mock.patch('concurrent.futures.ProcessPoolExecutor',
                 side_effect=futures.ThreadPoolExecutor)
     @mock.patch('asmtest.asm_collect.perform_single_compilation')
-    @mock.patch('multiprocessing.cpu_count', side_effect=lambda: 2)
-    def test_split(self, _, perform_single_compilation_mock, _2):
-
-        config1 = mock.Mock()
-        config2 = mock.Mock()
+    @mock.patch('asmtest.asm_collect.perform_single_baseline_compilation')
+    @mock.patch('asmtest.asm_collect.get_default_job_count',
+                side_effect=lambda: 1)
+    def test_split(self, _, perform_single_baseline_compilation_mock,
+                   perform_single_compilation_mock, _2):
+        perform_single_compilation_mock.side_effect = \
+            lambda *args: ([InsnCount() for _ in args[4]], None)
+        perform_single_baseline_compilation_mock.side_effect = \
+            compile_empty_baseline
+
+        config1 = InsnSetConfig([InsnSet.X86_SSE2])
+        config2 = InsnSetConfig([InsnSet.X86_AVX])
 
         test1_1 = mock.Mock()
         test1_2 = mock.Mock()
@@ -268,17 +456,23 @@ class TestPerformAllTests(unittest.TestCase):
         perform_all_tests(path, compiler, test_and_config_list, 2,
                           stdout=stdout, stderr=stderr)
 
+        self.assertEqual(
+            2, len(perform_single_baseline_compilation_mock.call_args_list))
+
         expected = [
-            mock.call(path, mock.ANY, compiler, config1, [test1_1, test1_2]),
-            mock.call(path, mock.ANY, compiler, config2, [test2_1, test2_2]),
-            mock.call(path, mock.ANY, compiler, config2, [test2_3]),
+            mock.call(path, mock.ANY, compiler, config1, [test1_1, test1_2],
+                      None, None, None),
+            mock.call(path, mock.ANY, compiler, config2, [test2_1, test2_2],
+                      None, None, None),
+            mock.call(path, mock.ANY, compiler, config2, [test2_3],
+                      None, None, None),
         ]
 
         self.assertEqual(expected,
                          perform_single_compilation_mock.call_args_list)
 
         expected_stdout = '''\
-Using 3 threads
+Using 1 threads
 
 Compiled 2/5
 Compiled 4/5
@@ -288,3 +482,519 @@ Compiled 5/5
 
         expected_stderr = ''
         self.assertEqual(expected_stderr, stderr.getvalue())
+
+    @mock.patch('concurrent.futures.ProcessPoolExecutor',
+                side_effect=futures.ThreadPoolExecutor)
+    @mock.patch('asmtest.asm_collect.perform_single_compilation')
+    @mock.patch('asmtest.asm_collect.perform_single_baseline_compilation')
+    @mock.patch('asmtest.asm_collect.get_default_job_count',
+                side_effect=lambda: 1)
+    def test_isolate_failures(self, _,
+                              perform_single_baseline_compilation_mock,
+                              perform_single_compilation_mock, _2):
+        perform_single_baseline_compilation_mock.side_effect = \
+            compile_empty_baseline
+
+        tests = [Test(TestDesc(f'code{i};', 16, ['int32<4>']), f'id{i}')
+                 for i in range(4)]
+
+        def compile_chunk(path, test_dir, compiler, config, tests_chunk,
+                          *args):
+            if tests[2] in tests_chunk:
+                raise Exception('error')
+            return [InsnCount() for _ in tests_chunk], None
+
+        perform_single_compilation_mock.side_effect = compile_chunk
+
+        config = InsnSetConfig([InsnSet.X86_SSE2])
+        compiler = mock.Mock()
+        stderr = StringIO()
+        stdout = StringIO()
+
+        perform_all_tests('path', compiler, [(config, {'cat': tests})], 4,
+                          stdout=stdout, stderr=stderr,
+                          isolate_failures=True)
+
+        chunks = [call[0][4]
+                  for call in perform_single_compilation_mock.call_args_list]
+        self.assertEqual([tests, tests[:2], tests[2:], tests[2:3], tests[3:]],
+                         chunks)
+
+        self.assertIsNotNone(tests[0].insns)
+        self.assertIsNotNone(tests[1].insns)
+        self.assertIsNone(tests[2].insns)
+        self.assertIsNotNone(tests[3].insns)
+
+        expected_stdout = '''\
+Using 1 threads
+
+Compiled 2/4
+Failed to compile test "code2;" with B=16 and types int32<4>
+Compiled 3/4
+Compiled 4/4
+'''
+        self.assertEqual(expected_stdout, stdout.getvalue())
+        self.assertEqual('error\n', stderr.getvalue())
+
+    @mock.patch('concurrent.futures.ProcessPoolExecutor',
+                side_effect=futures.ThreadPoolExecutor)
+    @mock.patch('asmtest.asm_collect.perform_single_compilation')
+    @mock.patch('asmtest.asm_collect.perform_single_baseline_compilation')
+    @mock.patch('asmtest.asm_collect.get_default_job_count',
+                side_effect=lambda: 1)
+    def test_isolate_baseline_failure(self, _,
+                                      perform_single_baseline_compilation_mock,
+                                      perform_single_compilation_mock, _2):
+        config1 = InsnSetConfig([InsnSet.X86_SSE2])
+        config2 = InsnSetConfig([InsnSet.X86_AVX])
+
+        def compile_baseline(path, test_dir, compiler, config, *args):
+            if config is config2:
+                raise Exception('error')
+            return compile_empty_baseline(path, test_dir, compiler, config,
+                                          *args)
+
+        perform_single_baseline_compilation_mock.side_effect = \
+            compile_baseline
+        perform_single_compilation_mock.side_effect = \
+            lambda *args: ([InsnCount() for _ in args[4]], None)
+
+        tests1 = [Test(TestDesc(f'code{i};', 16, ['int32<4>']), f'id{i}')
+                  for i in range(2)]
+        tests2 = [Test(TestDesc(f'code{i};', 16, ['int32<4>']), f'id{i}')
+                  for i in range(3)]
+        stderr = StringIO()
+        stdout = StringIO()
+
+        perform_all_tests('path', mock.Mock(),
+                          [(config1, {'cat': tests1}),
+                           (config2, {'cat': tests2})], 4,
+                          stdout=stdout, stderr=stderr,
+                          isolate_failures=True)
+
+        self.assertEqual([tests1],
+                         [call[0][4] for call in
+                          perform_single_compilation_mock.call_args_list])
+        for test in tests1:
+            self.assertEqual({}, test.insns.insns)
+        for test in tests2:
+            self.assertIsNone(test.insns)
+
+        expected_stdout = '''\
+Using 1 threads
+
+Failed to compile baseline for IsnsSetConfig(short_ids:avx)
+Compiled 5/5
+'''
+        self.assertEqual(expected_stdout, stdout.getvalue())
+        self.assertEqual('error\n', stderr.getvalue())
+
+    @mock.patch('concurrent.futures.ProcessPoolExecutor',
+                side_effect=futures.ThreadPoolExecutor)
+    @mock.patch('asmtest.asm_collect.perform_single_compilation')
+    @mock.patch('asmtest.asm_collect.perform_single_baseline_compilation')
+    @mock.patch('asmtest.asm_collect.build_precompiled_header')
+    @mock.patch('asmtest.asm_collect.get_default_job_count',
+                side_effect=lambda: 1)
+    def test_pch_failure(self, _, build_precompiled_header_mock,
+                         perform_single_baseline_compilation_mock,
+                         perform_single_compilation_mock, _2):
+        config1 = InsnSetConfig([InsnSet.X86_SSE2])
+        config2 = InsnSetConfig([InsnSet.X86_AVX])
+
+        def build_pch(path, compiler, config, pch_dir):
+            if config is config1:
+                raise Exception('error')
+            return 'pch/simdpp_pch.h'
+
+        build_precompiled_header_mock.side_effect = build_pch
+        perform_single_baseline_compilation_mock.side_effect = \
+            compile_empty_baseline
+        perform_single_compilation_mock.side_effect = \
+            lambda *args: ([InsnCount() for _ in args[4]], None)
+
+        tests1 = [Test(TestDesc('code1;', 16, ['int32<4>']), 'id1')]
+        tests2 = [Test(TestDesc('code2;', 16, ['int32<4>']), 'id2')]
+        stdout = StringIO()
+
+        perform_all_tests('path', mock.Mock(),
+                          [(config1, {'cat': tests1}),
+                           (config2, {'cat': tests2})], 4,
+                          stdout=stdout, stderr=StringIO(), use_pch=True)
+
+        # the tests of the config whose header failed to build are compiled
+        # without the precompiled header
+        pch_paths = {call[0][3].short_ids()[0]: call[0][6]
+                     for call in perform_single_compilation_mock.call_args_list}
+        self.assertEqual({'sse2': None, 'avx': 'pch/simdpp_pch.h'}, pch_paths)
+        self.assertIsNotNone(tests1[0].insns)
+        self.assertIsNotNone(tests2[0].insns)
+        self.assertIn('Could not build precompiled header for ' +
+                      'IsnsSetConfig(short_ids:sse2)', stdout.getvalue())
+
+    @mock.patch('asmtest.asm_collect.perform_single_compilation_async')
+    @mock.patch('asmtest.asm_collect.perform_single_baseline_compilation_async')
+    @mock.patch('asmtest.asm_collect.get_default_job_count',
+                side_effect=lambda: 1)
+    def test_asyncio(self, _, perform_single_baseline_compilation_mock,
+                     perform_single_compilation_mock):
+        async def compile_baseline(*args):
+            return compile_empty_baseline(*args)
+
+        async def compile_chunk(path, test_dir, compiler, config, tests_chunk,
+                                *args):
+            ret = []
+            for test in tests_chunk:
+                insns = InsnCount()
+                insns.add_insn(test.desc.code, 1)
+                ret.append(insns)
+            return ret, None
+
+        perform_single_baseline_compilation_mock.side_effect = \
+            compile_baseline
+        perform_single_compilation_mock.side_effect = compile_chunk
+
+        tests = [Test(TestDesc(f'code{i};', 16, ['int32<4>']), f'id{i}')
+                 for i in range(3)]
+        config = InsnSetConfig([InsnSet.X86_SSE2])
+        stderr = StringIO()
+        stdout = StringIO()
+
+        perform_all_tests('path', mock.Mock(), [(config, {'cat': tests})], 2,
+                          stdout=stdout, stderr=stderr, use_asyncio=True)
+
+        self.assertEqual([{f'code{i};': 1} for i in range(3)],
+                         [test.insns.insns for test in tests])
+        self.assertEqual('', stderr.getvalue())
+
+    @mock.patch('concurrent.futures.ProcessPoolExecutor',
+                side_effect=futures.ThreadPoolExecutor)
+    @mock.patch('asmtest.asm_collect.detect_insn_set_support')
+    @mock.patch('asmtest.asm_collect.perform_single_compilation')
+    @mock.patch('asmtest.asm_collect.perform_single_baseline_compilation')
+    @mock.patch('asmtest.asm_collect.get_default_job_count',
+                side_effect=lambda: 1)
+    def test_config_detection(self, _,
+                              perform_single_baseline_compilation_mock,
+                              perform_single_compilation_mock,
+                              detect_insn_set_support_mock, _2):
+        perform_single_baseline_compilation_mock.side_effect = \
+            compile_empty_baseline
+        perform_single_compilation_mock.side_effect = \
+            lambda *args: ([InsnCount() for _ in args[4]], None)
+
+        def detect(path, compiler, config):
+            if config.insn_sets == [InsnSet.X86_AVX]:
+                return False, [], None, 'unsupported'
+            return True, ['cap'], None, None
+
+        detect_insn_set_support_mock.side_effect = detect
+
+        config_sse2 = InsnSetConfig([InsnSet.X86_SSE2])
+        config_avx = InsnSetConfig([InsnSet.X86_AVX])
+        config_sse3 = InsnSetConfig([InsnSet.X86_SSE3])
+
+        tests_by_config = {}
+
+        def get_tests_for_config(config):
+            tests = [Test(TestDesc(f'code{i};', 16, ['int32<4>']), f'id{i}')
+                     for i in range(3)]
+            tests_by_config[config.insn_sets[0]] = tests
+            # the first test already has results
+            return {'cat': tests}, {'cat': tests[1:]}
+
+        config_detection = ConfigDetection(
+            [config_sse2, config_avx, config_sse3], get_tests_for_config)
+        test_and_config_list = []
+        stdout = StringIO()
+        stderr = StringIO()
+
+        perform_all_tests('path', mock.Mock(), test_and_config_list, 1,
+                          stdout=stdout, stderr=stderr,
+                          test_source=TestSource([], regenerate=True),
+                          config_detection=config_detection)
+
+        self.assertEqual([[InsnSet.X86_SSE2], [InsnSet.X86_SSE3]],
+                         [config.insn_sets for config, _ in
+                          test_and_config_list])
+        self.assertEqual(['cap'], test_and_config_list[0][0].capabilities)
+        self.assertEqual([config.insn_sets for config, _ in
+                          test_and_config_list],
+                         [config.insn_sets for config in
+                          config_detection.supported_configs])
+        self.assertEqual([(config_avx, 'unsupported')],
+                         config_detection.unsupported_configs)
+
+        for tests in tests_by_config.values():
+            self.assertIsNone(tests[0].insns)
+            self.assertIsNotNone(tests[1].insns)
+            self.assertIsNotNone(tests[2].insns)
+        self.assertEqual(4, len(perform_single_compilation_mock.call_args_list))
+        self.assertEqual('', stderr.getvalue())
+
+    @mock.patch('concurrent.futures.ProcessPoolExecutor',
+                side_effect=futures.ThreadPoolExecutor)
+    @mock.patch('asmtest.asm_collect.detect_insn_set_support')
+    @mock.patch('asmtest.asm_collect.perform_single_compilation')
+    @mock.patch('asmtest.asm_collect.perform_single_baseline_compilation')
+    @mock.patch('asmtest.asm_collect.get_default_job_count',
+                side_effect=lambda: 1)
+    def test_config_detection_equivalent_configs(
+            self, _, perform_single_baseline_compilation_mock,
+            perform_single_compilation_mock, detect_insn_set_support_mock,
+            _2):
+        perform_single_baseline_compilation_mock.side_effect = \
+            compile_empty_baseline
+        perform_single_compilation_mock.side_effect = \
+            lambda *args: ([InsnCount() for _ in args[4]], None)
+
+        def detect(path, compiler, config):
+            # SSE3 compiles to the same code as SSE2
+            if config.insn_sets == [InsnSet.X86_AVX]:
+                return True, ['cap'], 'fp_avx', None
+            return True, ['cap'], 'fp_sse2', None
+
+        detect_insn_set_support_mock.side_effect = detect
+
+        def get_tests_for_config(config):
+            tests = [Test(TestDesc(f'code{i};', 16, ['int32<4>']), f'id{i}')
+                     for i in range(3)]
+            return {'cat': tests}, {'cat': tests}
+
+        config_detection = ConfigDetection(
+            [InsnSetConfig([InsnSet.X86_SSE2]),
+             InsnSetConfig([InsnSet.X86_SSE3]),
+             InsnSetConfig([InsnSet.X86_AVX])], get_tests_for_config)
+        test_and_config_list = []
+        stdout = StringIO()
+
+        perform_all_tests('path', mock.Mock(), test_and_config_list, 1,
+                          stdout=stdout, stderr=StringIO(),
+                          test_source=TestSource([], regenerate=True),
+                          config_detection=config_detection)
+
+        self.assertEqual([[InsnSet.X86_SSE2], [InsnSet.X86_SSE3],
+                          [InsnSet.X86_AVX]],
+                         [config.insn_sets for config, _ in
+                          test_and_config_list])
+        self.assertIs(test_and_config_list[0][1], test_and_config_list[1][1])
+        self.assertIsNot(test_and_config_list[0][1],
+                         test_and_config_list[2][1])
+        for test in test_and_config_list[1][1]['cat']:
+            self.assertIsNotNone(test.insns)
+        self.assertEqual(6, len(perform_single_compilation_mock.call_args_list))
+        self.assertIn('Reusing the results of sse2 for equivalent config sse3',
+                      stdout.getvalue())
+
+
+def create_future(result=None, exception=None):
+    future = futures.Future()
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
+    return future
+
+
+def create_tests(count, prefix='code'):
+    return [Test(TestDesc(f'{prefix}{i};', 16, ['int32<4>']), f'id{i}')
+            for i in range(count)]
+
+
+class TestCompilationScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.config1 = InsnSetConfig([InsnSet.X86_SSE2])
+        self.config2 = InsnSetConfig([InsnSet.X86_AVX])
+        self.tests1 = create_tests(3)
+        self.tests2 = create_tests(2)
+        self.test_and_config_list = [(self.config1, {'cat': self.tests1}),
+                                     (self.config2, {'cat': self.tests2})]
+        self.job_functions = JobFunctions(mock.Mock(), mock.Mock(),
+                                          mock.Mock(), mock.Mock())
+        self.executor = mock.Mock()
+        self.resource_limiter = mock.Mock()
+        self.stdout = StringIO()
+        self.stderr = StringIO()
+
+    def create_scheduler(self, **kwargs):
+        context = WorkerContext('path', 'tmp', mock.Mock(),
+                                TestSource(self.test_and_config_list))
+        return CompilationScheduler(context, self.executor,
+                                    self.job_functions,
+                                    self.resource_limiter, 2,
+                                    stdout=self.stdout, stderr=self.stderr,
+                                    **kwargs)
+
+    def test_start_config(self):
+        scheduler = self.create_scheduler()
+        scheduler.start_config(0, self.config1, {'cat': self.tests1})
+
+        self.assertEqual(3, scheduler.total_test_count)
+        self.assertEqual(1, len(scheduler.queued_jobs))
+        fn, args, _ = scheduler.queued_jobs[0]
+        self.assertIs(self.job_functions.baseline, fn)
+        self.assertEqual((self.config1, None), (args[0], args[2]))
+        self.assertEqual(1, len(args[1]))
+
+        chunks = [scheduler.queued_chunks.pop()
+                  for _ in range(len(scheduler.queued_chunks))]
+        self.assertEqual([2, 1], [len(chunk.tests) for chunk in chunks])
+
+    @mock.patch('tempfile.mkdtemp', side_effect=lambda dir: dir + '/pch')
+    def test_pch_failure(self, _):
+        scheduler = self.create_scheduler(use_pch=True)
+        scheduler.start_config(0, self.config1, {'cat': self.tests1})
+
+        self.assertEqual(0, len(scheduler.queued_chunks))
+        fn, args, on_done = scheduler.queued_jobs.popleft()
+        self.assertIs(self.job_functions.build_pch, fn)
+        self.assertEqual(self.config1, args[2])
+        self.assertEqual('tmp/pch', args[3])
+
+        self.assertTrue(on_done(create_future(exception=Exception('error'))))
+        self.assertIn('Could not build precompiled header for ' +
+                      'IsnsSetConfig(short_ids:sse2)', self.stdout.getvalue())
+        _, args, _ = scheduler.queued_jobs.popleft()
+        self.assertIsNone(args[2])
+        self.assertIsNone(scheduler.queued_chunks.pop().pch_path)
+
+    def test_chunk_success(self):
+        scheduler = self.create_scheduler()
+        scheduler.start_config(1, self.config2, {'cat': self.tests2})
+        chunk = scheduler.queued_chunks.pop()
+        future = create_future((encode_insn_counts(
+            [InsnCount.from_dict({'mov': 1}), InsnCount.from_dict({'ret': 2})]),
+            0.5))
+
+        self.assertTrue(scheduler.on_chunk_done(chunk, future))
+        self.assertEqual([{'mov': 1}, {'ret': 2}],
+                         [dict(test.insns.insns) for test in self.tests2])
+        self.assertEqual(self.tests2, scheduler.compiled_tests[1])
+        self.assertEqual('Compiled 2/2\n', self.stdout.getvalue())
+
+    def test_chunk_failure(self):
+        scheduler = self.create_scheduler()
+        chunk = CompilationChunk(0, self.config1, ['cat'] * 3, self.tests1,
+                                 None)
+        self.assertFalse(scheduler.on_chunk_done(
+            chunk, create_future(exception=Exception('error'))))
+        self.assertEqual('Failed to compile...\n', self.stdout.getvalue())
+        self.assertEqual('error\n', self.stderr.getvalue())
+
+    def test_chunk_failure_isolated(self):
+        scheduler = self.create_scheduler(isolate_failures=True)
+        scheduler.start_config(1, self.config2, {'cat': self.tests2})
+        scheduler.queued_chunks.push(CompilationChunk(
+            0, self.config1, ['cat'] * 3, self.tests1, None))
+        chunk = CompilationChunk(0, self.config1, ['cat'] * 3, self.tests1,
+                                 None)
+
+        self.assertTrue(scheduler.on_chunk_done(
+            chunk, create_future(exception=Exception('error'))))
+        self.assertEqual([self.tests1[:1], self.tests1[1:]],
+                         [scheduler.queued_chunks.pop().tests
+                          for _ in range(2)])
+
+        single = CompilationChunk(0, self.config1, ['cat'], self.tests1[:1],
+                                  None)
+        self.assertTrue(scheduler.on_chunk_done(
+            single, create_future(exception=Exception('error'))))
+        self.assertIsNone(self.tests1[0].insns)
+        self.assertEqual(1, scheduler.processed_test_count)
+        self.assertIn('Failed to compile test "code0;"',
+                      self.stdout.getvalue())
+
+    def test_baseline_failure_isolated(self):
+        scheduler = self.create_scheduler(isolate_failures=True)
+        scheduler.start_config(0, self.config1, {'cat': self.tests1})
+        scheduler.start_config(1, self.config2, {'cat': self.tests2})
+        _, _, on_done = scheduler.queued_jobs.popleft()
+
+        self.assertTrue(on_done(create_future(exception=Exception('error'))))
+        self.assertEqual(3, scheduler.processed_test_count)
+        self.assertEqual([1], [scheduler.queued_chunks.pop().config_index
+                               for _ in range(len(scheduler.queued_chunks))])
+        self.assertNotIn(0, scheduler.baselines)
+
+    def test_baseline_overhead(self):
+        scheduler = self.create_scheduler()
+        scheduler.start_config(0, self.config1, {'cat': self.tests1})
+        _, _, on_done = scheduler.queued_jobs.popleft()
+
+        self.assertTrue(on_done(create_future(({}, 2.0))))
+        self.assertEqual({}, scheduler.baselines[0])
+        self.assertEqual(2.0, scheduler.compile_time_history.get_overhead(
+            self.config1))
+
+    def test_detection(self):
+        def get_tests_for_config(config):
+            tests = create_tests(2, 'detected')
+            return {'cat': tests}, {'cat': tests}
+
+        config_detection = ConfigDetection(
+            [InsnSetConfig([InsnSet.X86_SSE3]),
+             InsnSetConfig([InsnSet.X86_AVX2])], get_tests_for_config)
+        scheduler = self.create_scheduler(config_detection=config_detection)
+        scheduler.queue_detection()
+        self.assertEqual([self.job_functions.detection] * 2,
+                         [fn for fn, _, _ in scheduler.queued_jobs])
+
+        _, _, on_done = scheduler.queued_jobs.popleft()
+        self.assertTrue(on_done(create_future((True, [], None, None))))
+        _, _, on_done = scheduler.queued_jobs.popleft()
+        self.assertTrue(on_done(create_future(exception=Exception('error'))))
+
+        self.assertEqual([0], list(scheduler.detected_tests.keys()))
+        self.assertEqual(2, scheduler.total_test_count)
+        self.assertEqual(1, len(scheduler.queued_chunks))
+        self.assertEqual(2, scheduler.queued_chunks.pop().config_index)
+        self.assertEqual(1, len(config_detection.unsupported_configs))
+
+    def test_submit_queued_jobs(self):
+        self.resource_limiter.can_start_job.side_effect = \
+            lambda pending_count: pending_count < 2
+        self.executor.submit.side_effect = lambda *args: mock.Mock()
+        scheduler = self.create_scheduler()
+        scheduler.start_config(0, self.config1, {'cat': self.tests1})
+
+        scheduler.submit_queued_jobs()
+        self.assertEqual(2, len(scheduler.pending_jobs))
+        self.assertEqual(1, len(scheduler.queued_chunks))
+        calls = self.executor.submit.call_args_list
+        self.assertIs(self.job_functions.baseline, calls[0][0][0])
+        self.assertEqual((self.job_functions.compilation, 0, self.config1,
+                          [(0, 2)], None), calls[1][0])
+
+    def test_handle_completed_jobs(self):
+        scheduler = self.create_scheduler()
+        handled = []
+        done = [create_future(i) for i in range(3)]
+        other = mock.Mock()
+        for order, future in [(2, done[0]), (0, done[1]), (1, done[2])]:
+            scheduler.pending_jobs[future] = (
+                order, lambda future: handled.append(future.result()) or True)
+        scheduler.pending_jobs[other] = (3, None)
+
+        self.assertTrue(scheduler.handle_completed_jobs(done))
+        self.assertEqual([1, 2, 0], handled)
+
+        failed = create_future()
+        scheduler.pending_jobs[failed] = (4, lambda future: False)
+        self.assertFalse(scheduler.handle_completed_jobs([failed]))
+        other.cancel.assert_called_once_with()
+
+    def test_postprocess_compiled_tests(self):
+        scheduler = self.create_scheduler()
+        for test in self.tests1 + self.tests2:
+            test.insns = InsnCount.from_dict({'mov': 2, 'ret': 1})
+        scheduler.compiled_tests[0] = self.tests1
+        scheduler.compiled_tests[1] = self.tests2
+        scheduler.baselines[0] = {
+            get_test_signature(self.tests1[0].desc):
+                InsnCount.from_dict({'ret': 1})}
+
+        scheduler.postprocess_compiled_tests()
+        self.assertEqual([{'mov': 2}] * 3,
+                         [dict(test.insns.insns) for test in self.tests1])
+        self.assertEqual([None, None], [test.insns for test in self.tests2])
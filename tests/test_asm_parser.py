@@ -17,10 +17,16 @@
 
 from __future__ import print_function
 
+import copy
+import pickle
 import unittest
 
 from asmtest.asm_parser import AsmFunction
+from asmtest.asm_parser import AsmFunctionParser
 from asmtest.asm_parser import InsnCount
+from asmtest.asm_parser import decode_insn_counts
+from asmtest.asm_parser import encode_insn_counts
+from asmtest.asm_parser import iter_compiler_asm_functions
 from asmtest.asm_parser import parse_compiler_asm_output
 
 
@@ -124,6 +130,83 @@ function_name:
         ]
         self.assertEqual(expected, parse_compiler_asm_output(output))
 
+    def test_msvc_function(self):
+        output = '''
+_function_name PROC ; COMDAT
+    insn1
+_function_name ENDP
+function_name2 PROC ; COMDAT
+    insn2
+function_name2 ENDP
+'''
+
+        expected = [
+            AsmFunction('function_name', ['insn1']),
+            AsmFunction('function_name2', ['insn2']),
+        ]
+        self.assertEqual(expected, parse_compiler_asm_output(output))
+
+
+class TestIterCompilerAsmFunctions(unittest.TestCase):
+
+    def test_function_filter(self):
+        lines = [
+            'function_name:',
+            '    insn1',
+            'skipped_name:',
+            '    insn2',
+            'function_name2:',
+            '    insn3',
+            'skipped_name2:',
+            '    insn4',
+        ]
+
+        expected = [
+            AsmFunction('function_name', ['insn1']),
+            AsmFunction('function_name2', ['insn3']),
+        ]
+        result = iter_compiler_asm_functions(
+            lines, lambda name: name.startswith('function'))
+        self.assertEqual(expected, list(result))
+
+    def test_canonical_insns(self):
+        lines = [
+            'function_name:',
+            '    movapd %xmm0, %xmm1',
+            '    movaps %xmm1, %xmm2',
+            '    addps %xmm1, %xmm2',
+        ]
+
+        expected = [
+            AsmFunction('function_name', ['movaps', 'movaps', 'addps']),
+        ]
+        result = iter_compiler_asm_functions(
+            lines, canonical_insns={'movapd': 'movaps'})
+        self.assertEqual(expected, list(result))
+
+
+class TestAsmFunctionParser(unittest.TestCase):
+
+    def test_batches(self):
+        lines = [
+            'test1:',
+            '   movaps  xmm0, xmm1',
+            'skipped:',
+            '   addps   xmm0, xmm1',
+            'test2:',
+            '   addps   xmm0, xmm1',
+            '   ret',
+        ]
+        parser = AsmFunctionParser(lambda name: name.startswith('test'))
+        functions = []
+        for i in range(0, len(lines), 3):
+            functions += parser.parse(lines[i:i + 3])
+        functions.append(parser.finish())
+
+        self.assertEqual([AsmFunction('test1', ['movaps']),
+                          AsmFunction('test2', ['addps', 'ret'])], functions)
+        self.assertIsNone(parser.finish())
+
 
 class TestInsnCountFromInsnList(unittest.TestCase):
 
@@ -164,3 +247,64 @@ class TestInsnCount(unittest.TestCase):
         count.add_insn('mov', 1)
         count.sub_insn('mov', 1)
         self.assertEqual({}, count.insns)
+
+    def test_add_and_sub(self):
+        count = InsnCount.from_dict({'mov': 2, 'add': 1, 'sub': 1})
+        other = InsnCount.from_dict({'mov': 1, 'add': 1, 'xor': 3})
+        count.sub(other)
+        self.assertEqual({'mov': 1, 'sub': 1, 'xor': -3}, count.insns)
+        count.add(other)
+        self.assertEqual({'mov': 2, 'add': 1, 'sub': 1}, count.insns)
+        self.assertEqual(count,
+                         InsnCount.from_dict({'sub': 1, 'add': 1, 'mov': 2}))
+        self.assertEqual(2, count.get('mov'))
+        self.assertEqual(0, count.get('xor'))
+
+    def test_merge(self):
+        count = InsnCount.from_dict({'a1': 1, 'a2': 2, 'a3': 3, 'a4': 4})
+        count.merge(InsnCount.from_dict({'a0': 1, 'a2': 1, 'a4': 2,
+                                         'a5': 1}), -2)
+        self.assertEqual({'a0': -2, 'a1': 1, 'a3': 3, 'a5': -2},
+                         count.insns)
+        count.merge(InsnCount())
+        count.merge(count, 0)
+        self.assertEqual({'a0': -2, 'a1': 1, 'a3': 3, 'a5': -2},
+                         count.insns)
+
+        count = InsnCount()
+        count.merge(InsnCount.from_dict({'a1': 1, 'a2': 2}))
+        self.assertEqual({'a1': 1, 'a2': 2}, count.insns)
+
+    def test_insns_is_read_only(self):
+        count = InsnCount.from_dict({'mov': 2})
+        with self.assertRaises(TypeError):
+            count.insns['mov'] = 1
+        with self.assertRaises(AttributeError):
+            count.insns = {'mov': 1}
+        self.assertEqual({'mov': 2}, count.to_dict())
+
+    def test_copy_and_pickle(self):
+        count = InsnCount.from_dict({'mov': 2, 'add': -1})
+        copied = copy.deepcopy(count)
+        copied.add_insn('mov')
+        self.assertEqual({'mov': 2, 'add': -1}, count.insns)
+        self.assertEqual(count, pickle.loads(pickle.dumps(count)))
+
+
+class TestEncodeInsnCounts(unittest.TestCase):
+
+    def test_roundtrip(self):
+        count1 = InsnCount.from_dict({'mov': 2, 'add': -1})
+        count2 = InsnCount()
+        count3 = InsnCount.from_dict({'add': 1})
+
+        encoded = encode_insn_counts([count1, count2, count3])
+        # each name is stored once, in the order of the interned ids
+        self.assertEqual(['add', 'mov'], sorted(encoded[0]))
+
+        decoded = decode_insn_counts(encoded)
+        self.assertEqual([{'mov': 2, 'add': -1}, {}, {'add': 1}],
+                         [count.insns for count in decoded])
+
+    def test_empty(self):
+        self.assertEqual([], decode_insn_counts(encode_insn_counts([])))
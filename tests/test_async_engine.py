@@ -0,0 +1,142 @@
+#   Copyright (C) 2018  Povilas Kanapickas <povilas@radix.lt>
+#
+#   This file is part of libsimdpp asm tests
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see http://www.gnu.org/licenses/.
+
+from __future__ import print_function
+
+import asyncio
+import sys
+import time
+import unittest
+
+from asmtest.async_engine import AsyncioExecutor
+from asmtest.utils import call_program_async
+from asmtest.utils import iter_program_output_lines_async
+
+
+class TestAsyncioExecutor(unittest.TestCase):
+
+    def test_results(self):
+        async def square(value):
+            await asyncio.sleep(0)
+            return value * value
+
+        with AsyncioExecutor(max_workers=2) as executor:
+            work_futures = [executor.submit(square, i) for i in range(5)]
+            self.assertEqual([0, 1, 4, 9, 16],
+                             [future.result() for future in work_futures])
+
+    def test_exception(self):
+        async def fail():
+            raise Exception('error')
+
+        with AsyncioExecutor(max_workers=2) as executor:
+            future = executor.submit(fail)
+            with self.assertRaisesRegex(Exception, 'error'):
+                future.result()
+
+    def test_max_workers(self):
+        running = []
+        max_running = []
+
+        async def work():
+            running.append(True)
+            max_running.append(len(running))
+            await asyncio.sleep(0.01)
+            running.pop()
+
+        with AsyncioExecutor(max_workers=3) as executor:
+            for future in [executor.submit(work) for _ in range(10)]:
+                future.result()
+        self.assertEqual(3, max(max_running))
+
+    def test_initializer(self):
+        values = []
+        with AsyncioExecutor(max_workers=2, initializer=values.append,
+                             initargs=(1,)):
+            pass
+        self.assertEqual([1], values)
+
+    def test_run_in_executor(self):
+        async def work():
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, sum, [1, 2, 3])
+
+        with AsyncioExecutor(max_workers=2, parse_workers=1) as executor:
+            self.assertEqual(6, executor.submit(work).result())
+
+
+class TestCallProgramAsync(unittest.TestCase):
+
+    def run_coroutine(self, coro):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coro)
+        finally:
+            loop.close()
+
+    def test_input_output(self):
+        args = [sys.executable, '-c',
+                'import sys; sys.stdout.write(sys.stdin.read().upper())']
+        self.assertEqual('ABC', self.run_coroutine(
+            call_program_async(args, input='abc')))
+
+    def test_returncode(self):
+        args = [sys.executable, '-c', 'import sys; sys.exit(3)']
+        with self.assertRaisesRegex(Exception, 'code: 3'):
+            self.run_coroutine(call_program_async(args))
+
+    def test_timeout(self):
+        args = [sys.executable, '-c', 'import time; time.sleep(30)']
+        start_time = time.time()
+        with self.assertRaisesRegex(Exception, 'did not finish'):
+            self.run_coroutine(call_program_async(args, timeout=0.5))
+        self.assertLess(time.time() - start_time, 10)
+
+
+class TestIterProgramOutputLinesAsync(unittest.TestCase):
+
+    def collect_lines(self, args, **kwargs):
+        async def collect():
+            return [line async for line
+                    in iter_program_output_lines_async(args, **kwargs)]
+
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(collect())
+        finally:
+            loop.close()
+
+    def test_lines(self):
+        args = [sys.executable, '-c',
+                'import sys; sys.stdout.write(sys.stdin.read().upper())']
+        self.assertEqual(['A\n', 'B\n', 'C'],
+                         self.collect_lines(args, input='a\nb\nc'))
+
+    def test_returncode(self):
+        args = [sys.executable, '-c',
+                'import sys; print("out"); sys.stderr.write("err"); '
+                'sys.exit(3)']
+        with self.assertRaisesRegex(Exception, 'code: 3\nstderr:\nerr'):
+            self.collect_lines(args)
+
+    def test_timeout(self):
+        args = [sys.executable, '-c',
+                'import time; print("out", flush=True); time.sleep(30)']
+        start_time = time.time()
+        with self.assertRaisesRegex(Exception, 'did not finish'):
+            self.collect_lines(args, timeout=0.5)
+        self.assertLess(time.time() - start_time, 10)
@@ -19,8 +19,23 @@ from __future__ import print_function
 
 import unittest
 
+from asmtest.compiler import CompilerGcc
+from asmtest.compiler import CompilerInvocation
 from asmtest.compiler import detect_gcc_like_compiler_from_version_output
 from asmtest.compiler import detect_msvc_compiler_from_id
+from asmtest.compiler import get_preprocessed_fingerprint
+from asmtest.compiler import parse_preprocessed_capabilities
+from asmtest.insn_set import InsnSet
+from asmtest.insn_set import InsnSetConfig
+
+
+def create_gcc_like_compiler(name):
+    compiler = CompilerGcc()
+    compiler.name = name
+    compiler.path = 'g++' if name == 'gcc' else 'clang++'
+    compiler.version = '7.2.0'
+    compiler.target_arch = 'x86_64'
+    return compiler
 
 
 class TestDetectGccLikeCompilerFromVersionOutput(unittest.TestCase):
@@ -77,3 +92,84 @@ class TestDetectCompilerFromId(unittest.TestCase):
     def test_msvc_2010_no_env(self):
         with self.assertRaises(Exception):
             detect_msvc_compiler_from_id('Visual Studio 10 2010', {})
+
+
+class TestParsePreprocessedCapabilities(unittest.TestCase):
+
+    def test_parse(self):
+        macros = '''#define has_INT8_SIMD_cap
+#define asmtest_has_no_INT8_SIMD_cap
+#define SIMDPP_HAS_INT16_SIMD 1
+#define asmtest_has_INT16_SIMD_cap
+'''
+        self.assertEqual(['INT16_SIMD'], parse_preprocessed_capabilities(
+            macros, ['INT8_SIMD', 'INT16_SIMD']))
+
+    def test_missing_capability(self):
+        with self.assertRaisesRegex(Exception, 'INT8_SIMD'):
+            parse_preprocessed_capabilities('#define asmtest_has_X_cap\n',
+                                            ['INT8_SIMD'])
+
+
+class TestGetPreprocessedFingerprint(unittest.TestCase):
+
+    def test_ignores_arch_macros_and_order(self):
+        macros = '''#define __SSE2__ 1
+#define SIMDPP_ARCH_X86_SSE2
+#define SIMDPP_USE_SSE2 1
+'''
+        self.assertEqual(
+            get_preprocessed_fingerprint(macros),
+            get_preprocessed_fingerprint(
+                '#define SIMDPP_USE_SSE2 1\n#define __SSE2__ 1\n'))
+        self.assertNotEqual(
+            get_preprocessed_fingerprint(macros),
+            get_preprocessed_fingerprint(macros + '#define __SSE3__ 1\n'))
+
+
+class TestPrecompiledHeaderFlags(unittest.TestCase):
+
+    def setUp(self):
+        self.config = InsnSetConfig([InsnSet.X86_SSE2])
+
+    def test_pch_output_path(self):
+        self.assertEqual('dir/simdpp_pch.h.gch',
+                         create_gcc_like_compiler('gcc').get_pch_output_path(
+                             'dir/simdpp_pch.h'))
+        self.assertEqual('dir/simdpp_pch.h.pch',
+                         create_gcc_like_compiler('clang').get_pch_output_path(
+                             'dir/simdpp_pch.h'))
+
+    def test_pch_use_flags(self):
+        # GCC picks up the precompiled header next to the included header,
+        # while clang needs the precompiled header itself
+        self.assertEqual(['-include', 'dir/simdpp_pch.h', '-Winvalid-pch'],
+                         create_gcc_like_compiler('gcc').get_pch_use_flags(
+                             'dir/simdpp_pch.h'))
+        self.assertEqual(['-include-pch', 'dir/simdpp_pch.h.pch'],
+                         create_gcc_like_compiler('clang').get_pch_use_flags(
+                             'dir/simdpp_pch.h'))
+
+    def test_pch_build_flags(self):
+        compiler = create_gcc_like_compiler('clang')
+        invocation = CompilerInvocation(
+            self.config, 'simdpp', 'dir/simdpp_pch.h',
+            compiler.get_pch_output_path('dir/simdpp_pch.h'),
+            is_pch_build=True)
+        flags = compiler.get_flags(invocation)
+        self.assertEqual(['-x', 'c++-header', 'dir/simdpp_pch.h', '-o',
+                          'dir/simdpp_pch.h.pch'], flags[:5])
+        self.assertNotIn('-include-pch', flags)
+
+        # the flags that affect the code must match when using the header
+        use_flags = compiler.get_flags(CompilerInvocation(
+            self.config, 'simdpp', 'test.cc', 'test.o',
+            pch_path='dir/simdpp_pch.h'))
+        self.assertEqual(flags[5:], use_flags[-len(flags[5:]):])
+        self.assertIn('-include-pch', use_flags)
+
+    def test_no_pch(self):
+        flags = create_gcc_like_compiler('gcc').get_flags(CompilerInvocation(
+            self.config, 'simdpp', 'test.cc', 'test.o'))
+        self.assertNotIn('-include', flags)
+        self.assertNotIn('-x', flags)
@@ -0,0 +1,119 @@
+#   Copyright (C) 2018  Povilas Kanapickas <povilas@radix.lt>
+#
+#   This file is part of libsimdpp asm tests
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see http://www.gnu.org/licenses/.
+
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from asmtest.compiler import CompilerGcc
+from asmtest.detection_cache import DetectionCache
+from asmtest.insn_set import InsnSet
+from asmtest.insn_set import InsnSetConfig
+
+if sys.version_info[0] < 3:
+    import mock
+else:
+    from unittest import mock  # noqa: pylint: disable=ungrouped-imports
+
+
+class TestDetectionCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.tmp_dir, 'cache', 'detect.json')
+        self.compiler_path = os.path.join(self.tmp_dir, 'g++')
+        self.write_compiler('binary')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_compiler(self, contents):
+        with open(self.compiler_path, 'w') as out_f:
+            out_f.write(contents)
+
+    def create_compiler(self):
+        compiler = CompilerGcc()
+        compiler.name = 'gcc'
+        compiler.path = self.compiler_path
+        compiler.version = '7.2.0'
+        compiler.target_arch = 'x86_64'
+        return compiler
+
+    def test_missing_file(self):
+        cache = DetectionCache.load(self.cache_path)
+        self.assertIsNone(cache.get_compiler(self.compiler_path))
+        self.assertIsNone(cache.get_insn_sets(self.create_compiler(), 'lib'))
+
+    def test_compiler(self):
+        cache = DetectionCache.load(self.cache_path)
+        cache.put_compiler(self.compiler_path, self.create_compiler())
+        cache.save()
+
+        compiler = DetectionCache.load(self.cache_path).get_compiler(
+            self.compiler_path)
+        self.assertIsInstance(compiler, CompilerGcc)
+        self.assertEqual(('gcc', '7.2.0', 'x86_64', self.compiler_path),
+                         (compiler.name, compiler.version,
+                          compiler.target_arch, compiler.path))
+
+        self.write_compiler('new binary')
+        self.assertIsNone(
+            DetectionCache.load(self.cache_path).get_compiler(
+                self.compiler_path))
+
+    def test_binary_not_read(self):
+        cache = DetectionCache.load(self.cache_path)
+        cache.put_compiler(self.compiler_path, self.create_compiler())
+        with mock.patch('asmtest.fingerprint.hash_file') as hash_file_mock:
+            self.assertIsNotNone(cache.get_compiler(self.compiler_path))
+        hash_file_mock.assert_not_called()
+
+    def test_unknown_compiler_path(self):
+        cache = DetectionCache.load(self.cache_path)
+        cache.put_compiler('Visual Studio 15 2017', self.create_compiler())
+        self.assertEqual({}, cache.compilers)
+        self.assertIsNone(cache.get_compiler('Visual Studio 15 2017'))
+
+    def test_insn_sets(self):
+        config_sse2 = InsnSetConfig([InsnSet.X86_SSE2])
+        config_sse2.capabilities = ['cap']
+        config_avx = InsnSetConfig([InsnSet.X86_AVX])
+
+        cache = DetectionCache.load(self.cache_path)
+        cache.put_insn_sets(self.create_compiler(), 'lib', [config_sse2],
+                            [(config_avx, 'error')])
+        cache.save()
+
+        cache = DetectionCache.load(self.cache_path)
+        supported, unsupported = cache.get_insn_sets(self.create_compiler(),
+                                                     'lib')
+        self.assertEqual([[InsnSet.X86_SSE2]],
+                         [config.insn_sets for config in supported])
+        self.assertEqual(['cap'], supported[0].capabilities)
+        self.assertEqual([([InsnSet.X86_AVX], 'error')],
+                         [(config.insn_sets, error)
+                          for config, error in unsupported])
+
+        self.assertIsNone(cache.get_insn_sets(self.create_compiler(), 'lib2'))
+
+        self.write_compiler('new binary')
+        cache = DetectionCache.load(self.cache_path)
+        self.assertIsNone(cache.get_insn_sets(self.create_compiler(), 'lib'))
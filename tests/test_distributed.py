@@ -0,0 +1,233 @@
+#   Copyright (C) 2018  Povilas Kanapickas <povilas@radix.lt>
+#
+#   This file is part of libsimdpp asm tests
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see http://www.gnu.org/licenses/.
+
+from __future__ import print_function
+
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import unittest
+from concurrent import futures
+from io import StringIO
+
+from asmtest.asm_collect import TestSource
+from asmtest.asm_collect import WorkerContext
+from asmtest.asm_collect import flatten_tests_by_cat
+from asmtest.asm_collect import generate_test_list
+from asmtest.asm_collect import get_test_signature
+from asmtest.asm_collect import perform_all_tests
+from asmtest.asm_collect import run_detection_job
+from asmtest.asm_parser import InsnCount
+from asmtest.compiler import CompilerBase
+from asmtest.distributed import PROTOCOL_VERSION
+from asmtest.distributed import DistributedExecutor
+from asmtest.distributed import get_compiler_version_info
+from asmtest.distributed import parse_address
+from asmtest.distributed import recv_message
+from asmtest.distributed import run_worker
+from asmtest.distributed import send_message
+from asmtest.fingerprint import get_libsimdpp_fingerprint
+from asmtest.insn_set import InsnSet
+from asmtest.insn_set import InsnSetConfig
+from asmtest.test_list import get_all_tests
+
+if sys.version_info[0] < 3:
+    import mock
+else:
+    from unittest import mock  # noqa: pylint: disable=ungrouped-imports
+
+
+def create_compiler(version):
+    compiler = CompilerBase()
+    compiler.name = 'gcc'
+    compiler.path = 'g++'
+    compiler.target_arch = 'x86_64'
+    compiler.version = version
+    return compiler
+
+
+def fake_baseline_compilation(*args):
+    return ({get_test_signature(test.desc): InsnCount() for test in args[4]},
+            0.1)
+
+
+def fake_compilation(*args):
+    ret = []
+    for test in args[4]:
+        insns = InsnCount.from_dict({'insn_' + test.desc.code: 1})
+        ret.append(insns)
+    return ret, 0.1
+
+
+class TestParseAddress(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual(('localhost', 1234), parse_address('localhost:1234'))
+        self.assertEqual(('::1', 80), parse_address('::1:80'))
+        with self.assertRaises(Exception):
+            parse_address('localhost')
+
+
+class TestDistributedExecutor(unittest.TestCase):
+
+    def setUp(self):
+        self.libsimdpp_path = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.libsimdpp_path, 'simdpp'))
+        with open(os.path.join(self.libsimdpp_path, 'simdpp/simd.h'),
+                  'w') as out_f:
+            out_f.write('#pragma once\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.libsimdpp_path)
+
+    def start_workers(self, count, address_future, compiler):
+        errors = []
+
+        def worker():
+            try:
+                run_worker(address_future.result(), self.libsimdpp_path,
+                           compiler, jobs=2, stdout=StringIO())
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads, errors
+
+    @mock.patch('concurrent.futures.ProcessPoolExecutor',
+                side_effect=futures.ThreadPoolExecutor)
+    @mock.patch('asmtest.asm_collect.perform_single_compilation',
+                side_effect=fake_compilation)
+    @mock.patch('asmtest.asm_collect.perform_single_baseline_compilation',
+                side_effect=fake_baseline_compilation)
+    def test_multiple_workers(self, _, perform_single_compilation_mock, _2):
+        configs = [InsnSetConfig([InsnSet.X86_SSE2]),
+                   InsnSetConfig([InsnSet.X86_SSE2, InsnSet.X86_SSE3])]
+        test_and_config_list = [
+            (config, generate_test_list(get_all_tests(config), ['math']))
+            for config in configs]
+        compiler = create_compiler('12.2.0')
+
+        address_future = futures.Future()
+
+        def create_executor(worker_context):
+            executor = DistributedExecutor(('127.0.0.1', 0), worker_context,
+                                           stdout=StringIO())
+            address_future.set_result(executor.address)
+            return executor
+
+        threads, errors = self.start_workers(3, address_future, compiler)
+
+        stdout = StringIO()
+        stderr = StringIO()
+        perform_all_tests(self.libsimdpp_path, compiler,
+                          test_and_config_list, 50, stdout=stdout,
+                          stderr=stderr, jobs=16,
+                          executor_factory=create_executor,
+                          test_source=TestSource(test_and_config_list,
+                                                 regenerate=True,
+                                                 categories=['math']))
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([], errors)
+        self.assertEqual('', stderr.getvalue())
+        self.assertGreater(
+            len(perform_single_compilation_mock.call_args_list), 3)
+
+        for _, tests_by_cat in test_and_config_list:
+            for test in flatten_tests_by_cat(tests_by_cat):
+                self.assertEqual({'insn_' + test.desc.code: 1},
+                                 test.insns.insns)
+
+    def test_rejects_mismatching_compiler(self):
+        config = InsnSetConfig([InsnSet.X86_SSE2])
+        test_and_config_list = [(config, {})]
+        context = WorkerContext(self.libsimdpp_path, None,
+                                create_compiler('12.2.0'),
+                                TestSource(test_and_config_list,
+                                           regenerate=True))
+        stdout = StringIO()
+        executor = DistributedExecutor(('127.0.0.1', 0), context,
+                                       stdout=stdout)
+        try:
+            with self.assertRaisesRegex(Exception, 'compiler mismatch'):
+                run_worker(executor.address, self.libsimdpp_path,
+                           create_compiler('11.3.0'), jobs=1,
+                           stdout=StringIO())
+        finally:
+            executor.shutdown()
+        self.assertIn('Rejected worker', stdout.getvalue())
+
+    def create_executor(self, **kwargs):
+        config = InsnSetConfig([InsnSet.X86_SSE2])
+        context = WorkerContext(self.libsimdpp_path, None,
+                                create_compiler('12.2.0'),
+                                TestSource([(config, {})], regenerate=True))
+        return DistributedExecutor(('127.0.0.1', 0), context,
+                                   stdout=StringIO(), **kwargs)
+
+    def connect_fake_worker(self, executor):
+        sock = socket.create_connection(executor.address)
+        send_message(sock, {
+            'type': 'hello',
+            'protocol': PROTOCOL_VERSION,
+            'compiler': get_compiler_version_info(create_compiler('12.2.0')),
+            'libsimdpp': get_libsimdpp_fingerprint(self.libsimdpp_path),
+            'slots': 1,
+        })
+        self.assertEqual('welcome', recv_message(sock)['type'])
+        return sock
+
+    def test_invalid_result_and_lost_job(self):
+        executor = self.create_executor()
+        executor.max_job_attempts = 2
+        try:
+            future = executor.submit(run_detection_job,
+                                     InsnSetConfig([InsnSet.X86_SSE2]))
+
+            # the worker is disconnected and the job is given to the next
+            # worker
+            sock = self.connect_fake_worker(executor)
+            job = recv_message(sock)
+            send_message(sock, {'type': 'result', 'id': job['id']})
+            self.assertIsNone(recv_message(sock))
+            sock.close()
+            self.assertFalse(future.done())
+
+            sock = self.connect_fake_worker(executor)
+            self.assertEqual('detect', recv_message(sock)['job'])
+            sock.close()
+
+            with self.assertRaisesRegex(Exception, 'lost by 2 workers'):
+                future.result(timeout=10)
+        finally:
+            executor.shutdown()
+
+    def test_no_workers(self):
+        executor = self.create_executor(worker_timeout=0.1)
+        try:
+            future = executor.submit(run_detection_job,
+                                     InsnSetConfig([InsnSet.X86_SSE2]))
+            with self.assertRaisesRegex(Exception, 'No workers connected'):
+                future.result(timeout=10)
+        finally:
+            executor.shutdown()
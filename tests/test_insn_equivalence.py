@@ -0,0 +1,119 @@
+#   Copyright (C) 2018  Povilas Kanapickas <povilas@radix.lt>
+#
+#   This file is part of libsimdpp asm tests
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see http://www.gnu.org/licenses/.
+
+from __future__ import print_function
+
+import unittest
+
+from asmtest.asm_parser import InsnCount
+from asmtest.asm_parser import parse_compiler_asm_output
+from asmtest.insn_equivalence import EQUIVALENT_INSNS
+from asmtest.insn_equivalence import get_arch_family
+from asmtest.insn_equivalence import get_canonical_insns
+
+
+def count_insns(output, target_arch):
+    functions = parse_compiler_asm_output(output,
+                                          get_canonical_insns(target_arch))
+    return InsnCount.from_insn_list(functions[0].insns).insns
+
+
+class TestGetArchFamily(unittest.TestCase):
+
+    def test_families(self):
+        self.assertEqual('x86', get_arch_family('x86_64'))
+        self.assertEqual('x86', get_arch_family('i686'))
+        self.assertEqual('x86', get_arch_family('x86'))
+        self.assertEqual('arm', get_arch_family('arm'))
+        self.assertEqual('arm', get_arch_family('armv7l'))
+        self.assertEqual('arm', get_arch_family('armhf'))
+        self.assertEqual('aarch64', get_arch_family('aarch64'))
+        self.assertEqual('power', get_arch_family('powerpc64le'))
+
+    def test_unknown(self):
+        self.assertIsNone(get_arch_family(None))
+        self.assertIsNone(get_arch_family('mips'))
+        self.assertIsNone(get_arch_family('armeb'))
+        self.assertIsNone(get_arch_family('aarch64_be'))
+
+
+class TestGetCanonicalInsns(unittest.TestCase):
+
+    def test_groups_dont_overlap(self):
+        for groups in EQUIVALENT_INSNS.values():
+            eq_insns = [insn for insns in groups.values() for insn in insns]
+            self.assertEqual(len(eq_insns), len(set(eq_insns)))
+            self.assertEqual(set(), set(eq_insns) & set(groups.keys()))
+
+    def test_per_arch(self):
+        self.assertEqual('movaps', get_canonical_insns('x86_64')['movdqa'])
+        self.assertEqual('vldm', get_canonical_insns('armv7l')['vldmia'])
+        self.assertNotIn('vldmia', get_canonical_insns('x86_64'))
+        self.assertNotIn('movdqa', get_canonical_insns('aarch64'))
+
+    def test_unknown_arch_uses_all_groups(self):
+        canonical_insns = get_canonical_insns(None)
+        self.assertEqual('movaps', canonical_insns['movdqa'])
+        self.assertEqual('vldm', canonical_insns['vldmia'])
+
+    def test_loaded_once(self):
+        self.assertIs(get_canonical_insns('x86_64'),
+                      get_canonical_insns('i686'))
+
+
+class TestCanonicalizeWhileParsing(unittest.TestCase):
+
+    def test_no_eq(self):
+        output = 'func:\n    movapd\n    movapd\n    movapd\n'
+        self.assertEqual({'movaps': 3}, count_insns(output, 'x86_64'))
+
+    def test_eq_same_group(self):
+        output = 'func:\n    movapd\n    movaps\n    movdqa\n'
+        self.assertEqual({'movaps': 3}, count_insns(output, 'x86_64'))
+
+    def test_eq_different_group(self):
+        output = 'func:\n    movapd\n    vmovapd\n    vmovdqu\n'
+        self.assertEqual({'movaps': 1, 'vmovaps': 1, 'vmovups': 1},
+                         count_insns(output, 'x86_64'))
+
+    def test_avx512(self):
+        output = '''\
+func:
+    vmovdqa32 (%rdi), %zmm0
+    vmovdqa64 (%rsi), %zmm1
+    vpxorq %zmm1, %zmm0, %zmm0
+    vmovdqu8 %zmm0, (%rdx)
+    vmovdqu64 %zmm1, (%rcx)
+'''
+        self.assertEqual({'vmovaps': 2, 'vpxor': 1, 'vmovups': 2},
+                         count_insns(output, 'x86_64'))
+
+    def test_neon(self):
+        output = '''\
+func:
+    vldmia r0, {d16-d19}
+    vldm r1, {d20-d23}
+    vld1.32 {d16[1]}, [r2]
+    vld1.16 {d17[]}, [r3]
+'''
+        # lane and duplicating loads of different element sizes differ
+        self.assertEqual({'vldm': 2, 'vld1.32': 1, 'vld1.16': 1},
+                         count_insns(output, 'armv7l'))
+
+        # the scalar mvn is not a vector not
+        output = 'func:\n    mvn x0, x1\n    not v0.16b, v0.16b\n'
+        self.assertEqual({'mvn': 1, 'not': 1}, count_insns(output, 'aarch64'))
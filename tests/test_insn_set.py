@@ -0,0 +1,69 @@
+#   Copyright (C) 2016-2018  Povilas Kanapickas <povilas@radix.lt>
+#
+#   This file is part of libsimdpp asm tests
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see http://www.gnu.org/licenses/.
+
+from __future__ import print_function
+
+import unittest
+
+from asmtest.insn_set import InsnSet
+from asmtest.insn_set import InsnSetConfig
+from asmtest.insn_set import get_all_insn_set_configs
+
+
+class TestGetAllInsnSetConfigs(unittest.TestCase):
+
+    def test_lattice(self):
+        insn_sets = [config.insn_sets for config in get_all_insn_set_configs()]
+        self.assertEqual(len(insn_sets), len(set(map(tuple, insn_sets))))
+        for expected in [
+                [InsnSet.X86_SSE2],
+                [InsnSet.X86_FMA3],
+                [InsnSet.X86_SSE4_1, InsnSet.X86_POPCNT],
+                [InsnSet.X86_AVX, InsnSet.X86_XOP],
+                [InsnSet.X86_AVX2, InsnSet.X86_FMA3],
+                [InsnSet.X86_AVX512F, InsnSet.X86_AVX512VL],
+                [InsnSet.X86_AVX512F, InsnSet.X86_FMA3, InsnSet.X86_AVX512BW,
+                 InsnSet.X86_AVX512DQ, InsnSet.X86_AVX512VL],
+                [InsnSet.POWER_VSX_207]]:
+            self.assertIn(expected, insn_sets)
+        # extensions are not combined with levels outside their range
+        self.assertNotIn([InsnSet.X86_SSE2, InsnSet.X86_POPCNT], insn_sets)
+        self.assertNotIn([InsnSet.X86_AVX2, InsnSet.X86_XOP], insn_sets)
+
+    def test_without_lattice(self):
+        insn_sets = [config.insn_sets
+                     for config in get_all_insn_set_configs(False)]
+        self.assertEqual(22, len(insn_sets))
+        self.assertIn([InsnSet.X86_AVX, InsnSet.X86_FMA3], insn_sets)
+        self.assertNotIn([InsnSet.X86_SSE4_1, InsnSet.X86_POPCNT], insn_sets)
+
+
+class TestInsnSetConfig(unittest.TestCase):
+
+    def test_equivalence_key(self):
+        config = InsnSetConfig([InsnSet.X86_SSE2])
+        config.capabilities = ['INT8_SIMD', 'INT16_SIMD']
+        self.assertIsNone(config.equivalence_key())
+
+        config.fingerprint = 'fp'
+        other = InsnSetConfig.from_json(config.to_json())
+        other.insn_sets = [InsnSet.X86_SSE3]
+        other.capabilities = ['INT16_SIMD', 'INT8_SIMD']
+        self.assertEqual(config.equivalence_key(), other.equivalence_key())
+
+        other.capabilities = ['INT8_SIMD']
+        self.assertNotEqual(config.equivalence_key(), other.equivalence_key())
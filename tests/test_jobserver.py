@@ -0,0 +1,151 @@
+#   Copyright (C) 2018  Povilas Kanapickas <povilas@radix.lt>
+#
+#   This file is part of libsimdpp asm tests
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see http://www.gnu.org/licenses/.
+
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from asmtest.jobserver import JobserverClient
+from asmtest.jobserver import parse_jobserver_auth
+from asmtest.resources import ResourceLimiter
+
+
+class TestParseJobserverAuth(unittest.TestCase):
+
+    def test_no_jobserver(self):
+        self.assertIsNone(parse_jobserver_auth(None))
+        self.assertIsNone(parse_jobserver_auth(''))
+        self.assertIsNone(parse_jobserver_auth(' -j4'))
+
+    def test_fds(self):
+        self.assertEqual(('fds', 3, 4),
+                         parse_jobserver_auth(' -j4 --jobserver-auth=3,4'))
+        self.assertEqual(('fds', 5, 6),
+                         parse_jobserver_auth('--jobserver-fds=5,6 -j'))
+
+    def test_fifo(self):
+        self.assertEqual(('fifo', '/tmp/GMfifo1'),
+                         parse_jobserver_auth('-j4 --jobserver-auth=fifo:' +
+                                              '/tmp/GMfifo1'))
+
+    def test_last_wins(self):
+        self.assertEqual(('fds', 5, 6),
+                         parse_jobserver_auth('--jobserver-auth=3,4 ' +
+                                              '--jobserver-auth=5,6'))
+
+    def test_disabled(self):
+        self.assertIsNone(parse_jobserver_auth('--jobserver-auth=-2,-2'))
+
+
+@unittest.skipIf(sys.platform == 'win32', 'jobserver requires posix')
+class TestJobserverClient(unittest.TestCase):
+
+    def check_tokens(self, environ, read_fd, write_fd):
+        os.write(write_fd, b'++')
+
+        client = JobserverClient.from_environment(environ)
+        self.assertTrue(client.try_acquire())
+        self.assertTrue(client.try_acquire())
+        self.assertFalse(client.try_acquire())
+        self.assertEqual(2, client.get_token_count())
+
+        client.release()
+        client.close()
+        self.assertEqual(b'++', os.read(read_fd, 2))
+
+    def test_fds(self):
+        read_fd, write_fd = os.pipe()
+        try:
+            environ = {'MAKEFLAGS': f'-j3 --jobserver-auth={read_fd},' +
+                       str(write_fd)}
+            self.check_tokens(environ, read_fd, write_fd)
+        finally:
+            os.close(read_fd)
+            os.close(write_fd)
+
+    def test_fifo(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'fifo')
+            os.mkfifo(path)
+            fd = os.open(path, os.O_RDWR | os.O_NONBLOCK)
+            try:
+                environ = {'MAKEFLAGS': f'-j3 --jobserver-auth=fifo:{path}'}
+                self.check_tokens(environ, fd, fd)
+            finally:
+                os.close(fd)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_closed_fds(self):
+        read_fd, write_fd = os.pipe()
+        os.close(read_fd)
+        os.close(write_fd)
+        environ = {'MAKEFLAGS': f'-j3 --jobserver-auth={read_fd},{write_fd}'}
+        self.assertIsNone(JobserverClient.from_environment(environ))
+
+
+class FakeJobserver:
+
+    def __init__(self, available):
+        self.available = available
+        self.tokens = 0
+
+    def try_acquire(self):
+        if self.available == 0:
+            return False
+        self.available -= 1
+        self.tokens += 1
+        return True
+
+    def release(self):
+        self.available += 1
+        self.tokens -= 1
+
+    def get_token_count(self):
+        return self.tokens
+
+    def close(self):
+        while self.tokens > 0:
+            self.release()
+
+
+class TestResourceLimiterJobserver(unittest.TestCase):
+
+    def test_tokens(self):
+        jobserver = FakeJobserver(1)
+        limiter = ResourceLimiter(8, jobserver=jobserver)
+        limiter.get_used_memory = lambda: None
+        limiter.get_available_memory = lambda: None
+
+        # the first job does not need a token
+        self.assertTrue(limiter.can_start_job(0))
+        self.assertEqual(0, jobserver.tokens)
+        self.assertTrue(limiter.can_start_job(1))
+        self.assertEqual(1, jobserver.tokens)
+        self.assertFalse(limiter.can_start_job(2))
+
+        limiter.release_unused_tokens(1)
+        self.assertEqual(0, jobserver.tokens)
+
+        limiter.can_start_job(1)
+        limiter.close()
+        self.assertEqual(1, jobserver.available)
@@ -0,0 +1,94 @@
+#   Copyright (C) 2018  Povilas Kanapickas <povilas@radix.lt>
+#
+#   This file is part of libsimdpp asm tests
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see http://www.gnu.org/licenses/.
+
+from __future__ import print_function
+
+import random
+import unittest
+
+from asmtest.asm_parser import InsnCount
+from asmtest.postprocess import get_insn_totals
+from asmtest.postprocess import has_numpy
+from asmtest.postprocess import postprocess_insn_counts
+
+
+def create_counts(seed, count):
+    rng = random.Random(seed)
+    names = [f'insn{i}' for i in range(20)]
+    ret = []
+    for _ in range(count):
+        ret.append(InsnCount.from_dict(
+            {name: rng.randint(1, 5)
+             for name in rng.sample(names, rng.randint(0, 8))}))
+    return ret
+
+
+class TestPostprocessInsnCounts(unittest.TestCase):
+
+    def check_postprocess(self, use_numpy):
+        baseline = InsnCount.from_dict({'mov': 1, 'ret': 1})
+        empty_baseline = InsnCount()
+        insn_counts = [
+            InsnCount.from_dict({'mov': 3, 'ret': 1, 'movaps': 2}),
+            InsnCount.from_dict({'movaps': 2, 'ret': 1}),
+            InsnCount.from_dict({'movaps': 1}),
+            InsnCount(),
+        ]
+
+        postprocess_insn_counts(
+            insn_counts, [baseline, baseline, empty_baseline, empty_baseline],
+            use_numpy=use_numpy)
+
+        self.assertEqual([{'mov': 2, 'movaps': 2},
+                          {'mov': -1, 'movaps': 2},
+                          {'movaps': 1},
+                          {}],
+                         [insns.insns for insns in insn_counts])
+        self.assertEqual({'mov': 1, 'ret': 1}, baseline.insns)
+
+    def test_fallback(self):
+        self.check_postprocess(False)
+
+    @unittest.skipUnless(has_numpy(), 'NumPy is not available')
+    def test_numpy(self):
+        self.check_postprocess(True)
+
+    @unittest.skipUnless(has_numpy(), 'NumPy is not available')
+    def test_numpy_matches_fallback(self):
+        baselines = create_counts(1, 5)
+
+        expected = create_counts(2, 200)
+        actual = create_counts(2, 200)
+        postprocess_insn_counts(expected, baselines * 40, use_numpy=False)
+        postprocess_insn_counts(actual, baselines * 40, use_numpy=True)
+        self.assertEqual(expected, actual)
+
+
+class TestGetInsnTotals(unittest.TestCase):
+
+    def test_fallback(self):
+        insn_counts = [InsnCount.from_dict({'mov': 2, 'ret': 1}),
+                       InsnCount.from_dict({'mov': -2, 'add': 3})]
+        self.assertEqual({'ret': 1, 'add': 3},
+                         get_insn_totals(insn_counts, use_numpy=False))
+        self.assertEqual({}, get_insn_totals([], use_numpy=False))
+
+    @unittest.skipUnless(has_numpy(), 'NumPy is not available')
+    def test_numpy_matches_fallback(self):
+        insn_counts = create_counts(3, 100)
+        self.assertEqual(get_insn_totals(insn_counts, use_numpy=False),
+                         get_insn_totals(insn_counts, use_numpy=True))
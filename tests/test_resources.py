@@ -0,0 +1,204 @@
+#   Copyright (C) 2018  Povilas Kanapickas <povilas@radix.lt>
+#
+#   This file is part of libsimdpp asm tests
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see http://www.gnu.org/licenses/.
+
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from asmtest.resources import ResourceLimiter
+from asmtest.resources import get_available_memory
+from asmtest.resources import get_cgroup_cpu_limit
+from asmtest.resources import get_compiler_memory
+from asmtest.resources import parse_memory_size
+
+if sys.version_info[0] < 3:
+    import mock
+else:
+    from unittest import mock  # noqa: pylint: disable=ungrouped-imports
+
+GB = 1024 ** 3
+
+
+class TestParseMemorySize(unittest.TestCase):
+
+    def test_sizes(self):
+        self.assertEqual(1000, parse_memory_size('1000'))
+        self.assertEqual(512 * 1024 ** 2, parse_memory_size('512M'))
+        self.assertEqual(8 * GB, parse_memory_size('8G'))
+        self.assertEqual(GB // 2, parse_memory_size('0.5GiB'))
+
+    def test_invalid(self):
+        with self.assertRaises(Exception):
+            parse_memory_size('8X')
+
+
+class TestCgroupLimits(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_file(self, rel_path, contents):
+        path = os.path.join(self.tmp_dir, rel_path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as out_f:
+            out_f.write(contents)
+
+    def test_no_cgroup(self):
+        self.assertIsNone(get_cgroup_cpu_limit(self.tmp_dir))
+        self.assertIsNone(get_available_memory(self.tmp_dir, self.tmp_dir))
+
+    def test_cpu_v2(self):
+        self.write_file('cpu.max', '250000 100000\n')
+        self.assertEqual(2.5, get_cgroup_cpu_limit(self.tmp_dir))
+
+        self.write_file('cpu.max', 'max 100000\n')
+        self.assertIsNone(get_cgroup_cpu_limit(self.tmp_dir))
+
+    def test_cpu_v1(self):
+        self.write_file('cpu/cpu.cfs_quota_us', '200000\n')
+        self.write_file('cpu/cpu.cfs_period_us', '100000\n')
+        self.assertEqual(2, get_cgroup_cpu_limit(self.tmp_dir))
+
+        self.write_file('cpu/cpu.cfs_quota_us', '-1\n')
+        self.assertIsNone(get_cgroup_cpu_limit(self.tmp_dir))
+
+    def test_memory(self):
+        self.write_file('memory.max', str(4 * GB))
+        self.write_file('memory.current', str(1 * GB))
+        self.write_file('meminfo', 'MemTotal: 16777216 kB\n' +
+                        'MemAvailable: 8388608 kB\n')
+        self.assertEqual(3 * GB,
+                         get_available_memory(self.tmp_dir, self.tmp_dir))
+
+        self.write_file('memory.max', 'max')
+        self.assertEqual(8 * GB,
+                         get_available_memory(self.tmp_dir, self.tmp_dir))
+
+
+class TestGetCompilerMemory(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_stat(self, pid, ppid, session, rss_pages):
+        os.makedirs(os.path.join(self.tmp_dir, str(pid)))
+        fields = ['S', ppid, session, session] + [0] * 17 + [rss_pages, 0]
+        with open(os.path.join(self.tmp_dir, str(pid), 'stat'), 'w') as f:
+            f.write(f'{pid} (cc1 (x)) ' +
+                    ' '.join(str(field) for field in fields))
+
+    def test_sessions(self):
+        page_size = os.sysconf('SC_PAGE_SIZE')
+        self.write_stat(10, 1, 10, 100)
+        # a worker process, then a compiler driver started by the worker
+        # and the compiler and assembler started by the driver
+        self.write_stat(11, 10, 10, 200)
+        self.write_stat(12, 11, 12, 1)
+        self.write_stat(13, 12, 12, 20)
+        self.write_stat(14, 12, 12, 3)
+        # a compiler started by the current process
+        self.write_stat(15, 10, 15, 40)
+        # an unrelated process
+        self.write_stat(16, 1, 16, 1000)
+
+        self.assertEqual({12: 24 * page_size, 15: 40 * page_size},
+                         get_compiler_memory(10, self.tmp_dir))
+        self.assertEqual({}, get_compiler_memory(16, self.tmp_dir))
+
+    def test_no_proc(self):
+        self.assertIsNone(get_compiler_memory(
+            10, os.path.join(self.tmp_dir, 'none')))
+
+
+class TestResourceLimiter(unittest.TestCase):
+
+    def create_limiter(self, max_jobs, max_memory, compiler_memory,
+                       available):
+        limiter = ResourceLimiter(max_jobs, max_memory)
+        limiter.get_compiler_memory = mock.Mock(return_value=compiler_memory)
+        limiter.get_available_memory = mock.Mock(return_value=available)
+        return limiter
+
+    def test_max_jobs(self):
+        limiter = self.create_limiter(2, None, None, None)
+        self.assertTrue(limiter.can_start_job(0))
+        self.assertTrue(limiter.can_start_job(1))
+        self.assertFalse(limiter.can_start_job(2))
+
+    def test_always_starts_first_job(self):
+        limiter = self.create_limiter(2, 1, {1: 10 * GB}, 0)
+        self.assertTrue(limiter.can_start_job(0))
+
+    def test_max_memory(self):
+        limiter = self.create_limiter(8, 4 * GB, {1: 2 * GB}, None)
+        self.assertTrue(limiter.can_start_job(1))
+        self.assertEqual(2 * GB, limiter.job_memory_estimate)
+        self.assertFalse(limiter.can_start_job(2))
+
+    def test_available_memory(self):
+        limiter = self.create_limiter(8, None, {1: GB // 2, 2: GB // 2},
+                                      GB + GB // 4)
+        self.assertTrue(limiter.can_start_job(2))
+        # the running jobs are expected to grow to the estimated size
+        self.assertFalse(limiter.can_start_job(4))
+
+    def test_no_memory_check(self):
+        limiter = ResourceLimiter(8, 1, check_memory=False)
+        limiter.get_used_memory = mock.Mock(return_value=10 * GB)
+        self.assertTrue(limiter.can_start_job(4))
+        limiter.get_used_memory.assert_not_called()
+
+    def test_estimate_decays(self):
+        limiter = self.create_limiter(8, None, {1: 2 * GB}, None)
+        limiter.can_start_job(1)
+        self.assertEqual(2 * GB, limiter.job_memory_estimate)
+
+        # the peak of a completed compiler is remembered for a while
+        limiter.get_compiler_memory.return_value = {2: GB}
+        limiter.can_start_job(1)
+        self.assertEqual(2 * GB, limiter.job_memory_estimate)
+
+        for session in range(3, 3 + limiter.peak_history):
+            limiter.get_compiler_memory.return_value = {session: GB}
+            limiter.can_start_job(1)
+        self.assertEqual(GB, limiter.job_memory_estimate)
+
+    def test_memory_poll_interval(self):
+        limiter = ResourceLimiter(8)
+        with mock.patch('asmtest.resources.get_compiler_memory',
+                        return_value={1: GB}) as get_memory, \
+                mock.patch('time.monotonic', return_value=100):
+            limiter.get_used_memory()
+            limiter.get_used_memory()
+            self.assertEqual(1, get_memory.call_count)
+
+        with mock.patch('asmtest.resources.get_compiler_memory',
+                        return_value={1: GB}) as get_memory, \
+                mock.patch('time.monotonic', return_value=101):
+            self.assertEqual(GB, limiter.get_used_memory())
+            self.assertEqual(1, get_memory.call_count)
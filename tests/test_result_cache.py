@@ -0,0 +1,275 @@
+#   Copyright (C) 2018  Povilas Kanapickas <povilas@radix.lt>
+#
+#   This file is part of libsimdpp asm tests
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see http://www.gnu.org/licenses/.
+
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+from asmtest import fingerprint
+from asmtest.asm_parser import InsnCount
+from asmtest.cache_server import CacheServer
+from asmtest.compiler import CompilerGcc
+from asmtest.fingerprint import get_compiler_identity
+from asmtest.fingerprint import get_file_hash
+from asmtest.fingerprint import get_libsimdpp_fingerprint
+from asmtest.insn_equivalence import EQUIVALENT_INSNS
+from asmtest.insn_set import InsnSet
+from asmtest.insn_set import InsnSetConfig
+from asmtest.result_cache import CombinedResultCache
+from asmtest.result_cache import RemoteResultCache
+from asmtest.result_cache import ResultCache
+
+if sys.version_info[0] < 3:
+    import mock
+else:
+    from unittest import mock  # noqa: pylint: disable=ungrouped-imports
+
+KEY1 = '01' * 32
+KEY2 = '02' * 32
+
+
+def create_test_compiler():
+    compiler = CompilerGcc()
+    compiler.name = 'gcc'
+    compiler.path = 'g++'
+    compiler.version = '7.2.0'
+    compiler.target_arch = 'x86_64'
+    return compiler
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_missing_entry(self):
+        cache = ResultCache(self.tmp_dir, 'compiler', 'libsimdpp')
+        self.assertIsNone(cache.get('0123'))
+
+    def test_put_get(self):
+        cache = ResultCache(self.tmp_dir, 'compiler', 'libsimdpp')
+
+        insns = InsnCount.from_dict({'movaps': 3, 'mov': -1})
+        cache.put('0123', {'id1': insns, 'id2': InsnCount()})
+
+        result = cache.get('0123')
+        self.assertEqual(['id1', 'id2'], sorted(result.keys()))
+        self.assertEqual({'movaps': 3, 'mov': -1}, result['id1'].insns)
+        self.assertEqual({}, result['id2'].insns)
+
+    def test_key_depends_on_inputs(self):
+        compiler = create_test_compiler()
+        config_sse2 = InsnSetConfig([InsnSet.X86_SSE2])
+        config_avx = InsnSetConfig([InsnSet.X86_AVX])
+
+        cache = ResultCache(self.tmp_dir, 'compiler', 'libsimdpp')
+        key = cache.get_key(compiler, config_sse2, 'code')
+
+        self.assertEqual(key, cache.get_key(compiler, config_sse2, 'code'))
+        self.assertNotEqual(key, cache.get_key(compiler, config_sse2, 'code2'))
+        self.assertNotEqual(key, cache.get_key(compiler, config_avx, 'code'))
+
+        cache2 = ResultCache(self.tmp_dir, 'compiler2', 'libsimdpp')
+        self.assertNotEqual(key, cache2.get_key(compiler, config_sse2, 'code'))
+
+        cache3 = ResultCache(self.tmp_dir, 'compiler', 'libsimdpp2')
+        self.assertNotEqual(key, cache3.get_key(compiler, config_sse2, 'code'))
+
+        with mock.patch.dict(EQUIVALENT_INSNS['x86'], {'por': ['pxor']}):
+            cache4 = ResultCache(self.tmp_dir, 'compiler', 'libsimdpp')
+        self.assertNotEqual(key, cache4.get_key(compiler, config_sse2, 'code'))
+
+
+class TestRemoteResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.server = CacheServer(('127.0.0.1', 0), self.tmp_dir)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}/'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_put_get(self):
+        cache = RemoteResultCache(self.url, 'compiler', 'libsimdpp')
+        self.assertIsNone(cache.get(KEY1))
+
+        insns = InsnCount.from_dict({'movaps': 3})
+        cache.put(KEY1, {'id1': insns})
+
+        result = cache.get(KEY1)
+        self.assertEqual(['id1'], list(result.keys()))
+        self.assertEqual({'movaps': 3}, result['id1'].insns)
+        self.assertIsNone(cache.get(KEY2))
+
+        # the server uses the same layout as the local cache
+        local_cache = ResultCache(self.tmp_dir, 'compiler', 'libsimdpp')
+        self.assertEqual({'movaps': 3}, local_cache.get(KEY1)['id1'].insns)
+
+    def test_invalid_key(self):
+        cache = RemoteResultCache(self.url, 'compiler', 'libsimdpp')
+        cache.put('../key', {'id1': InsnCount()})
+        self.assertIsNone(cache.get('../key'))
+        self.assertFalse(cache.disabled)
+        self.assertEqual([], os.listdir(self.tmp_dir))
+
+    @mock.patch('sys.stderr')
+    def test_unreachable_server(self, _):
+        port = self.server.server_port
+        self.server.shutdown()
+        self.server.server_close()
+
+        cache = RemoteResultCache(f'http://127.0.0.1:{port}', 'compiler',
+                                  'libsimdpp', timeout=1)
+        self.assertIsNone(cache.get(KEY1))
+        self.assertTrue(cache.disabled)
+        cache.put(KEY1, {'id1': InsnCount()})
+
+    def test_combined(self):
+        local_dir = os.path.join(self.tmp_dir, 'local')
+        remote_cache = RemoteResultCache(self.url, 'compiler', 'libsimdpp')
+        cache = CombinedResultCache(
+            ResultCache(local_dir, 'compiler', 'libsimdpp'), remote_cache)
+
+        insns = InsnCount.from_dict({'movaps': 3})
+        remote_cache.put(KEY1, {'id1': insns})
+
+        self.assertEqual({'movaps': 3}, cache.get(KEY1)['id1'].insns)
+        self.assertTrue(os.path.isfile(
+            os.path.join(local_dir, KEY1[:2], KEY1 + '.json')))
+
+        cache.put(KEY2, {'id2': insns})
+        self.assertIsNotNone(remote_cache.get(KEY2))
+
+
+class TestGetLibsimdppFingerprint(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.tmp_dir, 'simdpp', 'core'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_file(self, rel_path, contents):
+        with open(os.path.join(self.tmp_dir, rel_path), 'w') as out_f:
+            out_f.write(contents)
+
+    def test_changes_with_contents(self):
+        self.write_file('simdpp/simd.h', 'header')
+        self.write_file('simdpp/core/add.h', 'add')
+        fingerprint = get_libsimdpp_fingerprint(self.tmp_dir)
+
+        self.assertEqual(fingerprint, get_libsimdpp_fingerprint(self.tmp_dir))
+
+        self.write_file('simdpp/core/add.h', 'add2')
+        self.assertNotEqual(fingerprint,
+                            get_libsimdpp_fingerprint(self.tmp_dir))
+
+    def test_ignores_files_outside_headers(self):
+        self.write_file('simdpp/simd.h', 'header')
+        fingerprint = get_libsimdpp_fingerprint(self.tmp_dir)
+
+        self.write_file('README.md', 'readme')
+        self.assertEqual(fingerprint, get_libsimdpp_fingerprint(self.tmp_dir))
+
+
+class TestGetFileHash(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'file')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_file(self, contents):
+        with open(self.path, 'w') as out_f:
+            out_f.write(contents)
+
+    def test_hashed_once(self):
+        self.write_file('contents')
+        with mock.patch('asmtest.fingerprint.hash_file',
+                        wraps=fingerprint.hash_file) as hash_file_mock:
+            file_hash = get_file_hash(self.path)
+            self.assertEqual(file_hash, get_file_hash(self.path))
+            self.assertEqual(1, hash_file_mock.call_count)
+
+            self.write_file('new contents')
+            self.assertNotEqual(file_hash, get_file_hash(self.path))
+            self.assertEqual(2, hash_file_mock.call_count)
+
+
+class TestGetCompilerIdentity(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def create_compiler(self, dir_name, contents):
+        path = os.path.join(self.tmp_dir, dir_name, 'g++')
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as out_f:
+            out_f.write(contents)
+        compiler = create_test_compiler()
+        compiler.path = path
+        return compiler
+
+    def test_location_independent(self):
+        compiler1 = self.create_compiler('host1', 'binary')
+        compiler2 = self.create_compiler('host2', 'binary')
+        compiler3 = self.create_compiler('host3', 'other binary')
+        self.assertEqual(get_compiler_identity(compiler1),
+                         get_compiler_identity(compiler2))
+        self.assertNotEqual(get_compiler_identity(compiler1),
+                            get_compiler_identity(compiler3))
+
+    @unittest.skipIf(sys.platform == 'win32', 'Requires a shell script')
+    def test_compiler_proper(self):
+        # A driver that reports the cc1plus next to it
+        driver = '#!/bin/sh\necho "$(dirname "$0")/cc1plus"\n'
+        compilers = []
+        for dir_name, cc1plus in [('host1', 'cc1plus'), ('host2', 'cc1plus'),
+                                  ('host3', 'other cc1plus')]:
+            compiler = self.create_compiler(dir_name, driver)
+            os.chmod(compiler.path, 0o755)
+            with open(os.path.join(self.tmp_dir, dir_name, 'cc1plus'),
+                      'w') as out_f:
+                out_f.write(cc1plus)
+            compilers.append(compiler)
+
+        self.assertEqual([os.path.join(self.tmp_dir, 'host1', 'cc1plus')],
+                         compilers[0].get_component_paths())
+        self.assertEqual(get_compiler_identity(compilers[0]),
+                         get_compiler_identity(compilers[1]))
+        self.assertNotEqual(get_compiler_identity(compilers[0]),
+                            get_compiler_identity(compilers[2]))
@@ -0,0 +1,150 @@
+#   Copyright (C) 2018  Povilas Kanapickas <povilas@radix.lt>
+#
+#   This file is part of libsimdpp asm tests
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see http://www.gnu.org/licenses/.
+
+from __future__ import print_function
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from asmtest.asm_parser import InsnCount
+from asmtest.results_db import ResultsDb
+from asmtest.test_desc import Test
+from asmtest.test_desc import TestDesc
+
+
+def create_test(code, size, type_name, insns=None):
+    test = Test(TestDesc(code, size, [type_name] * 3), 'id')
+    if insns is not None:
+        test.insns = InsnCount.from_dict(insns)
+    return test
+
+
+class TestResultsDb(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmp_dir, 'db', 'results.sqlite')
+        self.db = ResultsDb.open(self.db_path)
+
+        add_code = 'vr = add(va, vb);'
+        self.db.put_results('gcc_7', 'x86_64', 'sse2', 'math', [
+            create_test(add_code, 16, 'uint8<16>', {'paddb': 1, 'mov': 2}),
+            create_test(add_code, 32, 'uint8<32>', {'paddb': 2}),
+            create_test('vr = mul_lo(va, vb);', 16, 'uint8<16>'),
+        ])
+        self.db.put_results('clang_6', 'x86_64', 'avx2', 'math', [
+            create_test(add_code, 16, 'uint8<16>', {'vpaddb': 1}),
+            create_test(add_code, 16, 'int32<4>', {'vpaddd': 1}),
+        ])
+        self.db.commit()
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_list_tests(self):
+        columns, rows = self.db.query({'compiler': 'gcc_7'})
+        self.assertEqual(['compiler', 'arch', 'config', 'category', 'code',
+                          'bytes', 'vr', 'va', 'vb', 'vc', 'count', 'insns'],
+                         columns)
+        self.assertEqual([
+            ('gcc_7', 'x86_64', 'sse2', 'math', 'vr = add(va, vb);', 16,
+             'uint8<16>', 'uint8<16>', 'uint8<16>', None, 3,
+             'mov:2 paddb:1'),
+            ('gcc_7', 'x86_64', 'sse2', 'math', 'vr = add(va, vb);', 32,
+             'uint8<32>', 'uint8<32>', 'uint8<32>', None, 2, 'paddb:2'),
+            ('gcc_7', 'x86_64', 'sse2', 'math', 'vr = mul_lo(va, vb);', 16,
+             'uint8<16>', 'uint8<16>', 'uint8<16>', None, None, None),
+        ], rows)
+
+    def test_filters(self):
+        _, rows = self.db.query({'code': 'vr = add(*'}, type_pattern='uint8*')
+        self.assertEqual([('clang_6', 16), ('gcc_7', 16), ('gcc_7', 32)],
+                         [(row[0], row[5]) for row in rows])
+
+        _, rows = self.db.query({'bytes': '32'})
+        self.assertEqual([('gcc_7', 32)], [(row[0], row[5]) for row in rows])
+
+    def test_type_filter_uses_index(self):
+        sql = 'SELECT result_id FROM types WHERE type GLOB ?'
+        plan = self.db.connection.execute('EXPLAIN QUERY PLAN ' + sql,
+                                          ['uint8*']).fetchall()
+        self.assertIn('types_by_type', ' '.join(row[-1] for row in plan))
+
+        self.db.put_results('gcc_7', 'x86_64', 'sse2', 'convert', [
+            Test(TestDesc('vr = to_int8(va);', 16,
+                          ['int8<16>', 'uint16<8>']), 'id'),
+        ])
+        _, rows = self.db.query(type_pattern='uint16*')
+        self.assertEqual(['convert'], [row[3] for row in rows])
+
+    def test_upgrade_from_version_1(self):
+        self.db.connection.executescript('''
+            DROP TABLE types;
+            CREATE INDEX results_by_type ON results (vr);
+            PRAGMA user_version = 1;''')
+        self.db.close()
+
+        self.db = ResultsDb.open(self.db_path)
+        _, rows = self.db.query(type_pattern='int32*')
+        self.assertEqual([('clang_6', 'int32<4>')],
+                         [(row[0], row[6]) for row in rows])
+
+    def test_insn(self):
+        columns, rows = self.db.query({'vr': 'uint8<16>'}, insn='paddb')
+        self.assertEqual('count', columns[-1])
+        self.assertEqual([0, 1, None], [row[-1] for row in rows])
+
+    def test_group_by(self):
+        columns, rows = self.db.query(group_by=['compiler'])
+        self.assertEqual(['compiler', 'tests', 'failed', 'sum', 'min',
+                          'max'], columns)
+        self.assertEqual([('clang_6', 2, 0, 2, 1, 1),
+                          ('gcc_7', 3, 1, 5, 2, 3)], rows)
+
+        _, rows = self.db.query({'code': 'vr = add(va, vb);'},
+                                type_pattern='uint8<16>', insn='paddb',
+                                group_by=['config', 'vr'])
+        self.assertEqual([('avx2', 'uint8<16>', 1, 0, 0, 0, 0),
+                          ('sse2', 'uint8<16>', 1, 0, 1, 1, 1)], rows)
+
+    def test_unknown_column(self):
+        with self.assertRaises(Exception):
+            self.db.query({'unknown': 'value'})
+        with self.assertRaises(Exception):
+            self.db.query(group_by=['code; DROP TABLE results'])
+
+    def test_put_replaces_results(self):
+        self.db.put_results('gcc_7', 'x86_64', 'sse2', 'math', [
+            create_test('vr = sub(va, vb);', 16, 'uint8<16>', {'psubb': 1}),
+        ])
+        self.db.commit()
+        self.db.close()
+
+        self.db = ResultsDb.open(self.db_path)
+        _, rows = self.db.query(group_by=['compiler', 'code'])
+        self.assertEqual([('clang_6', 'vr = add(va, vb);', 2, 0, 2, 1, 1),
+                          ('gcc_7', 'vr = sub(va, vb);', 1, 0, 1, 1, 1)],
+                         rows)
+        self.assertEqual(
+            [(1,)], self.db.connection.execute(
+                "SELECT COUNT(*) FROM insns WHERE insn = 'psubb'").fetchall())
+        self.assertEqual(
+            [(0,)], self.db.connection.execute(
+                "SELECT COUNT(*) FROM insns WHERE insn = 'paddb'").fetchall())
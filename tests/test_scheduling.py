@@ -0,0 +1,251 @@
+#   Copyright (C) 2018  Povilas Kanapickas <povilas@radix.lt>
+#
+#   This file is part of libsimdpp asm tests
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see http://www.gnu.org/licenses/.
+
+from __future__ import print_function
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from asmtest.insn_set import InsnSet
+from asmtest.insn_set import InsnSetConfig
+from asmtest.scheduling import ChunkQueue
+from asmtest.scheduling import CompileTimeHistory
+from asmtest.scheduling import sort_chunks_longest_first
+from asmtest.scheduling import split_tests_into_adaptive_chunks
+
+if sys.version_info[0] < 3:
+    import mock
+else:
+    from unittest import mock  # noqa: pylint: disable=ungrouped-imports
+
+
+class TestCompileTimeHistory(unittest.TestCase):
+
+    def test_default_estimate(self):
+        history = CompileTimeHistory()
+        config = InsnSetConfig([InsnSet.X86_SSE2])
+        self.assertEqual(CompileTimeHistory.default_seconds_per_test * 3.0,
+                         history.get_estimate(config, 'shuffle'))
+
+    def test_record_single_category(self):
+        history = CompileTimeHistory()
+        config = InsnSetConfig([InsnSet.X86_SSE2])
+        history.record_overhead(config, 1.0)
+
+        # the overhead of compiling the file is not attributed to the tests
+        history.record_chunk(config, ['cat'] * 4, 3.0)
+        self.assertAlmostEqual(0.5, history.get_estimate(config, 'cat'))
+
+        history.record_chunk(config, ['cat'] * 4, 5.0)
+        self.assertAlmostEqual(0.75, history.get_estimate(config, 'cat'))
+
+        history.record_chunk(config, ['cat'] * 4, 0.5)
+        self.assertAlmostEqual(0.375, history.get_estimate(config, 'cat'))
+
+    def test_overhead(self):
+        history = CompileTimeHistory()
+        config_sse2 = InsnSetConfig([InsnSet.X86_SSE2])
+        config_avx = InsnSetConfig([InsnSet.X86_AVX])
+        self.assertEqual(CompileTimeHistory.default_overhead_seconds,
+                         history.get_overhead(config_sse2))
+
+        history.record_overhead(config_sse2, 2.0)
+        history.record_overhead(config_sse2, 4.0)
+        self.assertAlmostEqual(3.0, history.get_overhead(config_sse2))
+        self.assertAlmostEqual(3.0, history.get_overhead(config_avx))
+
+        history.seconds_per_test = {'unknown/sse2/cat': 0.5}
+        self.assertAlmostEqual(4.0, history.estimate_chunk(config_sse2,
+                                                           ['cat'] * 2))
+
+    def test_load_save(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'history.json')
+            config = InsnSetConfig([InsnSet.X86_SSE2])
+            history = CompileTimeHistory(path)
+            history.record_overhead(config, 2.0)
+            history.record_chunk(config, ['cat'], 3.0)
+            history.save()
+
+            history = CompileTimeHistory.load(path)
+            self.assertAlmostEqual(2.0, history.get_overhead(config))
+            self.assertAlmostEqual(1.0, history.get_estimate(config, 'cat'))
+
+            # the per-test times of the old format include the overhead
+            with open(path, 'w') as out_f:
+                json.dump({'unknown/sse2/cat': 3.0}, out_f)
+            history = CompileTimeHistory.load(path)
+            self.assertEqual({}, history.seconds_per_test)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_record_splits_by_estimate(self):
+        history = CompileTimeHistory()
+        config = InsnSetConfig([InsnSet.X86_SSE2])
+        history.seconds_per_test = {'unknown/sse2/cat1': 1.0,
+                                    'unknown/sse2/cat2': 3.0}
+        history.overhead_seconds = {'unknown/sse2': 1.0}
+
+        history.record_chunk(config, ['cat1', 'cat2'], 9.0)
+        self.assertAlmostEqual(1.5, history.get_estimate(config, 'cat1'))
+        self.assertAlmostEqual(4.5, history.get_estimate(config, 'cat2'))
+
+    def test_unknown_config_uses_category_average(self):
+        history = CompileTimeHistory()
+        config = InsnSetConfig([InsnSet.X86_AVX])
+        history.seconds_per_test = {'unknown/sse2/cat1': 1.0,
+                                    'unknown/sse3/cat1': 2.0,
+                                    'unknown/sse2/cat2': 5.0}
+
+        self.assertAlmostEqual(1.5, history.get_estimate(config, 'cat1'))
+
+    def test_unknown_category_uses_average(self):
+        history = CompileTimeHistory()
+        config = InsnSetConfig([InsnSet.X86_SSE2])
+        history.seconds_per_test = {'unknown/sse2/cat1': 1.0,
+                                    'unknown/sse2/cat2': 3.0}
+
+        self.assertAlmostEqual(2.0, history.get_estimate(config, 'cat3'))
+
+    def test_compilers(self):
+        gcc = mock.Mock(version='12.2.0', target_arch='x86_64')
+        gcc.name = 'gcc'
+        clang = mock.Mock(version='16.0.0', target_arch='x86_64')
+        clang.name = 'clang'
+        config = InsnSetConfig([InsnSet.X86_SSE2])
+
+        history = CompileTimeHistory(compiler=gcc)
+        history.record_overhead(config, 0.5)
+        history.record_chunk(config, ['cat1'], 1.5)
+        self.assertEqual(['gcc_12.2.0_x86_64/sse2/cat1'],
+                         list(history.seconds_per_test.keys()))
+
+        history.seconds_per_test['clang_16.0.0_x86_64/sse2/cat1'] = 3.0
+        history.seconds_per_test['clang_16.0.0_x86_64/sse2/cat2'] = 3.0
+        history.seconds_per_test['clang_16.0.0_x86_64/avx/cat2'] = 5.0
+        self.assertAlmostEqual(1.0, history.get_estimate(config, 'cat1'))
+        # the other compiler is used only if nothing else is known
+        self.assertAlmostEqual(4.0, history.get_estimate(config, 'cat2'))
+
+        history = CompileTimeHistory(compiler=clang)
+        history.seconds_per_test = {'gcc_12.2.0_x86_64/avx/cat1': 1.0,
+                                    'clang_16.0.0_x86_64/avx/cat1': 3.0}
+        self.assertAlmostEqual(3.0, history.get_estimate(config, 'cat1'))
+
+
+class TestSortChunksLongestFirst(unittest.TestCase):
+
+    def test_sort(self):
+        history = CompileTimeHistory()
+        config_sse2 = InsnSetConfig([InsnSet.X86_SSE2])
+        config_avx = InsnSetConfig([InsnSet.X86_AVX])
+        history.seconds_per_test = {'unknown/sse2/cat': 1.0,
+                                    'unknown/avx/cat': 3.0}
+
+        chunk1 = mock.Mock(config=config_sse2, categories=['cat'] * 4)
+        chunk2 = mock.Mock(config=config_avx, categories=['cat'] * 2)
+        chunk3 = mock.Mock(config=config_sse2, categories=['cat'] * 2)
+        chunk4 = mock.Mock(config=config_avx, categories=['cat'] * 3)
+
+        result = sort_chunks_longest_first([chunk1, chunk2, chunk3, chunk4],
+                                           history)
+        self.assertEqual([chunk4, chunk2, chunk1, chunk3], result)
+
+
+class TestChunkQueue(unittest.TestCase):
+
+    def test_order(self):
+        history = CompileTimeHistory()
+        config = InsnSetConfig([InsnSet.X86_SSE2])
+        history.seconds_per_test = {'sse2/cat': 1.0}
+
+        chunk1 = mock.Mock(config=config, categories=['cat'] * 2)
+        chunk2 = mock.Mock(config=config, categories=['cat'] * 4)
+        half1 = mock.Mock(config=config, categories=['cat'])
+        half2 = mock.Mock(config=config, categories=['cat'])
+        half3 = mock.Mock(config=config, categories=['cat'])
+        chunk3 = mock.Mock(config=config, categories=['cat'] * 3)
+        chunk4 = mock.Mock(config=config, categories=['cat'] * 3)
+
+        queue = ChunkQueue(history)
+        queue.push(chunk1)
+        queue.push(chunk2)
+        queue.push(half2, urgent=True)
+        queue.push(half1, urgent=True)
+        # urgent chunks stay in front of the chunks pushed later
+        queue.push(chunk3)
+        queue.push(chunk4)
+        self.assertEqual(6, len(queue))
+        self.assertIs(half1, queue.pop())
+        queue.push(half3, urgent=True)
+
+        self.assertEqual([half3, half2, chunk2, chunk3, chunk4, chunk1],
+                         [queue.pop() for _ in range(len(queue))])
+
+    def test_remove_if(self):
+        history = CompileTimeHistory()
+        config = InsnSetConfig([InsnSet.X86_SSE2])
+        chunks = [mock.Mock(config=config, categories=['cat'] * (i + 1),
+                            config_index=i % 2) for i in range(5)]
+
+        queue = ChunkQueue(history)
+        for chunk in chunks:
+            queue.push(chunk)
+        removed = queue.remove_if(lambda chunk: chunk.config_index == 1)
+        self.assertEqual([chunks[1], chunks[3]],
+                         sorted(removed, key=chunks.index))
+        self.assertEqual([chunks[4], chunks[2], chunks[0]],
+                         [queue.pop() for _ in range(len(queue))])
+
+
+class TestSplitTestsIntoAdaptiveChunks(unittest.TestCase):
+
+    def test_split(self):
+        history = CompileTimeHistory()
+        config = InsnSetConfig([InsnSet.X86_SSE2])
+        history.seconds_per_test = {'unknown/sse2/cheap': 1.0,
+                                    'unknown/sse2/expensive': 4.0}
+        history.overhead_seconds = {'unknown/sse2': 1.0}
+
+        tests = [('cheap', 1), ('cheap', 2), ('cheap', 3), ('cheap', 4),
+                 ('cheap', 5), ('expensive', 6), ('expensive', 7)]
+
+        result = list(split_tests_into_adaptive_chunks(tests, config, history,
+                                                       5.0, 3))
+        expected = [
+            [('cheap', 1), ('cheap', 2), ('cheap', 3)],
+            [('cheap', 4), ('cheap', 5)],
+            [('expensive', 6)],
+            [('expensive', 7)],
+        ]
+        self.assertEqual(expected, result)
+
+    def test_large_overhead(self):
+        history = CompileTimeHistory()
+        config = InsnSetConfig([InsnSet.X86_SSE2])
+        history.seconds_per_test = {'unknown/sse2/cat': 1.0}
+        history.overhead_seconds = {'unknown/sse2': 10.0}
+
+        tests = [('cat', i) for i in range(5)]
+        result = list(split_tests_into_adaptive_chunks(tests, config, history,
+                                                       4.0, 10))
+        self.assertEqual([2, 2, 1], [len(chunk) for chunk in result])